@@ -0,0 +1,109 @@
+import asyncio
+import aiohttp
+from APIs.http_cache import CachedResponse, CacheMissError, get_http_cache
+from APIs.http_client import HTTPConfig, RETRY_STATUS
+from APIs.rate_limiter import get_rate_limiter
+
+
+class AsyncHTTPClient:
+    """
+    Async version of HTTPClient. Shares the rate limiter and the response cache with the blocking clients,
+    so both count against the same provider budget.
+    The client owns its aiohttp session: inside async with, the requests share one keep-alive session, closed at the
+    end of the block. Outside of one, each request opens and closes its own session, so no session outlives its event loop.
+    Connection errors and 5xx responses are retried like the HTTPAdapter of the blocking client,
+    and the sqlite cache is read and written in a worker thread so it never blocks the event loop.
+    """
+
+    def __init__(self, name: str, rate_limit: float = None, config: HTTPConfig = None):
+        self.name = name
+        self.config = HTTPConfig() if config is None else config
+        self.limiter = get_rate_limiter(name, rate_limit)
+        self.cache = get_http_cache()
+        self.session = None
+        self.loop = None
+
+    @property
+    def offline(self) -> bool:
+        return self.cache is not None and self.cache.offline
+
+    def _new_session(self) -> aiohttp.ClientSession:
+        # The connector keeps the connections alive and bounds the requests in flight
+        connector = aiohttp.TCPConnector(limit=self.config.pool_size * 10, limit_per_host=self.config.pool_size)
+        timeout = aiohttp.ClientTimeout(sock_connect=self.config.connect_timeout, sock_read=self.config.read_timeout)
+        return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+    async def __aenter__(self):
+        if self.session is None or self.session.closed:
+            self.session = self._new_session()
+            self.loop = asyncio.get_running_loop()
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def close(self):
+        session, self.session, self.loop = self.session, None, None
+        if session is not None:
+            await session.close()
+
+    async def _send(self, method: str, url: str, **kwargs) -> CachedResponse:
+        if self.session is not None and not self.session.closed and self.loop is asyncio.get_running_loop():
+            return await self._send_retrying(self.session, method, url, **kwargs)
+        async with self._new_session() as session:
+            return await self._send_retrying(session, method, url, **kwargs)
+
+    async def _send_retrying(self, session: aiohttp.ClientSession, method: str, url: str, **kwargs) -> CachedResponse:
+        """
+        Sends the request, retrying connection errors and 5xx responses with exponential backoff.
+        The last 5xx response is returned, the last connection error is raised.
+        """
+        for attempt in range(self.config.retries + 1):
+            if attempt > 0:
+                await asyncio.sleep(self.config.backoff_factor * 2 ** (attempt - 1))
+            try:
+                async with session.request(method, url, **kwargs) as raw:
+                    response = CachedResponse(url=url, status_code=raw.status, text=await raw.text(), headers=dict(raw.headers), from_cache=False)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if attempt == self.config.retries:
+                    raise
+                continue
+            if response.status_code not in RETRY_STATUS:
+                break
+        return response
+
+    async def request(self, method: str, url: str, cache: bool = True, **kwargs) -> CachedResponse:
+        if self.offline and not cache:
+            raise CacheMissError(f"{self.name} cannot send uncached {method} {url} offline")
+        key = None
+        if cache and self.cache is not None:
+            key = self.cache.key_for(method, url, kwargs.get("params"), kwargs.get("data"))
+            cached = await asyncio.to_thread(self.cache.get, key)
+            if cached is not None:
+                return cached
+            if self.cache.offline:
+                raise CacheMissError(f"{self.name} has no recorded response for {method} {url}")
+
+        response = await self.limiter.request_async(self._send, method, url, **kwargs)
+        if key is not None and response.status_code == 200:
+            await asyncio.to_thread(self.cache.set, key, url, response.status_code, response.text, response.headers)
+        return response
+
+    async def get(self, url: str, cache: bool = True, **kwargs) -> CachedResponse:
+        return await self.request("GET", url, cache=cache, **kwargs)
+
+    async def post(self, url: str, cache: bool = True, **kwargs) -> CachedResponse:
+        return await self.request("POST", url, cache=cache, **kwargs)
+
+
+class AsyncSessionMixin:
+    """
+    async with support of the API clients, closes the session of their async_http client at the end of the block.
+    """
+
+    async def __aenter__(self):
+        await self.async_http.__aenter__()
+        return self
+
+    async def __aexit__(self, *args):
+        await self.async_http.close()
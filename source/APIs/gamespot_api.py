@@ -1,16 +1,21 @@
-import requests
 from dotenv import load_dotenv
 import os
 import xml.etree.ElementTree as ET
 from APIs.api_types import GamespotType
+from APIs.http_client import HTTPClient, HTTPConfig
+from APIs.async_http_client import AsyncHTTPClient, AsyncSessionMixin
 from datetime import datetime
 from urllib.parse import quote_plus
 
 
-class Gamespot:
-    def __init__(self):
+class Gamespot(AsyncSessionMixin):
+    def __init__(self, rate_limit: float = None, http_config: HTTPConfig = None):
         load_dotenv()
         self.api_key = os.getenv("GAMESPOT_API_KEY")
+        self.http = HTTPClient("gamespot", rate_limit, http_config)
+        self.async_http = AsyncHTTPClient("gamespot", rate_limit, http_config)
+        # Set headers for the requests
+        self.headers = {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"}
 
         # Format pattern to get release date 2025-04-24 12:00:00
         self.format_pattern = "%Y-%m-%d %H:%M:%S"
@@ -20,13 +25,22 @@ class Gamespot:
         Searches for games by name and retrieves details.
         Returns a list of GamespotType objects.
         """
-        search_url = f"https://www.gamespot.com/api/games/?limit={max_n}&filter=name:{quote_plus(game_name)}&api_key={self.api_key}"
+        response = self.http.get(self._search_url(game_name, max_n), headers=self.headers)
+        response.raise_for_status()
+        return self._parse_results(response)
 
-        # Set headers for the request
-        headers = {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"}
-        response = requests.get(search_url, headers=headers)
+    async def search_async(self, game_name: str, max_n: int = 1) -> list[GamespotType]:
+        """
+        Async version of search.
+        """
+        response = await self.async_http.get(self._search_url(game_name, max_n), headers=self.headers)
         response.raise_for_status()
+        return self._parse_results(response)
+
+    def _search_url(self, game_name: str, max_n: int) -> str:
+        return f"https://www.gamespot.com/api/games/?limit={max_n}&filter=name:{quote_plus(game_name)}&api_key={self.api_key}"
 
+    def _parse_results(self, response) -> list[GamespotType]:
         if response.status_code != 200:
             print(f"Error: {response.status_code}")
             print(f"Response: {response.text}")
@@ -1,11 +1,17 @@
 from howlongtobeatpy import HowLongToBeat
 from APIs.api_types import HLTBType
+from APIs.rate_limiter import get_rate_limiter
+from APIs.http_cache import CacheMissError, get_http_cache
+from dataclasses import asdict
 from datetime import datetime
+from urllib.parse import urlencode
 
 
 class HLTB:
-    def __init__(self):
+    def __init__(self, rate_limit: float = None):
         self.client = HowLongToBeat()
+        self.limiter = get_rate_limiter("hltb", rate_limit)
+        self.cache = get_http_cache()
 
         # Format pattern to get release date 2025
         self.format_pattern = "%Y"
@@ -15,8 +21,45 @@ class HLTB:
         Searches for games by name on HowLongToBeat.
         Returns a list of HLTBType objects sorted by similarity.
         """
-        results_list = self.client.search(game_name)
+        cached = self._cached(game_name, max_n)
+        if cached is not None:
+            return cached
 
+        results_list = self.limiter.call(self.client.search, game_name)
+        return self._store(game_name, max_n, self._parse_results(results_list, max_n))
+
+    async def search_async(self, game_name: str, max_n: int = 1) -> list[HLTBType]:
+        """
+        Async version of search, using the async search of howlongtobeatpy.
+        """
+        cached = self._cached(game_name, max_n)
+        if cached is not None:
+            return cached
+
+        results_list = await self.limiter.call_async(self.client.async_search, game_name)
+        return self._store(game_name, max_n, self._parse_results(results_list, max_n))
+
+    def _cache_url(self, game_name: str, max_n: int) -> str:
+        # howlongtobeatpy hides the HTTP requests, so the parsed results are cached instead
+        return f"hltb://search?{urlencode({'q': game_name, 'max_n': max_n})}"
+
+    def _cached(self, game_name: str, max_n: int) -> list[HLTBType]:
+        if self.cache is None:
+            return None
+        cached = self.cache.get_json(self.cache.key_for("GET", self._cache_url(game_name, max_n)))
+        if cached is not None:
+            return [HLTBType(**game) for game in cached]
+        if self.cache.offline:
+            raise CacheMissError(f"hltb has no recorded response for {game_name}")
+        return None
+
+    def _store(self, game_name: str, max_n: int, hltb_results: list[HLTBType]) -> list[HLTBType]:
+        if self.cache is not None:
+            cache_url = self._cache_url(game_name, max_n)
+            self.cache.set_json(self.cache.key_for("GET", cache_url), cache_url, [asdict(game) for game in hltb_results])
+        return hltb_results
+
+    def _parse_results(self, results_list: list, max_n: int) -> list[HLTBType]:
         if not results_list or len(results_list) == 0:
             return []
 
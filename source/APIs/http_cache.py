@@ -0,0 +1,217 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+from dataclasses import dataclass, field
+from pathlib import Path
+from threading import Lock
+from time import time
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+import requests
+from dotenv import load_dotenv
+
+DAY = 24 * 60 * 60
+
+# Time to live of each endpoint, the first pattern that matches the url is used. 0 disables the cache
+DEFAULT_TTLS = [
+    (r"id\.twitch\.tv/oauth2", 0),
+    (r"api\.rawg\.io/api/games/\d+", 30 * DAY),
+    (r"api\.rawg\.io/api/games", 7 * DAY),
+    (r"api\.igdb\.com/v4/", 7 * DAY),
+    (r"gamespot\.com/api/reviews", 1 * DAY),
+    (r"gamespot\.com/api/games", 7 * DAY),
+    (r"backend\.metacritic\.com/composer/metacritic/pages/games/", 30 * DAY),
+    (r"backend\.metacritic\.com/finder/", 7 * DAY),
+    (r"backend\.metacritic\.com/reviews/", 1 * DAY),
+    (r"^hltb://", 30 * DAY),
+]
+DEFAULT_TTL = 7 * DAY
+
+# data/cache of the repository root, wherever the scripts are run from
+DEFAULT_PATH = str(Path(__file__).resolve().parents[2] / "data" / "cache" / "http_cache.sqlite")
+
+# Query parameters that hold credentials, they are not part of the key so the fixtures can be shared
+SECRET_PARAMS = {"api_key", "apikey", "key", "client_secret", "client_id"}
+
+
+class CacheMissError(Exception):
+    pass
+
+
+def normalize_url(url: str, params: dict = None) -> str:
+    """
+    Lowercases scheme and host, merges params into the query, sorts it and removes the credentials.
+    """
+    parts = urlsplit(url)
+    query = parse_qsl(parts.query, keep_blank_values=True)
+    if params:
+        query += [(k, str(v)) for k, v in params.items()]
+    query = sorted((k, v) for k, v in query if k.lower() not in SECRET_PARAMS)
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, urlencode(query), ""))
+
+
+@dataclass
+class CachedResponse:
+    """
+    Response served from the cache, with the parts of requests.Response used by the clients.
+    """
+
+    url: str
+    status_code: int
+    text: str
+    headers: dict = field(default_factory=dict)
+    from_cache: bool = True
+
+    @property
+    def ok(self) -> bool:
+        return self.status_code < 400
+
+    @property
+    def content(self) -> bytes:
+        return self.text.encode("utf-8")
+
+    def json(self):
+        return json.loads(self.text)
+
+    def raise_for_status(self):
+        # Only successful responses are cached, errors come from the async client
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} Error for url: {self.url}", response=self)
+
+
+class HTTPCache:
+    """
+    Disk backed response cache shared by all the API clients.
+    Entries are keyed by the normalized request, expire by endpoint TTL and are evicted by least recent use
+    when the file grows over max_size_mb. In offline mode expired entries are still served and misses raise
+    CacheMissError, so a recorded cache works as a fixture for running the pipeline without network.
+    """
+
+    def __init__(self, path: str = DEFAULT_PATH, max_size_mb: float = 1024, ttls: list = None, default_ttl: float = DEFAULT_TTL, offline: bool = False):
+        self.path = path
+        self.max_size = int(max_size_mb * 1024 * 1024)
+        self.ttls = [(re.compile(pattern), ttl) for pattern, ttl in (DEFAULT_TTLS if ttls is None else ttls)]
+        self.default_ttl = default_ttl
+        self.offline = offline
+        self.hits = 0
+        self.misses = 0
+        self.lock = Lock()
+
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                url TEXT,
+                status INTEGER,
+                headers TEXT,
+                body TEXT,
+                size INTEGER,
+                created REAL,
+                accessed REAL,
+                expires REAL
+            )
+            """
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        self.size = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def key_for(self, method: str, url: str, params: dict = None, data=None) -> str:
+        """
+        Normalizes the request (method, host case, sorted query without credentials, body) into a key.
+        """
+        normalized_url = normalize_url(url, params)
+        if isinstance(data, bytes):
+            data = data.decode("utf-8")
+        body = " ".join(data.split()) if isinstance(data, str) else json.dumps(data, sort_keys=True)
+        return hashlib.sha256(f"{method.upper()} {normalized_url} {body}".encode("utf-8")).hexdigest()
+
+    def ttl_for(self, url: str) -> float:
+        for pattern, ttl in self.ttls:
+            if pattern.search(url):
+                return ttl
+        return self.default_ttl
+
+    def get(self, key: str) -> CachedResponse:
+        """
+        Returns the cached response or None when it is missing or expired.
+        """
+        now = time()
+        with self.lock:
+            row = self.db.execute("SELECT url, status, headers, body, expires FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or (row[4] < now and not self.offline):
+                self.misses += 1
+                return None
+            self.db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self.hits += 1
+        url, status, headers, body, _ = row
+        return CachedResponse(url=url, status_code=status, text=body, headers=json.loads(headers))
+
+    def set(self, key: str, url: str, status_code: int, text: str, headers: dict = None):
+        ttl = self.ttl_for(url)
+        if ttl <= 0:
+            return
+        now = time()
+        url = normalize_url(url)
+        headers = json.dumps(dict(headers or {}))
+        size = len(text) + len(headers) + len(url)
+        with self.lock:
+            old = self.db.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self.db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, url, status_code, headers, text, size, now, now, now + ttl),
+            )
+            self.size += size - (old[0] if old else 0)
+            self._evict()
+
+    def get_json(self, key: str):
+        cached = self.get(key)
+        return None if cached is None else cached.json()
+
+    def set_json(self, key: str, url: str, value):
+        self.set(key, url, 200, json.dumps(value))
+
+    def _evict(self):
+        # Remove the least recently used entries until the cache fits again
+        while self.size > self.max_size:
+            rows = self.db.execute("SELECT key, size FROM responses ORDER BY accessed LIMIT 100").fetchall()
+            if not rows:
+                self.size = 0
+                break
+            for key, size in rows:
+                self.db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.size -= size
+                if self.size <= self.max_size:
+                    break
+
+    def clear(self):
+        with self.lock:
+            self.db.execute("DELETE FROM responses")
+            self.size = 0
+
+
+_cache = None
+_cache_lock = Lock()
+
+
+def get_http_cache() -> HTTPCache:
+    """
+    Returns the cache shared by the clients, or None when HTTP_CACHE=off in the env file.
+    HTTP_CACHE=offline serves only recorded responses, HTTP_CACHE_PATH and HTTP_CACHE_SIZE_MB set the file and its bound.
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            load_dotenv()
+            mode = os.getenv("HTTP_CACHE", "on").lower()
+            if mode == "off":
+                return None
+            _cache = HTTPCache(
+                path=os.getenv("HTTP_CACHE_PATH", DEFAULT_PATH),
+                max_size_mb=float(os.getenv("HTTP_CACHE_SIZE_MB", "1024")),
+                offline=mode == "offline",
+            )
+        return _cache
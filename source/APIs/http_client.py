@@ -0,0 +1,81 @@
+from dataclasses import dataclass
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from APIs.http_cache import CacheMissError, get_http_cache
+from APIs.rate_limiter import get_rate_limiter
+
+# Server errors retried by the HTTP clients
+RETRY_STATUS = [500, 502, 503, 504]
+
+
+@dataclass
+class HTTPConfig:
+    pool_size: int = 10
+    connect_timeout: float = 5.0
+    read_timeout: float = 30.0
+    # Retries of connection errors and 5xx responses, throttling is handled by the rate limiter
+    retries: int = 3
+    backoff_factor: float = 0.5
+
+
+class HTTPClient:
+    """
+    HTTP access of a provider: answers from the response cache when possible,
+    otherwise sends the request through the provider rate limiter on a pooled keep-alive session
+    and stores the response.
+    """
+
+    def __init__(self, name: str, rate_limit: float = None, config: HTTPConfig = None):
+        self.name = name
+        self.config = HTTPConfig() if config is None else config
+        self.limiter = get_rate_limiter(name, rate_limit)
+        self.cache = get_http_cache()
+        self.session = self._create_session()
+
+    def _create_session(self) -> requests.Session:
+        retry = Retry(
+            total=self.config.retries,
+            backoff_factor=self.config.backoff_factor,
+            status_forcelist=RETRY_STATUS,
+            allowed_methods=None,
+            raise_on_status=False,
+            respect_retry_after_header=False,
+        )
+        adapter = HTTPAdapter(pool_connections=self.config.pool_size, pool_maxsize=self.config.pool_size, max_retries=retry)
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    @property
+    def offline(self) -> bool:
+        return self.cache is not None and self.cache.offline
+
+    def request(self, method: str, url: str, cache: bool = True, **kwargs):
+        if self.offline and not cache:
+            raise CacheMissError(f"{self.name} cannot send uncached {method} {url} offline")
+        key = None
+        if cache and self.cache is not None:
+            key = self.cache.key_for(method, url, kwargs.get("params"), kwargs.get("data"))
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+            if self.cache.offline:
+                raise CacheMissError(f"{self.name} has no recorded response for {method} {url}")
+
+        kwargs.setdefault("timeout", (self.config.connect_timeout, self.config.read_timeout))
+        response = self.limiter.request(self.session.request, method, url, **kwargs)
+
+        if key is not None and response.status_code == 200:
+            self.cache.set(key, url, response.status_code, response.text, response.headers)
+        return response
+
+    def get(self, url: str, cache: bool = True, **kwargs):
+        return self.request("GET", url, cache=cache, **kwargs)
+
+    def post(self, url: str, cache: bool = True, **kwargs):
+        return self.request("POST", url, cache=cache, **kwargs)
+
+    def close(self):
+        self.session.close()
@@ -1,18 +1,38 @@
+import asyncio
 import os
-import requests
+import weakref
 from dotenv import load_dotenv
 from APIs.api_types import IGDBType
+from APIs.http_client import HTTPClient, HTTPConfig
+from APIs.async_http_client import AsyncHTTPClient, AsyncSessionMixin
 import datetime
+from threading import Lock
+from time import monotonic
 from urllib.parse import quote
 
+FIELDS = "name, game_modes.name, game_type.type, keywords.name, language_supports.language.name, platforms.name, player_perspectives.name, themes.name, rating, summary, first_release_date, genres.name, cover.url"
+# Limits of the IGDB API: sub-queries in a multiquery and results of a query
+MULTIQUERY_SIZE = 10
+ID_QUERY_SIZE = 500
 
-class IGDB:
-    def __init__(self):
+AUTH_URL = "https://id.twitch.tv/oauth2/token"
+GAMES_URL = "https://api.igdb.com/v4/games"
+MULTIQUERY_URL = "https://api.igdb.com/v4/multiquery"
+
+
+class IGDB(AsyncSessionMixin):
+    def __init__(self, rate_limit: float = None, http_config: HTTPConfig = None):
         load_dotenv()
         self.client_id = os.getenv("IGDB_CLIENT_ID")
         self.client_secret = os.getenv("IGDB_CLIENT_SECRET")
         self.access_token = None
-        
+        self.token_expires = 0.0
+        self.token_lock = Lock()
+        # asyncio locks belong to one event loop, one per loop
+        self.async_token_locks = weakref.WeakKeyDictionary()
+        self.http = HTTPClient("igdb", rate_limit, http_config)
+        self.async_http = AsyncHTTPClient("igdb", rate_limit, http_config)
+
         # Format pattern to get release date 2025-04-24 00:00:00+00:00
         self.format_pattern = "%Y-%m-%d %H:%M:%S+00:00"
 
@@ -20,68 +40,187 @@ class IGDB:
         """
         Authenticates with Twitch to get the Bearer Token required for IGDB.
         """
-        auth_url = "https://id.twitch.tv/oauth2/token"
-        params = {
+        response = self.http.post(AUTH_URL, params=self._auth_params(), cache=False)
+        return self._store_token(response)
+
+    async def _get_access_token_async(self):
+        response = await self.async_http.post(AUTH_URL, params=self._auth_params(), cache=False)
+        return self._store_token(response)
+
+    def _auth_params(self) -> dict:
+        return {
             "client_id": self.client_id,
             "client_secret": self.client_secret,
             "grant_type": "client_credentials",
         }
 
-        response = requests.post(auth_url, params=params)
-
+    def _store_token(self, response) -> str:
         if response.status_code != 200:
             raise Exception(f"Authentication failed: {response.text}")
 
-        self.access_token = response.json()["access_token"]
+        token_data = response.json()
+        self.access_token = token_data["access_token"]
+        # Renew one minute before Twitch expires it
+        self.token_expires = monotonic() + token_data.get("expires_in", 3600) - 60
         return self.access_token
 
-    def search(self, game_name: str, max_n: int = 1) -> list[IGDBType]:
-        """
-        Searches for games by name and retrieves details.
-        Returns a list of IGDBType objects.
-        """
-        if not self.access_token:
-            self._get_access_token()
-
-        url = "https://api.igdb.com/v4/games"
+    def _needs_token(self, rejected: str = None) -> bool:
+        # Cached responses do not need the token. A rejected token is only renewed if no one renewed it since
+        return not self.http.offline and (not self.access_token or monotonic() >= self.token_expires or (rejected is not None and self.access_token == rejected))
 
-        headers = {
+    def _auth_headers(self) -> dict:
+        return {
             "Client-ID": self.client_id,
             "Authorization": f"Bearer {self.access_token}",
             "Content-Type": "text/plain",
         }
 
-        body = f"""
-            fields name, game_modes.name, game_type.type, keywords.name, language_supports.language.name, platforms.name, player_perspectives.name, themes.name, rating, summary, first_release_date, genres.name, cover.url;
-            search "{quote(game_name)}";
-            limit {max_n};
+    def _headers(self, rejected: str = None) -> dict:
+        """
+        Returns the IGDB headers, renewing the Bearer Token when it expired or it is the rejected one.
         """
+        with self.token_lock:
+            if self._needs_token(rejected):
+                self._get_access_token()
+            return self._auth_headers()
 
-        response = requests.post(url, headers=headers, data=body)
+    async def _headers_async(self, rejected: str = None) -> dict:
+        """
+        Async version of _headers. The coroutines of a gather wait for the first one to renew the token
+        and check again, so a cold or expired token is renewed once.
+        """
+        loop = asyncio.get_running_loop()
+        lock = self.async_token_locks.setdefault(loop, asyncio.Lock())
+        async with lock:
+            if self._needs_token(rejected):
+                await self._get_access_token_async()
+            return self._auth_headers()
 
+    def _query(self, url: str, body: str):
+        headers = self._headers()
+        response = self.http.post(url, headers=headers, data=body)
+        # The token may be revoked before its expiration
+        if response.status_code == 401:
+            response = self.http.post(url, headers=self._headers(rejected=self._token_of(headers)), data=body)
         if response.status_code != 200:
             raise Exception(f"IGDB Query failed: {response.text}")
+        return response.json()
 
-        results = response.json()
-        igdb_results = []
+    @staticmethod
+    def _token_of(headers: dict) -> str:
+        return headers["Authorization"].removeprefix("Bearer ")
 
-        for game in results:
-            igdb_obj = IGDBType(
-                id=game.get("id"),
-                name=game.get("name"),
-                game_modes=[g["name"] for g in game.get("game_modes", [])],
-                game_type=game.get("game_type", {}).get("type"),
-                keywords=[g["name"] for g in game.get("keywords", [])],
-                language_supports=[g["language"]["name"] for g in game.get("language_supports", [])],
-                platforms=[g["name"] for g in game.get("platforms", [])],
-                player_perspectives=[g["name"] for g in game.get("player_perspectives", [])],
-                themes=[g["name"] for g in game.get("themes", [])],
-                igdb_rating=float(game.get("rating")) / 100. if game.get("rating") else 0.0,
-                release=datetime.datetime.fromtimestamp(int(game.get("first_release_date", "0")), datetime.timezone.utc).strftime("%Y-%m-%d"),
-                genres=[g["name"] for g in game.get("genres", [])],
-                cover_url=[game.get("cover", {}).get("url")],
-                description=game.get("summary"),
-            )
-            igdb_results.append(igdb_obj)
+    async def _query_async(self, url: str, body: str):
+        headers = await self._headers_async()
+        response = await self.async_http.post(url, headers=headers, data=body)
+        if response.status_code == 401:
+            response = await self.async_http.post(url, headers=await self._headers_async(rejected=self._token_of(headers)), data=body)
+        if response.status_code != 200:
+            raise Exception(f"IGDB Query failed: {response.text}")
+        return response.json()
+
+    def search(self, game_name: str, max_n: int = 1) -> list[IGDBType]:
+        """
+        Searches for games by name and retrieves details.
+        Returns a list of IGDBType objects.
+        """
+        results = self._query(GAMES_URL, self._search_body(game_name, max_n))
+        return [self._parse_game(game) for game in results]
 
+    async def search_async(self, game_name: str, max_n: int = 1) -> list[IGDBType]:
+        """
+        Async version of search.
+        """
+        results = await self._query_async(GAMES_URL, self._search_body(game_name, max_n))
+        return [self._parse_game(game) for game in results]
+
+    def search_many(self, game_names: list[str], max_n: int = 1) -> list[list[IGDBType]]:
+        """
+        Searches many games packing up to MULTIQUERY_SIZE searches in each multiquery request.
+        Returns a list of IGDBType lists in the same order as game_names.
+        """
+        igdb_results = []
+        for batch in self._batches(game_names, MULTIQUERY_SIZE):
+            results = self._query(MULTIQUERY_URL, self._multiquery_body(batch, max_n))
+            igdb_results += self._parse_multiquery(results, len(batch))
         return igdb_results
+
+    async def search_many_async(self, game_names: list[str], max_n: int = 1) -> list[list[IGDBType]]:
+        """
+        Async version of search_many, the multiqueries are sent concurrently.
+        """
+        batches = self._batches(game_names, MULTIQUERY_SIZE)
+        results = await asyncio.gather(*[self._query_async(MULTIQUERY_URL, self._multiquery_body(batch, max_n)) for batch in batches])
+        return [games for batch, batch_results in zip(batches, results) for games in self._parse_multiquery(batch_results, len(batch))]
+
+    def get_many(self, game_ids: list[int]) -> list[IGDBType]:
+        """
+        Retrieves the details of many games by id, up to ID_QUERY_SIZE in each request.
+        Returns a list of IGDBType objects in the same order as game_ids, None when the id is not found.
+        """
+        games_by_id = {}
+        for batch in self._batches(game_ids, ID_QUERY_SIZE):
+            for game in self._query(GAMES_URL, self._ids_body(batch)):
+                games_by_id[game.get("id")] = self._parse_game(game)
+        return [games_by_id.get(int(game_id)) for game_id in game_ids]
+
+    async def get_many_async(self, game_ids: list[int]) -> list[IGDBType]:
+        """
+        Async version of get_many, used to hydrate recommendations without blocking.
+        """
+        batches = self._batches(game_ids, ID_QUERY_SIZE)
+        results = await asyncio.gather(*[self._query_async(GAMES_URL, self._ids_body(batch)) for batch in batches])
+        games_by_id = {game.get("id"): self._parse_game(game) for batch_results in results for game in batch_results}
+        return [games_by_id.get(int(game_id)) for game_id in game_ids]
+
+    def _batches(self, items: list, size: int) -> list[list]:
+        return [items[start : start + size] for start in range(0, len(items), size)]
+
+    def _search_body(self, game_name: str, max_n: int) -> str:
+        return f"""
+            fields {FIELDS};
+            search "{quote(game_name)}";
+            limit {max_n};
+        """
+
+    def _multiquery_body(self, game_names: list[str], max_n: int) -> str:
+        # Sub-queries are named by their position in the batch
+        return "".join(
+            f"""
+            query games "{i}" {{
+                fields {FIELDS};
+                search "{quote(game_name)}";
+                limit {max_n};
+            }};
+            """
+            for i, game_name in enumerate(game_names)
+        )
+
+    def _ids_body(self, game_ids: list[int]) -> str:
+        return f"""
+            fields {FIELDS};
+            where id = ({", ".join(str(int(game_id)) for game_id in game_ids)});
+            limit {len(game_ids)};
+        """
+
+    def _parse_multiquery(self, results: list, n: int) -> list[list[IGDBType]]:
+        results_by_name = {item["name"]: item.get("result", []) for item in results}
+        return [[self._parse_game(game) for game in results_by_name.get(str(i), [])] for i in range(n)]
+
+    def _parse_game(self, game: dict) -> IGDBType:
+        return IGDBType(
+            id=game.get("id"),
+            name=game.get("name"),
+            game_modes=[g["name"] for g in game.get("game_modes", [])],
+            game_type=game.get("game_type", {}).get("type"),
+            keywords=[g["name"] for g in game.get("keywords", [])],
+            language_supports=[g["language"]["name"] for g in game.get("language_supports", [])],
+            platforms=[g["name"] for g in game.get("platforms", [])],
+            player_perspectives=[g["name"] for g in game.get("player_perspectives", [])],
+            themes=[g["name"] for g in game.get("themes", [])],
+            igdb_rating=float(game.get("rating")) / 100. if game.get("rating") else 0.0,
+            release=datetime.datetime.fromtimestamp(int(game.get("first_release_date", "0")), datetime.timezone.utc).strftime("%Y-%m-%d"),
+            genres=[g["name"] for g in game.get("genres", [])],
+            cover_url=[game.get("cover", {}).get("url")],
+            description=game.get("summary"),
+        )
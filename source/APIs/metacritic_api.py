@@ -1,15 +1,19 @@
+import asyncio
 from dotenv import load_dotenv
 import os
-import requests
 from APIs.api_types import MetacriticType
+from APIs.http_client import HTTPClient, HTTPConfig
+from APIs.async_http_client import AsyncHTTPClient, AsyncSessionMixin
 from difflib import SequenceMatcher
 from urllib.parse import quote
 
 
-class Metacritic:
-    def __init__(self):
+class Metacritic(AsyncSessionMixin):
+    def __init__(self, rate_limit: float = None, http_config: HTTPConfig = None):
         load_dotenv()
         self.api_key = os.getenv("METACRITIC_API_KEY")
+        self.http = HTTPClient("metacritic", rate_limit, http_config)
+        self.async_http = AsyncHTTPClient("metacritic", rate_limit, http_config)
 
     def _score_ratio(self, score_obj: dict):
         score = score_obj.get("score", 0)
@@ -18,62 +22,107 @@ class Metacritic:
         den = 1 if max is None else max
         return float(num) / float(den)
 
-    def search(self, game_name: str, max_n: int = 1) -> list[MetacriticType]:
+    def search(self, game_name: str, max_n: int = 1, year: int = None) -> list[MetacriticType]:
         """
         Searches for games by name and retrieves details.
+        The finder hits are ranked by name similarity (and release year when given) and the details are fetched
+        in that order, stopping when max_n games are found.
         Returns a list of MetacriticType objects.
         """
         # Find name of the game in the Metacritic API
-        find_url = f"https://backend.metacritic.com/finder/metacritic/search/{quote(game_name)}/web?apiKey={self.api_key}&limit={max_n+5}&offset=0"
-        find_response = requests.get(find_url)
+        find_response = self.http.get(self._find_url(game_name, max_n))
         find_response.raise_for_status()
-        find_data = find_response.json()
-
-        # No result found
-        if not "data" in find_data:
-            return []
+        candidates = self._candidates(find_response.json(), game_name, year)
 
         # Start the return array
         metacritic_results = []
-        for item in find_data["data"]["items"]:
-            if item["type"] == "game-title":
-                # Match between names
-                name_ratio = SequenceMatcher(None, item["title"], game_name).ratio()
+        for game_slug in candidates:
+            # Get game metadata
+            game_response = self.http.get(self._game_url(game_slug))
+            game_response.raise_for_status()
+            metacritic_obj = self._parse_game(game_response.json(), game_slug)
+            if metacritic_obj is not None:
+                metacritic_results.append(metacritic_obj)
+                if len(metacritic_results) == max_n:
+                    break
+
+        return metacritic_results
 
-                # Get game metadata
-                game_slug = item["slug"]
-                game_url = f"https://backend.metacritic.com/composer/metacritic/pages/games/{game_slug}/web?contentOnly=true"
-                game_response = requests.get(game_url)
+    async def search_async(self, game_name: str, max_n: int = 1, year: int = None) -> list[MetacriticType]:
+        """
+        Async version of search, the details of the best max_n candidates left are fetched concurrently.
+        """
+        find_response = await self.async_http.get(self._find_url(game_name, max_n))
+        find_response.raise_for_status()
+        candidates = self._candidates(find_response.json(), game_name, year)
+
+        metacritic_results = []
+        while len(candidates) > 0 and len(metacritic_results) < max_n:
+            batch = candidates[: max_n - len(metacritic_results)]
+            candidates = candidates[len(batch) :]
+            game_responses = await asyncio.gather(*[self.async_http.get(self._game_url(game_slug)) for game_slug in batch])
+            for game_slug, game_response in zip(batch, game_responses):
                 game_response.raise_for_status()
-                game_data = game_response.json()
+                metacritic_obj = self._parse_game(game_response.json(), game_slug)
+                if metacritic_obj is not None:
+                    metacritic_results.append(metacritic_obj)
 
-                if not "components" in game_data or len(game_data["components"]) < 8:
-                    continue
-                if not "data" in game_data["components"][0]:
-                    continue
-                if not "data" in game_data["components"][6]:
-                    continue
-                if not "data" in game_data["components"][8]:
-                    continue
+        return metacritic_results
 
-                metadata = game_data["components"][0]["data"]["item"]
-                critics_score = self._score_ratio(game_data["components"][6]["data"]["item"])
-                user_score = self._score_ratio(game_data["components"][8]["data"]["item"])
+    def _find_url(self, game_name: str, max_n: int) -> str:
+        return f"https://backend.metacritic.com/finder/metacritic/search/{quote(game_name)}/web?apiKey={self.api_key}&limit={max_n+5}&offset=0"
 
-                metacritic_obj = MetacriticType(
-                    name=metadata.get("title"),
-                    release=metadata.get("releaseDate", ""),
-                    developers=[company["name"] for company in metadata.get("production", {}).get("companies", []) if company["typeName"] == "Developer"],
-                    publishers=[company["name"] for company in metadata.get("production", {}).get("companies", []) if company["typeName"] == "Publisher"],
-                    genres=[genre["name"] for genre in metadata.get("genres", [])],
-                    platforms=[platform["name"] for platform in metadata.get("platforms", [])],
-                    metacritic_rating=critics_score,
-                    user_rating=user_score,
-                )
-                metacritic_results.append((metacritic_obj, name_ratio))
+    def _game_url(self, game_slug: str) -> str:
+        return f"https://backend.metacritic.com/composer/metacritic/pages/games/{game_slug}/web?contentOnly=true"
+
+    def _candidates(self, find_data: dict, game_name: str, year: int = None) -> list[str]:
+        """
+        Returns the slugs of the games found by the finder, best name ratio first.
+        With a year, the games released more than one year apart go after the others.
+        """
+        # No result found
+        if not "data" in find_data:
+            return []
+        candidates = []
+        for item in find_data["data"]["items"]:
+            if item["type"] != "game-title":
+                continue
+            ratio = SequenceMatcher(None, item["title"], game_name).ratio()
+            item_year = item.get("premiereYear") or str(item.get("releaseDate") or "")[:4]
+            far = year is not None and str(item_year).isdigit() and abs(int(item_year) - int(year)) > 1
+            candidates.append((far, -ratio, item["slug"]))
+        return [slug for _, _, slug in sorted(candidates, key=lambda x: x[:2])]
+
+    def _component(self, game_data: dict, name: str, position: int) -> dict:
+        """
+        Returns the data item of the page component with the given name, or None when it is missing.
+        Pages without component names fall back to the position the component used to have.
+        """
+        components = game_data.get("components", [])
+        for component in components:
+            meta = component.get("meta") or {}
+            if name in (meta.get("componentName"), meta.get("componentType")) and "data" in component:
+                return component["data"].get("item")
+        if position < len(components) and not components[position].get("meta") and "data" in components[position]:
+            return components[position]["data"].get("item")
+        return None
 
-        # Sort by ratio of the name
-        sorted_data = sorted(metacritic_results, key=lambda x: x[1], reverse=True)
+    def _parse_game(self, game_data: dict, game_slug: str = "") -> MetacriticType:
+        metadata = self._component(game_data, "product", 0)
+        if metadata is None:
+            return None
+        # A game without scores yet is still valid
+        critics_score = self._component(game_data, "critic-score-summary", 6)
+        user_score = self._component(game_data, "user-score-summary", 8)
 
-        # Only return the max_n results
-        return [obj for obj, ratio in sorted_data][:max_n]
+        return MetacriticType(
+            name=metadata.get("title"),
+            release=metadata.get("releaseDate", ""),
+            developers=[company["name"] for company in metadata.get("production", {}).get("companies", []) if company["typeName"] == "Developer"],
+            publishers=[company["name"] for company in metadata.get("production", {}).get("companies", []) if company["typeName"] == "Publisher"],
+            genres=[genre["name"] for genre in metadata.get("genres", [])],
+            platforms=[platform["name"] for platform in metadata.get("platforms", [])],
+            metacritic_rating=0.0 if critics_score is None else self._score_ratio(critics_score),
+            user_rating=0.0 if user_score is None else self._score_ratio(user_score),
+            slug=game_slug,
+        )
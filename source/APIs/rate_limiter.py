@@ -0,0 +1,246 @@
+import asyncio
+import os
+import random
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from threading import Lock
+from time import monotonic, sleep, time
+from dotenv import load_dotenv
+
+# Requests per second allowed for each provider, overridable with <NAME>_RATE_LIMIT in the env file
+RATE_LIMITS = {
+    "gamespot": 1.0,
+    "rawg": 5.0,
+    "igdb": 4.0,
+    "metacritic": 2.0,
+    "hltb": 1.0,
+}
+
+# Status codes used by the providers to say that the client is going too fast
+THROTTLE_STATUS = {420, 429}
+THROTTLE_KEYWORDS = ["rate limit", "429", "420", "too many requests", "quota"]
+
+
+class RateLimitError(Exception):
+    pass
+
+
+@dataclass
+class RateLimitStats:
+    requests: int = 0
+    throttled: int = 0
+    wait_time: float = 0.0
+    backoff_time: float = 0.0
+
+
+class RateLimiter:
+    """
+    Token bucket limiter with exponential backoff for a single provider.
+    Thread safe, so the same provider can be shared by many workers.
+    """
+
+    def __init__(self, name: str, rate: float = 1.0, burst: int = 1, max_retries: int = 5, base_backoff: float = 1.0, max_backoff: float = 120.0):
+        self.name = name
+        self.rate = rate
+        self.interval = 1.0 / rate
+        self.tolerance = (burst - 1) * self.interval
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.stats = RateLimitStats()
+        self.lock = Lock()
+        # Theoretical arrival time of the next request and the end of the current backoff
+        self.next_request = 0.0
+        self.blocked_until = 0.0
+        self.attempts = 0
+
+    def reserve(self) -> float:
+        """
+        Takes a token from the bucket and returns how many seconds the caller must wait to use it.
+        """
+        with self.lock:
+            now = monotonic()
+            start = max(now, self.next_request - self.tolerance, self.blocked_until)
+            self.next_request = max(self.next_request, start) + self.interval
+            delay = start - now
+            self.stats.requests += 1
+            self.stats.wait_time += delay
+            return delay
+
+    def acquire(self):
+        delay = self.reserve()
+        if delay > 0:
+            sleep(delay)
+
+    async def acquire_async(self):
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def backoff(self, retry_after: float = None) -> float:
+        """
+        Blocks the provider after a throttled response.
+        Uses retry_after when the provider sent it, exponential backoff with jitter otherwise.
+        """
+        with self.lock:
+            self.attempts += 1
+            if retry_after is None:
+                retry_after = min(self.max_backoff, self.base_backoff * 2 ** (self.attempts - 1))
+                retry_after *= random.uniform(0.5, 1.0)
+            self.blocked_until = max(self.blocked_until, monotonic() + retry_after)
+            self.stats.throttled += 1
+            self.stats.backoff_time += retry_after
+            return retry_after
+
+    def success(self, headers: dict = None):
+        with self.lock:
+            self.attempts = 0
+        if headers is None:
+            return
+        # Wait for the window reset when the provider tells there are no requests left
+        remaining = _header_float(headers, ["X-RateLimit-Remaining", "RateLimit-Remaining", "Ratelimit-Remaining"])
+        reset = _header_float(headers, ["X-RateLimit-Reset", "RateLimit-Reset", "Ratelimit-Reset"])
+        if remaining is not None and remaining <= 0 and reset is not None:
+            # Some providers send an epoch instead of the seconds left
+            wait = reset - time() if reset > 1e9 else reset
+            if wait > 0:
+                with self.lock:
+                    self.blocked_until = max(self.blocked_until, monotonic() + min(wait, self.max_backoff))
+
+    def _accept_response(self, response) -> bool:
+        """
+        True when the response is not throttled, otherwise backs off (Retry-After or exponential) before the retry.
+        Shared by request and request_async so both handle throttling the same way.
+        """
+        if response.status_code not in THROTTLE_STATUS:
+            self.success(response.headers)
+            return True
+        delay = self.backoff(retry_after_seconds(response.headers))
+        print(f"{self.name} rate limited ({response.status_code}), waiting {delay:.1f} seconds")
+        return False
+
+    def request(self, send, *args, **kwargs):
+        """
+        Calls send (requests.get, session.post, ...) respecting the rate limit.
+        Throttled responses are retried after backing off, the last one raises RateLimitError.
+        """
+        for _ in range(self.max_retries + 1):
+            self.acquire()
+            response = send(*args, **kwargs)
+            if self._accept_response(response):
+                return response
+        raise RateLimitError(f"{self.name} rate limit exceeded after {self.max_retries} retries")
+
+    async def request_async(self, send, *args, **kwargs):
+        """
+        Async version of request, send must be a coroutine function returning a response with status_code and headers.
+        """
+        for _ in range(self.max_retries + 1):
+            await self.acquire_async()
+            response = await send(*args, **kwargs)
+            if self._accept_response(response):
+                return response
+        raise RateLimitError(f"{self.name} rate limit exceeded after {self.max_retries} retries")
+
+    def call(self, func, *args, **kwargs):
+        """
+        Same as request for clients that do not expose the HTTP response, like howlongtobeatpy.
+        Throttling is detected by the error message.
+        """
+        for _ in range(self.max_retries + 1):
+            self.acquire()
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                if not is_rate_limit_error(e):
+                    raise
+                delay = self.backoff()
+                print(f"{self.name} rate limited ({e}), waiting {delay:.1f} seconds")
+                continue
+            self.success()
+            return result
+        raise RateLimitError(f"{self.name} rate limit exceeded after {self.max_retries} retries")
+
+    async def call_async(self, func, *args, **kwargs):
+        """
+        Async version of call, func must be a coroutine function.
+        """
+        for _ in range(self.max_retries + 1):
+            await self.acquire_async()
+            try:
+                result = await func(*args, **kwargs)
+            except Exception as e:
+                if not is_rate_limit_error(e):
+                    raise
+                delay = self.backoff()
+                print(f"{self.name} rate limited ({e}), waiting {delay:.1f} seconds")
+                continue
+            self.success()
+            return result
+        raise RateLimitError(f"{self.name} rate limit exceeded after {self.max_retries} retries")
+
+
+def _header_float(headers: dict, names: list) -> float:
+    for name in names:
+        value = headers.get(name)
+        if value is None:
+            continue
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return None
+
+
+def retry_after_seconds(headers: dict) -> float:
+    """
+    Parses the Retry-After header, which is either a number of seconds or an HTTP date.
+    """
+    value = headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+def is_rate_limit_error(e: Exception) -> bool:
+    error_msg = str(e).lower()
+    return isinstance(e, RateLimitError) or any(keyword in error_msg for keyword in THROTTLE_KEYWORDS)
+
+
+_limiters = {}
+_limiters_lock = Lock()
+
+
+def get_rate_limiter(name: str, rate: float = None) -> RateLimiter:
+    """
+    Returns the limiter shared by every client of the provider.
+    The rate comes from the argument, then <NAME>_RATE_LIMIT in the env file, then RATE_LIMITS.
+    The budget is set by the first call, a later rate that differs from it raises ValueError
+    instead of being silently ignored, so clients should leave rate to the configuration.
+    """
+    with _limiters_lock:
+        if name not in _limiters:
+            load_dotenv()
+            if rate is None:
+                env_rate = os.getenv(f"{name.upper()}_RATE_LIMIT")
+                rate = float(env_rate) if env_rate else RATE_LIMITS.get(name, 1.0)
+            _limiters[name] = RateLimiter(name, rate)
+        elif rate is not None and float(rate) != _limiters[name].rate:
+            raise ValueError(f"The {name} rate limiter already runs at {_limiters[name].rate} requests/s, cannot use {rate}")
+        return _limiters[name]
+
+
+def rate_limit_stats() -> dict:
+    """
+    Returns the counters of every provider to tune their budgets.
+    """
+    with _limiters_lock:
+        return {name: limiter.stats for name, limiter in _limiters.items()}
@@ -1,23 +1,25 @@
+import asyncio
 from dotenv import load_dotenv
 import os
-import requests
 from APIs.api_types import RAWGType
+from APIs.http_client import HTTPClient, HTTPConfig
+from APIs.async_http_client import AsyncHTTPClient, AsyncSessionMixin
 from urllib.parse import quote_plus
 
 
-class RAWG:
-    def __init__(self):
+class RAWG(AsyncSessionMixin):
+    def __init__(self, rate_limit: float = None, http_config: HTTPConfig = None):
         load_dotenv()
         self.api_key = os.getenv("RAWG_API_KEY")
+        self.http = HTTPClient("rawg", rate_limit, http_config)
+        self.async_http = AsyncHTTPClient("rawg", rate_limit, http_config)
 
     def search(self, game_name: str, max_n: int = 1) -> list[RAWGType]:
         """
         Searches for games by name and retrieves details.
         Returns a list of RAWGType objects.
         """
-        search_url = f"https://api.rawg.io/api/games?search={quote_plus(game_name)}&key={self.api_key}"
-
-        response = requests.get(search_url)
+        response = self.http.get(self._search_url(game_name))
         response.raise_for_status()
 
         search_results = response.json().get("results", [])
@@ -28,28 +30,48 @@ class RAWG:
         # Get details for top max_n results
         rawg_results = []
         for game_summary in search_results[:max_n]:
-            game_id = game_summary.get("id")
-            details_url = f"https://api.rawg.io/api/games/{game_id}?key={self.api_key}"
+            details_response = self.http.get(self._details_url(game_summary.get("id")))
+            details_response.raise_for_status()
+            rawg_results.append(self._parse_game(details_response.json()))
+
+        return rawg_results
+
+    async def search_async(self, game_name: str, max_n: int = 1) -> list[RAWGType]:
+        """
+        Async version of search, the details of the top max_n results are fetched concurrently.
+        """
+        response = await self.async_http.get(self._search_url(game_name))
+        response.raise_for_status()
+
+        search_results = response.json().get("results", [])
 
-            details_response = requests.get(details_url)
+        details_responses = await asyncio.gather(*[self.async_http.get(self._details_url(game_summary.get("id"))) for game_summary in search_results[:max_n]])
+        rawg_results = []
+        for details_response in details_responses:
             details_response.raise_for_status()
-            game_data = details_response.json()
-
-            rawg_obj = RAWGType(
-                id=game_data.get("id"),
-                name=game_data.get("name"),
-                release=game_data.get("released"),
-                rawg_rating=float(game_data.get("rating")) / 5.0 if game_data.get("rating") else 0.0,
-                metacritic_rating=(float(game_data.get("metacritic")) / 100.0 if game_data.get("metacritic") else 0.0),
-                main_story=game_data.get("playtime"),
-                platforms=[p.get("platform", {}).get("name") for p in game_data.get("platforms", []) if p.get("platform") is not None],
-                genres=[g.get("name") for g in game_data.get("genres", [])],
-                keywords=[t.get("name") for t in game_data.get("tags", [])],
-                esrb_rating=(game_data.get("esrb_rating", {}).get("name") if game_data.get("esrb_rating") else ""),
-                developers=[d.get("name") for d in game_data.get("developers", [])],
-                publishers=[p.get("name") for p in game_data.get("publishers", [])],
-                description=game_data.get("description_raw"),
-            )
-            rawg_results.append(rawg_obj)
+            rawg_results.append(self._parse_game(details_response.json()))
 
         return rawg_results
+
+    def _search_url(self, game_name: str) -> str:
+        return f"https://api.rawg.io/api/games?search={quote_plus(game_name)}&key={self.api_key}"
+
+    def _details_url(self, game_id: int) -> str:
+        return f"https://api.rawg.io/api/games/{game_id}?key={self.api_key}"
+
+    def _parse_game(self, game_data: dict) -> RAWGType:
+        return RAWGType(
+            id=game_data.get("id"),
+            name=game_data.get("name"),
+            release=game_data.get("released"),
+            rawg_rating=float(game_data.get("rating")) / 5.0 if game_data.get("rating") else 0.0,
+            metacritic_rating=(float(game_data.get("metacritic")) / 100.0 if game_data.get("metacritic") else 0.0),
+            main_story=game_data.get("playtime"),
+            platforms=[p.get("platform", {}).get("name") for p in game_data.get("platforms", []) if p.get("platform") is not None],
+            genres=[g.get("name") for g in game_data.get("genres", [])],
+            keywords=[t.get("name") for t in game_data.get("tags", [])],
+            esrb_rating=(game_data.get("esrb_rating", {}).get("name") if game_data.get("esrb_rating") else ""),
+            developers=[d.get("name") for d in game_data.get("developers", [])],
+            publishers=[p.get("name") for p in game_data.get("publishers", [])],
+            description=game_data.get("description_raw"),
+        )
@@ -0,0 +1,76 @@
+import json
+import os
+from dataset.storage import write_table
+
+# Status of a processed input key
+OK = "ok"
+FAILED = "failed"
+SKIPPED = "skipped"
+
+
+class Checkpoint:
+    """
+    Append only JSON lines log of the processed input keys, with their status and the produced row.
+    Each record is flushed and fsynced before the next key starts, so a crash loses at most the key in progress
+    and a resumed run skips exactly the keys already processed.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.records = {}
+        self._load()
+        self.file = open(path, "a", encoding="utf-8")
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        good_offset = 0
+        with open(self.path, "rb") as f:
+            for line in f:
+                # A crash in the middle of a write leaves a truncated last line
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    break
+                self.records[record["key"]] = record
+                good_offset += len(line)
+        # Drop the truncated line so the next record starts on a new line
+        if os.path.getsize(self.path) > good_offset:
+            with open(self.path, "r+b") as f:
+                f.truncate(good_offset)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.records
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def status(self, key: str) -> str:
+        record = self.records.get(key)
+        return None if record is None else record["status"]
+
+    def record(self, key: str, status: str, row: dict = None):
+        record = {"key": key, "status": status, "row": row}
+        self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.records[key] = record
+
+    def rows(self) -> list[dict]:
+        """
+        Rows of the keys processed with success, in processing order.
+        """
+        return [record["row"] for record in self.records.values() if record["status"] == OK and record["row"] is not None]
+
+    def export(self, filename: str) -> int:
+        """
+        Writes all the rows to a parquet (or csv) filename atomically, so the file is always complete even if the run is killed.
+        """
+        rows = self.rows()
+        write_table(rows, filename)
+        return len(rows)
+
+    def close(self):
+        self.file.close()
@@ -0,0 +1,162 @@
+import json
+import os
+import sqlite3
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+from threading import Lock
+from dataset.storage import write_table
+
+# Status of a work item
+PENDING = "pending"
+IN_PROGRESS = "in_progress"
+DONE = "done"
+FAILED = "failed"
+
+
+@dataclass
+class WorkItem:
+    kind: str
+    key: str
+    game_slug: str = None
+    user: str = None
+    attempts: int = 0
+
+
+class CrawlFrontier:
+    """
+    Persistent queue of crawl work items in SQLite. Every (kind, key) is queued only once, so the table
+    is also the visited set. Completing an item stores its rows and its new items in the same transaction,
+    so a crash never loses or duplicates the work of an item: the items in progress go back to the queue
+    when the frontier is opened again.
+    The stored rows are moved to numbered parquet parts by flush, rewriting the same part when a flush is interrupted.
+    """
+
+    def __init__(self, path: str, max_attempts: int = 3):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.lock = Lock()
+
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=FULL")
+        self.db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS items (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT,
+                key TEXT,
+                game_slug TEXT,
+                user TEXT,
+                status TEXT,
+                attempts INTEGER DEFAULT 0,
+                UNIQUE (kind, key)
+            )
+            """
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS items_status ON items (status, id)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS results (id INTEGER PRIMARY KEY AUTOINCREMENT, part INTEGER, row TEXT)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS results_part ON results (part)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value)")
+        self.db.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('next_part', 1)")
+        # The parts of different frontiers written to the same table never share a name
+        self.db.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('frontier_id', ?)", (uuid.uuid4().hex[:8],))
+        self.frontier_id = self.db.execute("SELECT value FROM meta WHERE key = 'frontier_id'").fetchone()[0]
+        # Items taken by a run that stopped are processed again
+        self.db.execute("UPDATE items SET status = ? WHERE status = ?", (PENDING, IN_PROGRESS))
+
+    def add(self, items: list[WorkItem]) -> int:
+        """
+        Queues the items never seen before. Returns the number of new items.
+        """
+        with self.lock:
+            self.db.execute("BEGIN")
+            added = self._insert(items)
+            self.db.execute("COMMIT")
+        return added
+
+    def _insert(self, items: list[WorkItem]) -> int:
+        before = self.db.total_changes
+        self.db.executemany(
+            "INSERT OR IGNORE INTO items (kind, key, game_slug, user, status) VALUES (?, ?, ?, ?, ?)",
+            [(item.kind, item.key, item.game_slug, item.user, PENDING) for item in items],
+        )
+        return self.db.total_changes - before
+
+    def take(self, n: int = 1) -> list[WorkItem]:
+        """
+        Marks up to n pending items as in progress and returns them, oldest first.
+        """
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            rows = self.db.execute("SELECT id, kind, key, game_slug, user, attempts FROM items WHERE status = ? ORDER BY id LIMIT ?", (PENDING, n)).fetchall()
+            self.db.executemany("UPDATE items SET status = ? WHERE id = ?", [(IN_PROGRESS, row[0]) for row in rows])
+            self.db.execute("COMMIT")
+        return [WorkItem(kind, key, game_slug, user, attempts) for _, kind, key, game_slug, user, attempts in rows]
+
+    def complete(self, item: WorkItem, rows: list[dict] = None, new_items: list[WorkItem] = None):
+        """
+        Stores the rows and queues the new items found by item, and marks it as done.
+        """
+        with self.lock:
+            self.db.execute("BEGIN")
+            if rows:
+                self.db.executemany("INSERT INTO results (row) VALUES (?)", [(json.dumps(row, ensure_ascii=False),) for row in rows])
+            if new_items:
+                self._insert(new_items)
+            self.db.execute("UPDATE items SET status = ? WHERE kind = ? AND key = ?", (DONE, item.kind, item.key))
+            self.db.execute("COMMIT")
+
+    def fail(self, item: WorkItem) -> bool:
+        """
+        Queues item again, or marks it as failed after max_attempts. Returns True when it is queued again.
+        """
+        attempts = item.attempts + 1
+        status = PENDING if attempts < self.max_attempts else FAILED
+        with self.lock:
+            self.db.execute("UPDATE items SET status = ?, attempts = ? WHERE kind = ? AND key = ?", (status, attempts, item.kind, item.key))
+        return status == PENDING
+
+    def retry_failed(self) -> int:
+        with self.lock:
+            return self.db.execute("UPDATE items SET status = ?, attempts = 0 WHERE status = ?", (PENDING, FAILED)).rowcount
+
+    def counts(self) -> dict:
+        """
+        Number of items of each kind and status, like {"user": {"done": 10, "pending": 3}}.
+        """
+        counts = {}
+        with self.lock:
+            for kind, status, n in self.db.execute("SELECT kind, status, COUNT(*) FROM items GROUP BY kind, status"):
+                counts.setdefault(kind, {})[status] = n
+        return counts
+
+    def pending_rows(self) -> int:
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def flush(self, path: str, schema=None, min_rows: int = 1) -> int:
+        """
+        Moves the stored rows to the parquet part path/part-{frontier_id}-{n}.parquet when there are at least min_rows.
+        Returns the number of rows moved.
+        """
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            if self.db.execute("SELECT COUNT(*) FROM results WHERE part IS NULL").fetchone()[0] >= min_rows:
+                part = self.db.execute("SELECT value FROM meta WHERE key = 'next_part'").fetchone()[0]
+                self.db.execute("UPDATE results SET part = ? WHERE part IS NULL", (part,))
+                self.db.execute("UPDATE meta SET value = ? WHERE key = 'next_part'", (part + 1,))
+            self.db.execute("COMMIT")
+
+            moved = 0
+            # Parts assigned by an interrupted flush are written again with the same name
+            for (part,) in self.db.execute("SELECT DISTINCT part FROM results WHERE part IS NOT NULL ORDER BY part").fetchall():
+                rows = [json.loads(row) for (row,) in self.db.execute("SELECT row FROM results WHERE part = ? ORDER BY id", (part,))]
+                write_table(rows, os.path.join(path, f"part-{self.frontier_id}-{part:08d}.parquet"), schema)
+                self.db.execute("DELETE FROM results WHERE part = ?", (part,))
+                moved += len(rows)
+            return moved
+
+    def close(self):
+        self.db.close()
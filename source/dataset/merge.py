@@ -0,0 +1,131 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from dataset.storage import REVIEW_SCHEMA, iter_batches, write_table
+
+# Columns of the merged reviews
+REVIEW_COLUMNS = REVIEW_SCHEMA.names
+
+
+def normalize_reviews(df: pd.DataFrame, rename: dict = None, scale: float = 10.0) -> pd.DataFrame:
+    """
+    Renames the columns of a source to REVIEW_COLUMNS, formats the dates as YYYY-MM-DD
+    and converts the scores of the source, from 0 to scale, to the 0-10 scale.
+    """
+    df = df.rename(columns=rename or {})
+    for column in REVIEW_COLUMNS:
+        if column not in df.columns:
+            df[column] = None
+    df = df[REVIEW_COLUMNS].copy()
+    for column in ["author", "game_name", "type", "platform"]:
+        df[column] = df[column].astype(object).where(df[column].notna(), None)
+    df["date"] = pd.to_datetime(df["date"], errors="coerce", utc=True, format="mixed").dt.strftime("%Y-%m-%d")
+    df["date"] = df["date"].astype(object).where(df["date"].notna(), None)
+    score = pd.to_numeric(df["score"], errors="coerce").astype(float)
+    df["score"] = score * (10.0 / scale)
+    return df
+
+
+def review_keys(df: pd.DataFrame) -> np.ndarray:
+    """
+    64 bit hashes of (author, game, date) of normalized reviews, names compared case insensitive.
+    """
+    keys = pd.DataFrame({column: df[column].fillna("").astype(str).str.strip().str.lower() for column in ["author", "game_name", "date"]})
+    return pd.util.hash_pandas_object(keys, index=False).to_numpy(dtype=np.uint64)
+
+
+def source_files(path: str) -> list[str]:
+    """
+    Files of a table: the parquet parts of a directory or the file itself.
+    """
+    if os.path.isdir(path):
+        return sorted(os.path.join(path, name) for name in os.listdir(path) if name.endswith(".parquet") and not name.startswith((".", "_")))
+    return [path] if os.path.exists(path) else []
+
+
+class ReviewMerger:
+    """
+    Incremental merge of review sources into a directory of parquet parts.
+    The hashed keys of the merged reviews and the source files already merged are kept in _state.npz, so
+    each run only reads the new source files, in chunks of bounded size, and appends only the unseen reviews.
+    The parts written for a source file have deterministic names, so a merge interrupted before the state is
+    saved rewrites the same parts instead of duplicating reviews.
+    """
+
+    def __init__(self, path: str, batch_size: int = 100_000):
+        self.path = path
+        self.batch_size = batch_size
+        self.state_path = os.path.join(path, "_state.npz")
+        Path(path).mkdir(parents=True, exist_ok=True)
+        self.keys = np.array([], dtype=np.uint64)
+        self.sources = {}
+        if os.path.exists(self.state_path):
+            state = np.load(self.state_path)
+            self.keys = state["keys"]
+            self.sources = json.loads(str(state["sources"]))
+
+    def _source_id(self, filename: str) -> str:
+        stat = os.stat(filename)
+        return f"{os.path.abspath(filename)}:{stat.st_size}:{int(stat.st_mtime)}"
+
+    def _save(self):
+        tmp_path = os.path.join(self.path, "_state.tmp.npz")
+        np.savez(tmp_path, keys=self.keys, sources=np.array(json.dumps(self.sources)))
+        os.replace(tmp_path, self.state_path)
+
+    def _is_new(self, keys: np.ndarray) -> np.ndarray:
+        positions = np.searchsorted(self.keys, keys)
+        found = positions < len(self.keys)
+        found[found] = self.keys[positions[found]] == keys[found]
+        return ~found
+
+    def merge_file(self, filename: str, rename: dict = None, scale: float = 10.0) -> tuple[int, int]:
+        """
+        Appends the new reviews of a source file, its scores go from 0 to scale. Returns the number of rows read and appended.
+        """
+        source_id = self._source_id(filename)
+        if source_id in self.sources:
+            return 0, 0
+        part_name = hashlib.sha1(source_id.encode("utf-8")).hexdigest()[:16]
+
+        read = 0
+        appended = 0
+        new_keys = []
+        for chunk, df in enumerate(iter_batches(filename, batch_size=self.batch_size)):
+            df = normalize_reviews(df, rename, scale)
+            keys = review_keys(df)
+            # New against the merged reviews and the first occurrence inside the file
+            new = self._is_new(keys)
+            _, first = np.unique(keys, return_index=True)
+            unique = np.zeros(len(keys), dtype=bool)
+            unique[first] = True
+            if new_keys:
+                unique &= ~np.isin(keys, np.concatenate(new_keys))
+            new &= unique
+
+            read += len(df)
+            if new.any():
+                write_table(df[new], os.path.join(self.path, f"part-{part_name}-{chunk:05d}.parquet"), REVIEW_SCHEMA)
+                new_keys.append(keys[new])
+                appended += int(new.sum())
+
+        if new_keys:
+            self.keys = np.union1d(self.keys, np.concatenate(new_keys))
+        self.sources[source_id] = {"read": read, "appended": appended}
+        self._save()
+        return read, appended
+
+    def merge(self, path: str, rename: dict = None, scale: float = 10.0) -> tuple[int, int]:
+        """
+        Appends the new reviews of every source file of a table not merged yet.
+        """
+        read = 0
+        appended = 0
+        for filename in source_files(path):
+            file_read, file_appended = self.merge_file(filename, rename, scale)
+            read += file_read
+            appended += file_appended
+        return read, appended
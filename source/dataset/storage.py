@@ -0,0 +1,119 @@
+import os
+import uuid
+from pathlib import Path
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+# Low cardinality string columns stored as dictionaries (ids + one copy of each string)
+DICTIONARY_COLUMNS = ("author", "authors", "game_name", "platform", "type")
+
+_dictionary = pa.dictionary(pa.int32(), pa.string())
+GAMESPOT_REVIEW_SCHEMA = pa.schema([("authors", _dictionary), ("score", pa.float64()), ("game_name", _dictionary), ("publish_date", pa.string())])
+METACRITIC_REVIEW_SCHEMA = pa.schema([("author", _dictionary), ("score", pa.float64()), ("game_name", _dictionary), ("date", pa.string()), ("type", _dictionary), ("platform", _dictionary)])
+# Merged reviews, scores from 0 to 10 and dates as YYYY-MM-DD
+REVIEW_SCHEMA = METACRITIC_REVIEW_SCHEMA
+
+
+def find_table(base: str) -> str:
+    """
+    Returns the base directory of parquet parts, base.parquet or base.csv for the tables created before the columnar storage.
+    """
+    for path in [base, f"{base}.parquet", f"{base}.csv"]:
+        if os.path.exists(path):
+            return path
+    return f"{base}.parquet"
+
+
+def to_arrow(data, schema: pa.Schema = None, dictionary_columns: tuple = DICTIONARY_COLUMNS) -> pa.Table:
+    """
+    Converts a DataFrame or a list of dicts to an Arrow table.
+    Lists become native list columns and the dictionary_columns are dictionary encoded.
+    With a schema the columns are selected and cast to it, so every part of a table has the same types.
+    """
+    table = pa.Table.from_pandas(data, preserve_index=False) if isinstance(data, pd.DataFrame) else pa.Table.from_pylist(data)
+    if schema is not None:
+        columns = [table.column(name) if name in table.column_names else pa.nulls(len(table), schema.field(name).type) for name in schema.names]
+        return pa.Table.from_arrays([column.cast(field.type) for column, field in zip(columns, schema)], schema=schema)
+    for i, name in enumerate(table.column_names):
+        column = table.column(i)
+        if pa.types.is_null(column.type):
+            column = column.cast(pa.string())
+        if name in dictionary_columns and (pa.types.is_string(column.type) or pa.types.is_large_string(column.type)):
+            column = column.dictionary_encode()
+        table = table.set_column(i, name, column)
+    return table
+
+
+def write_table(data, path: str, schema: pa.Schema = None, dictionary_columns: tuple = DICTIONARY_COLUMNS):
+    """
+    Writes a DataFrame or a list of dicts to a parquet (or csv) file atomically.
+    """
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    # Hidden name, so datasets being read do not pick the file before it is complete
+    tmp_path = os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.tmp")
+    if path.endswith(".csv"):
+        pd.DataFrame(data).to_csv(tmp_path, index=False)
+    else:
+        pq.write_table(to_arrow(data, schema, dictionary_columns), tmp_path, compression="zstd")
+    os.replace(tmp_path, path)
+
+
+def read_table(path: str, columns: list = None, filter=None) -> pd.DataFrame:
+    """
+    Reads only the selected columns of a parquet file, a directory of parquet parts or a csv file.
+    Dictionary columns are loaded as pandas categoricals and list columns as lists.
+    """
+    if path.endswith(".csv"):
+        return pd.read_csv(path, usecols=columns)
+    return ds.dataset(path, format="parquet").to_table(columns=columns, filter=filter).to_pandas()
+
+
+def iter_batches(path: str, columns: list = None, batch_size: int = 100_000):
+    """
+    Yields DataFrames of at most batch_size rows, so big tables can be processed in bounded memory.
+    """
+    if path.endswith(".csv"):
+        yield from pd.read_csv(path, usecols=columns, chunksize=batch_size)
+        return
+    for batch in ds.dataset(path, format="parquet").to_batches(columns=columns, batch_size=batch_size):
+        yield batch.to_pandas()
+
+
+class TableWriter:
+    """
+    Streams rows into a directory of parquet parts, each part is written atomically when rows_per_part rows
+    are buffered. Appending to the table only adds new parts, so it can be read while it grows.
+    """
+
+    def __init__(self, path: str, schema: pa.Schema = None, rows_per_part: int = 10_000, dictionary_columns: tuple = DICTIONARY_COLUMNS):
+        self.path = path
+        self.schema = schema
+        self.rows_per_part = rows_per_part
+        self.dictionary_columns = dictionary_columns
+        self.buffer = []
+        self.rows_written = 0
+        Path(path).mkdir(parents=True, exist_ok=True)
+
+    def write(self, rows: list[dict]):
+        self.buffer += rows
+        if len(self.buffer) >= self.rows_per_part:
+            self.flush()
+
+    def flush(self):
+        if len(self.buffer) == 0:
+            return
+        part_path = os.path.join(self.path, f"part-{pd.Timestamp.now(tz='UTC').strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}.parquet")
+        write_table(self.buffer, part_path, self.schema, self.dictionary_columns)
+        self.rows_written += len(self.buffer)
+        self.buffer = []
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
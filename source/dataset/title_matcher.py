@@ -0,0 +1,205 @@
+import re
+import unicodedata
+from collections import defaultdict
+import numpy as np
+from rapidfuzz import fuzz, process
+
+# Thresholds of the linkage (token_sort_ratio from 0 to 100)
+GOOD_SCORE = 90
+MIN_SCORE = 70
+DEVELOPER_SCORE = 80
+# Best scoring candidates tried in order, so a near duplicate title failing the developer check does not hide the right one
+CANDIDATES = 5
+
+# Roman numerals converted to numbers. "i" is only converted at the end of the title to keep "I Am Setsuna"
+ROMAN_NUMERALS = {
+    "ii": "2", "iii": "3", "iv": "4", "v": "5", "vi": "6", "vii": "7", "viii": "8", "ix": "9", "x": "10",
+    "xi": "11", "xii": "12", "xiii": "13", "xiv": "14", "xv": "15", "xvi": "16", "xvii": "17", "xviii": "18", "xix": "19", "xx": "20",
+}
+STOPWORDS = {"the", "a", "an", "of", "and", "in", "on", "to", "for", "edition"}
+
+
+def normalize_title(title: str) -> str:
+    """
+    Lowercases, removes accents and punctuation and converts roman numerals to numbers.
+    """
+    if title is None:
+        return ""
+    title = unicodedata.normalize("NFKD", str(title)).encode("ascii", "ignore").decode("ascii").lower()
+    title = title.replace("&", " and ")
+    tokens = re.sub(r"[^a-z0-9]+", " ", title).split()
+    tokens = [ROMAN_NUMERALS.get(token, token) for token in tokens]
+    if len(tokens) > 1 and tokens[-1] == "i":
+        tokens[-1] = "1"
+    return " ".join(tokens)
+
+
+def release_year(release) -> int:
+    """
+    Returns the year of a release date like 2025-04-24, or 0 when it is unknown.
+    """
+    if release is None:
+        return 0
+    if isinstance(release, (int, np.integer)):
+        return int(release)
+    match = re.match(r"\s*(\d{4})", str(release))
+    return int(match.group(1)) if match else 0
+
+
+def developer_score(developers_a: list, developers_b: list) -> float:
+    if not developers_a or not developers_b:
+        return 0.0
+    return fuzz.token_set_ratio(normalize_title(" ".join(developers_a)), normalize_title(" ".join(developers_b)))
+
+
+class TitleMatcher:
+    """
+    Index over the titles of a source to link them with other sources.
+    Titles are normalized once and blocked by release year, and by token for the queries without year.
+    Candidates are scored with token_sort_ratio: a score over GOOD_SCORE is a match, between MIN_SCORE and
+    GOOD_SCORE the developers must be similar too, and under MIN_SCORE the candidate is discarded.
+    """
+
+    def __init__(self, titles: list, releases: list = None, developers: list = None, year_tolerance: int = 1):
+        self.titles = list(titles)
+        self.normalized = np.array([normalize_title(title) for title in self.titles], dtype=object)
+        self.years = np.array([release_year(release) for release in releases] if releases is not None else np.zeros(len(self.titles)), dtype=np.int32)
+        self.developers = developers
+        self.year_tolerance = year_tolerance
+
+        # Year -> positions, titles without year are in year 0
+        self.year_index = defaultdict(list)
+        for i, year in enumerate(self.years):
+            self.year_index[int(year)].append(i)
+        self.year_index = {year: np.array(positions, dtype=np.int64) for year, positions in self.year_index.items()}
+
+        # Token -> positions
+        self.token_index = defaultdict(list)
+        for i, title in enumerate(self.normalized):
+            for token in set(title.split()) - STOPWORDS:
+                self.token_index[token].append(i)
+
+    def _year_block(self, year: int) -> np.ndarray:
+        """
+        Positions released within year_tolerance of year, plus the titles without a known year.
+        """
+        if year == 0:
+            return np.arange(len(self.titles))
+        blocks = [self.year_index.get(y) for y in range(year - self.year_tolerance, year + self.year_tolerance + 1)] + [self.year_index.get(0)]
+        blocks = [block for block in blocks if block is not None]
+        return np.concatenate(blocks) if blocks else np.array([], dtype=np.int64)
+
+    def _token_block(self, normalized: str) -> np.ndarray:
+        positions = set()
+        for token in set(normalized.split()) - STOPWORDS:
+            positions.update(self.token_index.get(token, []))
+        return np.array(sorted(positions), dtype=np.int64)
+
+    def _accept(self, score: float, position: int, developers: list) -> bool:
+        if score >= GOOD_SCORE:
+            return True
+        if score < MIN_SCORE or developers is None or self.developers is None:
+            return False
+        return developer_score(developers, self.developers[position]) >= DEVELOPER_SCORE
+
+    def _first_accepted(self, scores: np.ndarray, positions: np.ndarray, developers: list) -> tuple[int, float]:
+        """
+        First of the CANDIDATES best scores (ties by column, like process.extract) accepted by the linkage, or (-1, 0.0).
+        """
+        top = np.flatnonzero(scores)
+        negative = -scores[top].astype(np.float32)
+        if len(top) > CANDIDATES:
+            best = np.argpartition(negative, CANDIDATES - 1)[:CANDIDATES]
+            top, negative = top[best], negative[best]
+        for i in top[np.lexsort((top, negative))]:
+            if self._accept(scores[i], int(positions[i]), developers):
+                return int(positions[i]), float(scores[i])
+        return -1, 0.0
+
+    def best_match(self, title: str, release=None, developers: list = None, min_score: float = MIN_SCORE) -> tuple[int, float]:
+        """
+        Returns the position and score of the best match of title, or (-1, 0.0) when nothing is accepted.
+        A min_score under MIN_SCORE returns the closest title without applying the linkage thresholds.
+        """
+        query = normalize_title(title)
+        year = release_year(release)
+        candidates = self._year_block(year) if year else self._token_block(query)
+        if len(candidates) == 0:
+            candidates = np.arange(len(self.titles))
+        if len(candidates) == 0:
+            return -1, 0.0
+
+        # Scored like match_many, so both try the same candidates in the same order
+        scores = process.cdist([query], self.normalized[candidates], scorer=fuzz.token_sort_ratio, processor=None, score_cutoff=min_score, dtype=np.float32)[0]
+        if min_score < MIN_SCORE:
+            best = int(scores.argmax())
+            return (int(candidates[best]), float(scores[best])) if scores[best] >= min_score else (-1, 0.0)
+        return self._first_accepted(scores, candidates, developers)
+
+    def _match_block(self, normalized: np.ndarray, rows: np.ndarray, candidates: np.ndarray, developers: list, matches: np.ndarray, scores: np.ndarray, workers: int, blocks: list = None):
+        """
+        Scores the query rows against the candidate positions with one cdist. With blocks (the sorted positions
+        each query may match) the scores outside the block of the query are dropped.
+        """
+        matrix = process.cdist(normalized[rows], self.normalized[candidates], scorer=fuzz.token_sort_ratio, processor=None, score_cutoff=MIN_SCORE, dtype=np.uint8, workers=workers)
+        if blocks is not None:
+            allowed = np.zeros(matrix.shape, dtype=bool)
+            for i, block in enumerate(blocks):
+                allowed[i, np.searchsorted(candidates, block)] = True
+            matrix[~allowed] = 0
+        for i, row in enumerate(rows):
+            matches[row], scores[row] = self._first_accepted(matrix[i], candidates, None if developers is None else developers[row])
+
+    def match_many(self, titles: list, releases: list = None, developers: list = None, chunk_size: int = 2048, token_chunk_size: int = 256, workers: int = -1) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Links many titles against the index using a vectorized cdist per release year block, with the same candidates
+        as best_match. Titles without year are blocked by token: sorted by their rarest token, token_chunk_size of them
+        are scored against the union of their token blocks. Only the queries whose block is empty scan the whole index.
+        Returns the matched positions (-1 when there is no match) and their scores.
+        """
+        normalized = np.array([normalize_title(title) for title in titles], dtype=object)
+        years = np.array([release_year(release) for release in releases] if releases is not None else np.zeros(len(titles)), dtype=np.int32)
+        matches = np.full(len(titles), -1, dtype=np.int64)
+        scores = np.zeros(len(titles), dtype=np.float32)
+        everything = np.arange(len(self.titles))
+        if len(everything) == 0:
+            return matches, scores
+
+        # Chunks bound the score matrix memory to chunk_size x candidates bytes
+        fallback = []
+        for year in np.unique(years[years != 0]):
+            queries = np.flatnonzero(years == year)
+            candidates = self._year_block(int(year))
+            if len(candidates) == 0:
+                fallback.append(queries)
+                continue
+            for start in range(0, len(queries), chunk_size):
+                self._match_block(normalized, queries[start : start + chunk_size], candidates, developers, matches, scores, workers)
+
+        yearless = np.flatnonzero(years == 0)
+        blocks = {row: self._token_block(normalized[row]) for row in yearless}
+        fallback.append(np.array([row for row in yearless if len(blocks[row]) == 0], dtype=np.int64))
+
+        def rarest(row):
+            return min((len(self.token_index[token]), token) for token in set(normalized[row].split()) - STOPWORDS if token in self.token_index)
+
+        blocked = sorted((row for row in yearless if len(blocks[row])), key=rarest)
+        for start in range(0, len(blocked), token_chunk_size):
+            rows = np.array(blocked[start : start + token_chunk_size], dtype=np.int64)
+            candidates = np.unique(np.concatenate([blocks[row] for row in rows]))
+            self._match_block(normalized, rows, candidates, developers, matches, scores, workers, [blocks[row] for row in rows])
+
+        fallback = np.concatenate(fallback)
+        for start in range(0, len(fallback), chunk_size):
+            self._match_block(normalized, fallback[start : start + chunk_size], everything, developers, matches, scores, workers)
+        return matches, scores
+
+
+def link(titles_a: list, titles_b: list, releases_a: list = None, releases_b: list = None, developers_a: list = None, developers_b: list = None) -> list[tuple[int, int, float]]:
+    """
+    Links the titles of source a to the titles of source b.
+    Returns (position in a, position in b, score) for every accepted match.
+    """
+    matcher = TitleMatcher(titles_b, releases_b, developers_b)
+    matches, scores = matcher.match_many(titles_a, releases_a, developers_a)
+    return [(int(i), int(matches[i]), float(scores[i])) for i in np.flatnonzero(matches >= 0)]
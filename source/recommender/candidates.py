@@ -0,0 +1,240 @@
+import json
+import os
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+from dataset.title_matcher import release_year
+from recommender.game_features import GameFeatures, as_list
+
+ARRAYS = ["centroids", "vectors", "rows", "positions", "offsets", "years", "platforms"]
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms > 0, norms, 1.0)
+
+
+def spherical_kmeans(vectors: np.ndarray, n_clusters: int, iterations: int = 10, chunk_size: int = 65_536, seed: int = 42) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Lloyd iterations on unit vectors (the centroids are renormalized), assignments by the largest inner product.
+    Empty clusters are reseeded with random vectors. Returns the centroids and the cluster of each vector.
+    """
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+    assignments = np.zeros(len(vectors), dtype=np.int64)
+    for _ in range(iterations):
+        for start in range(0, len(vectors), chunk_size):
+            assignments[start : start + chunk_size] = np.argmax(vectors[start : start + chunk_size] @ centroids.T, axis=1)
+        members = csr_matrix((np.ones(len(vectors), dtype=np.float32), (assignments, np.arange(len(vectors)))), shape=(n_clusters, len(vectors)))
+        sums = np.asarray(members @ vectors)
+        empty = np.flatnonzero(np.bincount(assignments, minlength=n_clusters) == 0)
+        sums[empty] = vectors[rng.choice(len(vectors), len(empty), replace=False)]
+        centroids = normalize(sums)
+    return centroids, assignments
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    Positions of the k largest scores of each row, in descending order.
+    """
+    k = min(k, scores.shape[1])
+    if k == 0:
+        return np.zeros((len(scores), 0), dtype=np.int64)
+    best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, best, axis=1), axis=1, kind="stable")
+    return np.take_along_axis(best, order, axis=1)
+
+
+class CandidateIndex:
+    """
+    Top k games most similar (cosine) to a user state, with hard filters on release year and platform.
+    The game vectors are clustered into inverted lists (IVF) and stored contiguous by list, with the year and
+    platforms of each game in the same order, so the filters select the games before any score is computed and
+    the lists without any game left are skipped. search(exact=True) scores every game left with batched matmuls
+    instead of probing lists.
+    The index is a directory of .npy arrays, loaded memory mapped.
+    """
+
+    def __init__(self, path: str, mmap: bool = True):
+        self.path = path
+        with open(os.path.join(path, "index.json")) as f:
+            self.metadata = json.load(f)
+        mmap_mode = "r" if mmap else None
+        for name in ARRAYS:
+            setattr(self, name, np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode))
+        # Offsets and centroids are small and read by every query
+        self.offsets = np.asarray(self.offsets)
+        self.centroids = np.asarray(self.centroids)
+        self.platform_index = {platform: i for i, platform in enumerate(self.metadata["platforms"])}
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    @classmethod
+    def build(cls, path: str, vectors: np.ndarray, years: np.ndarray, platforms: list[list], n_lists: int = None, iterations: int = 10, seed: int = 42, metadata: dict = None) -> "CandidateIndex":
+        """
+        Clusters the vectors (row i is game i) into n_lists lists, 4 * sqrt(n_games) by default, and saves the index.
+        years are 0 when unknown, platforms are the platform names of each game.
+        """
+        vectors = normalize(vectors)
+        n_lists = max(1, min(len(vectors), n_lists or int(4 * np.sqrt(len(vectors)))))
+        centroids, assignments = spherical_kmeans(vectors, n_lists, iterations, seed=seed)
+
+        # Platforms as a boolean matrix over every platform name, case folded
+        platforms = [sorted({str(platform).strip().lower() for platform in as_list(names) if str(platform).strip()}) for names in platforms]
+        vocabulary = sorted({platform for names in platforms for platform in names})
+        platform_index = {platform: i for i, platform in enumerate(vocabulary)}
+        platform_matrix = np.zeros((len(vectors), len(vocabulary)), dtype=bool)
+        for row, names in enumerate(platforms):
+            platform_matrix[row, [platform_index[platform] for platform in names]] = True
+
+        # Games stored contiguous by list, rows maps back to the game and positions from the game
+        rows = np.argsort(assignments, kind="stable")
+        offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignments, minlength=n_lists), out=offsets[1:])
+        years = np.asarray(years, dtype=np.int32)[rows]
+        platform_matrix = platform_matrix[rows]
+
+        positions = np.empty(len(rows), dtype=np.int64)
+        positions[rows] = np.arange(len(rows))
+        arrays = {
+            "centroids": centroids,
+            "vectors": vectors[rows],
+            "rows": rows.astype(np.int64),
+            "positions": positions,
+            "offsets": offsets,
+            "years": years,
+            "platforms": platform_matrix,
+        }
+        Path(path).mkdir(parents=True, exist_ok=True)
+        for name, array in arrays.items():
+            tmp_filename = os.path.join(path, f".{name}.npy")
+            np.save(tmp_filename, array)
+            os.replace(tmp_filename, os.path.join(path, f"{name}.npy"))
+        metadata = {"games": len(vectors), "dim": vectors.shape[1], "lists": n_lists, "platforms": vocabulary, **(metadata or {})}
+        tmp_filename = os.path.join(path, ".index.json")
+        with open(tmp_filename, "w") as f:
+            json.dump(metadata, f)
+        os.replace(tmp_filename, os.path.join(path, "index.json"))
+        return cls(path)
+
+    @classmethod
+    def from_features(cls, path: str, features: GameFeatures, games: pd.DataFrame, blocks: list[str] = None, **kwargs) -> "CandidateIndex":
+        """
+        Index over the given blocks of the feature matrix (all of them by default), games is the table the matrix was encoded from.
+        """
+        if len(games) != len(features):
+            raise ValueError(f"The games table has {len(games)} rows but the feature matrix has {len(features)}")
+        columns = np.concatenate([np.arange(*features.blocks[name]) for name in blocks]) if blocks else slice(None)
+        vectors = np.asarray(features.matrix[:, columns])
+        years = np.array([release_year(release) for release in games["release"]], dtype=np.int32)
+        metadata = {"features": features.key, "blocks": list(blocks) if blocks else list(features.blocks)}
+        return cls.build(path, vectors, years, games["platforms"].tolist(), metadata=metadata, **kwargs)
+
+    def user_state(self, played: list) -> np.ndarray:
+        """
+        Query vector of a user: the average of the vectors of the games played (game rows).
+        """
+        played = np.asarray(played, dtype=np.int64)
+        if len(played) == 0:
+            return np.zeros(self.vectors.shape[1], dtype=np.float32)
+        return normalize(np.asarray(self.vectors[np.sort(self.positions[played])], dtype=np.float32).mean(axis=0))
+
+    def _platform_columns(self, platforms: list) -> np.ndarray:
+        if platforms is None:
+            return None
+        return np.array([self.platform_index[name] for name in (str(platform).strip().lower() for platform in platforms) if name in self.platform_index], dtype=np.int64)
+
+    def allowed(self, min_year: int = None, max_year: int = None, platforms: list = None, rows: np.ndarray = None) -> np.ndarray:
+        """
+        Filter of the stored games (in list order), or of the game rows given. Games with unknown year are dropped by any year filter.
+        """
+        positions = slice(None) if rows is None else self.positions[np.asarray(rows, dtype=np.int64)]
+        allowed = np.ones(len(self.rows) if rows is None else len(rows), dtype=bool)
+        if min_year is not None or max_year is not None:
+            years = np.asarray(self.years[positions])
+            allowed &= years > 0
+            if min_year is not None:
+                allowed &= years >= min_year
+            if max_year is not None:
+                allowed &= years <= max_year
+        platform_columns = self._platform_columns(platforms)
+        if platform_columns is not None:
+            allowed &= np.asarray(self.platforms[positions])[:, platform_columns].any(axis=1) if len(platform_columns) else False
+        return allowed
+
+    def search(self, queries: np.ndarray, k: int = 100, min_year: int = None, max_year: int = None, platforms: list = None, exclude: list = None, n_probe: int = 8, exact: bool = False, brute_force_size: int = 4096, chunk_size: int = 65_536) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Top k game rows and cosine scores of each query (a user state or a [n_queries, dim] batch), best first.
+        Only games released between min_year and max_year on any of the platforms are returned, and exclude
+        has the game rows to leave out of each query (for example the games already played).
+        The filters are applied first: when at most brute_force_size games pass them, the games left are scored
+        exactly, otherwise the closest lists with games left are probed, n_probe times more lists the more selective
+        the filters are, and the probing goes on until there are k games. Rows are padded with -1 (score -inf).
+        """
+        queries = normalize(np.atleast_2d(queries))
+        if exclude is not None and len(queries) == 1 and len(exclude) and np.ndim(exclude[0]) == 0:
+            exclude = [exclude]
+        excluded = [np.array([], dtype=np.int64)] * len(queries) if exclude is None else [self.positions[np.asarray(played, dtype=np.int64)] for played in exclude]
+        allowed = self.allowed(min_year, max_year, platforms)
+        n_allowed = int(allowed.sum())
+        if exact or n_allowed <= brute_force_size:
+            return self._search_exact(queries, k, np.flatnonzero(allowed), excluded, chunk_size)
+
+        # Games left in each list, the lists without any are never scanned
+        cumulative = np.r_[0, np.cumsum(allowed)]
+        list_counts = cumulative[self.offsets[1:]] - cumulative[self.offsets[:-1]]
+        n_probe = int(np.ceil(n_probe * len(allowed) / n_allowed))
+        list_order = np.argsort(-(queries @ self.centroids.T), axis=1)
+
+        rows = np.full((len(queries), k), -1, dtype=np.int64)
+        scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        for q, query in enumerate(queries):
+            query_allowed = allowed
+            if len(excluded[q]):
+                query_allowed = allowed.copy()
+                query_allowed[excluded[q]] = False
+            candidates, candidate_scores, found = [], [], 0
+            for probed, i in enumerate(list_order[q][list_counts[list_order[q]] > 0]):
+                if probed >= n_probe and found >= k:
+                    break
+                start, stop = self.offsets[i], self.offsets[i + 1]
+                list_allowed = query_allowed[start:stop]
+                positions = start + np.flatnonzero(list_allowed)
+                if len(positions) == 0:
+                    continue
+                candidates.append(positions)
+                candidate_scores.append(np.asarray(self.vectors[start:stop], dtype=np.float32)[list_allowed] @ query)
+                found += len(positions)
+            if found == 0:
+                continue
+            candidates, candidate_scores = np.concatenate(candidates), np.concatenate(candidate_scores)
+            best = top_k(candidate_scores[None, :], k)[0]
+            rows[q, : len(best)] = self.rows[candidates[best]]
+            scores[q, : len(best)] = candidate_scores[best]
+        return rows, scores
+
+    def _search_exact(self, queries: np.ndarray, k: int, positions: np.ndarray, excluded: list, chunk_size: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Scores the games at positions with one matmul per chunk for all the queries, keeping the running top k of each query.
+        """
+        rows = np.full((len(queries), k), -1, dtype=np.int64)
+        scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        for start in range(0, len(positions), chunk_size):
+            chunk = positions[start : start + chunk_size]
+            # Contiguous slices of the memmap when there is no filter, gathers otherwise
+            vectors = self.vectors[chunk[0] : chunk[-1] + 1] if chunk[-1] - chunk[0] + 1 == len(chunk) else self.vectors[chunk]
+            chunk_scores = queries @ np.asarray(vectors, dtype=np.float32).T
+            for q, played in enumerate(excluded):
+                if len(played):
+                    chunk_scores[q, np.isin(chunk, played)] = -np.inf
+            # Merge the chunk with the best so far
+            merged_scores = np.concatenate([scores, chunk_scores], axis=1)
+            merged_rows = np.concatenate([rows, np.broadcast_to(self.rows[chunk], chunk_scores.shape)], axis=1)
+            best = top_k(merged_scores, k)
+            scores = np.take_along_axis(merged_scores, best, axis=1)
+            rows = np.take_along_axis(merged_rows, best, axis=1)
+        rows[~np.isfinite(scores)] = -1
+        return rows, scores
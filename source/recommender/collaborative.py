@@ -0,0 +1,235 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+from recommender.interactions import InteractionMatrix
+
+# Factorization methods
+ALS = "als"
+SVD = "svd"
+
+
+def randomized_svd(matrix: csr_matrix, k: int, oversamples: int = 10, power_iterations: int = 4, seed: int = 42) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Top k singular triplets of a sparse matrix by random projection (Halko et al.).
+    Only products of the sparse matrix with thin dense blocks are computed.
+    """
+    rng = np.random.default_rng(seed)
+    omega = rng.standard_normal((matrix.shape[1], k + oversamples)).astype(np.float32)
+    q, _ = np.linalg.qr(matrix @ omega)
+    for _ in range(power_iterations):
+        q, _ = np.linalg.qr(matrix.T @ q)
+        q, _ = np.linalg.qr(matrix @ q)
+    u, s, vt = np.linalg.svd((matrix.T @ q).T, full_matrices=False)
+    return (q @ u)[:, :k], s[:k], vt[:k]
+
+
+def name_weights(names: np.ndarray) -> np.ndarray:
+    """
+    Weight in [0.5, 1.5) of each name from its hash, the same for a name whatever its position.
+    """
+    hashes = pd.util.hash_array(np.asarray(names, dtype=object))
+    return (hashes >> np.uint64(11)).astype(np.float64) / 2**53 + 0.5
+
+
+def rating_checksums(interactions: InteractionMatrix) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Checksum of the ratings of each user and of each game: the sum of the ratings weighted by the hashed names of the
+    other side, so an edited score or a rating moved to another game changes it even if the number of ratings does not.
+    """
+    user_checksums = interactions.csr @ name_weights(interactions.items)
+    item_checksums = interactions.csr.T @ name_weights(interactions.users)
+    return np.asarray(user_checksums, dtype=np.float64), np.asarray(item_checksums, dtype=np.float64)
+
+
+class CollaborativeEmbedding:
+    """
+    User and game factors of the rating matrix, ratings ~ user_factors @ item_factors.T (+ mean for ALS).
+    The factors are fit with explicit ALS over the observed ratings or with a randomized SVD of the whole matrix,
+    both multithreaded on CPU. New users and games are folded in by solving their least squares problem against
+    the fixed factors of the other side, so a few thousand new ratings update the vectors in seconds and
+    fit is only needed for the periodic full refits.
+    """
+
+    def __init__(self, k: int = 32, method: str = ALS, regularization: float = 0.1, iterations: int = 10, threads: int = None, chunk_nnz: int = 100_000, seed: int = 42):
+        if method not in [ALS, SVD]:
+            raise ValueError(f"Unknown factorization method {method}")
+        self.k = k
+        self.method = method
+        self.regularization = regularization
+        self.iterations = iterations
+        self.threads = threads or os.cpu_count()
+        self.chunk_nnz = chunk_nnz
+        self.seed = seed
+        self.mean = 0.0
+        self.users = np.array([], dtype=object)
+        self.items = np.array([], dtype=object)
+        self.user_factors = np.zeros((0, k), dtype=np.float32)
+        self.item_factors = np.zeros((0, k), dtype=np.float32)
+        self.user_counts = np.array([], dtype=np.int64)
+        self.item_counts = np.array([], dtype=np.int64)
+        self.user_checksums = np.array([], dtype=np.float64)
+        self.item_checksums = np.array([], dtype=np.float64)
+
+    def fit(self, interactions: InteractionMatrix) -> "CollaborativeEmbedding":
+        """
+        Full refit on all the ratings.
+        """
+        matrix = interactions.csr
+        self.users, self.items = interactions.users, interactions.items
+        if self.method == SVD:
+            u, s, vt = randomized_svd(matrix, self.k, seed=self.seed)
+            self.mean = 0.0
+            self.user_factors = (u * s).astype(np.float32)
+            self.item_factors = vt.T.astype(np.float32)
+        else:
+            self.mean = float(matrix.data.mean()) if matrix.nnz else 0.0
+            rng = np.random.default_rng(self.seed)
+            self.item_factors = (rng.standard_normal((matrix.shape[1], self.k)) * 0.01).astype(np.float32)
+            self.user_factors = np.zeros((matrix.shape[0], self.k), dtype=np.float32)
+            matrix_t = interactions.csc.T.tocsr()
+            for _ in range(self.iterations):
+                self.user_factors = self._solve(matrix, self.item_factors)
+                self.item_factors = self._solve(matrix_t, self.user_factors)
+        self.user_counts = np.diff(matrix.indptr)
+        self.item_counts = np.diff(interactions.csc.indptr)
+        self.user_checksums, self.item_checksums = rating_checksums(interactions)
+        return self
+
+    def _solve(self, ratings: csr_matrix, factors: np.ndarray, rows: np.ndarray = None) -> np.ndarray:
+        """
+        Least squares factors of the rows of ratings given the factors of its columns.
+        ALS only uses the observed ratings, SVD treats the missing ratings as zeros like the fit.
+        """
+        rows = np.arange(ratings.shape[0]) if rows is None else rows
+        solution = np.zeros((len(rows), self.k), dtype=np.float32)
+        if self.method == SVD:
+            gram = factors.T @ factors
+            solution[:] = np.linalg.solve(gram + 1e-6 * np.eye(self.k), (ratings[rows] @ factors).T).T
+            return solution
+
+        # Rows with the same number of ratings are solved together with batched matrix products,
+        # in batches of about chunk_nnz ratings to bound the memory
+        counts = np.diff(ratings.indptr)[rows]
+        batches = []
+        for count in np.unique(counts[counts > 0]):
+            positions = np.flatnonzero(counts == count)
+            size = max(1, self.chunk_nnz // int(count))
+            batches += [positions[start : start + size] for start in range(0, len(positions), size)]
+        with ThreadPoolExecutor(max_workers=self.threads) as executor:
+            for positions, factors_batch in zip(batches, executor.map(lambda positions: self._solve_batch(ratings, factors, rows[positions]), batches)):
+                solution[positions] = factors_batch
+        return solution
+
+    def _solve_batch(self, ratings: csr_matrix, factors: np.ndarray, rows: np.ndarray) -> np.ndarray:
+        count = ratings.indptr[rows[0] + 1] - ratings.indptr[rows[0]]
+        cells = ratings.indptr[rows][:, None] + np.arange(count)
+        f = factors[ratings.indices[cells]]
+        ft = f.transpose(0, 2, 1)
+        # Sum of v v^T and of (r - mean) v over the ratings of each row, regularization weighted by the number of ratings
+        gram = ft @ f + self.regularization * count * np.eye(self.k, dtype=np.float32)
+        rhs = ft @ (ratings.data[cells] - self.mean)[:, :, None]
+        return np.linalg.solve(gram, rhs)[:, :, 0]
+
+    def update(self, interactions: InteractionMatrix) -> tuple[int, int]:
+        """
+        Updates the factors to a matrix with new ratings without a full refit: the known factors are kept,
+        and the new users and games, and the ones whose ratings changed (in number or in value), are folded in.
+        Returns the number of users and games updated.
+        """
+        user_factors = self._align(interactions.users, self.users, self.user_factors)
+        item_factors = self._align(interactions.items, self.items, self.item_factors)
+        user_checksums, item_checksums = rating_checksums(interactions)
+        user_changed = self._changed(interactions.users, np.diff(interactions.csr.indptr), user_checksums, self.users, self.user_counts, self.user_checksums)
+        item_changed = self._changed(interactions.items, np.diff(interactions.csc.indptr), item_checksums, self.items, self.item_counts, self.item_checksums)
+
+        # Games first, from the users known before, then the users from the updated games
+        matrix_t = interactions.csc.T.tocsr()
+        if len(item_changed):
+            item_factors[item_changed] = self._solve(matrix_t, user_factors, item_changed)
+        if len(user_changed):
+            user_factors[user_changed] = self._solve(interactions.csr, item_factors, user_changed)
+
+        self.users, self.items = interactions.users, interactions.items
+        self.user_factors, self.item_factors = user_factors, item_factors
+        self.user_counts = np.diff(interactions.csr.indptr)
+        self.item_counts = np.diff(interactions.csc.indptr)
+        self.user_checksums, self.item_checksums = user_checksums, item_checksums
+        return len(user_changed), len(item_changed)
+
+    def _align(self, names: np.ndarray, old_names: np.ndarray, old_factors: np.ndarray) -> np.ndarray:
+        factors = np.zeros((len(names), self.k), dtype=np.float32)
+        index = {name: i for i, name in enumerate(old_names)}
+        positions = np.array([index.get(name, -1) for name in names], dtype=np.int64)
+        known = positions >= 0
+        factors[known] = old_factors[positions[known]]
+        return factors
+
+    def _changed(self, names: np.ndarray, counts: np.ndarray, checksums: np.ndarray, old_names: np.ndarray, old_counts: np.ndarray, old_checksums: np.ndarray = None) -> np.ndarray:
+        """
+        Rows of the new names and of the ones whose number of ratings or checksum changed.
+        Embeddings saved without checksums only compare the counts.
+        """
+        index = {name: i for i, name in enumerate(old_names)}
+        positions = np.array([index.get(name, -1) for name in names], dtype=np.int64)
+        known = positions >= 0
+        changed = ~known
+        changed[known] = old_counts[positions[known]] != counts[known]
+        if old_checksums is not None and len(old_checksums) == len(old_names):
+            changed[known] |= ~np.isclose(old_checksums[positions[known]], checksums[known], rtol=1e-9, atol=1e-9)
+        return np.flatnonzero(changed)
+
+    def fold_in_users(self, ratings: csr_matrix) -> np.ndarray:
+        """
+        Factors of users not in the fit from their ratings of the known games (rows of ratings).
+        """
+        return self._solve(csr_matrix(ratings, dtype=np.float32), self.item_factors)
+
+    def fold_in_items(self, ratings: csr_matrix) -> np.ndarray:
+        """
+        Factors of games not in the fit from their ratings by the known users (rows of ratings).
+        """
+        return self._solve(csr_matrix(ratings, dtype=np.float32), self.user_factors)
+
+    def item_vectors(self) -> dict:
+        """
+        Game name -> k dimensional vector.
+        """
+        return dict(zip(self.items, self.item_factors))
+
+    def predict(self, user_rows: np.ndarray, item_columns: np.ndarray) -> np.ndarray:
+        return np.einsum("ij,ij->i", self.user_factors[user_rows], self.item_factors[item_columns]) + self.mean
+
+    def save(self, path: str):
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(
+            tmp_path,
+            users=self.users.astype(str),
+            items=self.items.astype(str),
+            user_factors=self.user_factors,
+            item_factors=self.item_factors,
+            user_counts=self.user_counts,
+            item_counts=self.item_counts,
+            user_checksums=self.user_checksums,
+            item_checksums=self.item_checksums,
+            config=np.array([self.k, self.regularization, self.iterations, self.mean]),
+            method=np.array(self.method),
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "CollaborativeEmbedding":
+        data = np.load(path)
+        k, regularization, iterations, mean = data["config"]
+        embedding = cls(int(k), str(data["method"]), float(regularization), int(iterations))
+        embedding.mean = float(mean)
+        embedding.users = data["users"].astype(object)
+        embedding.items = data["items"].astype(object)
+        embedding.user_factors = data["user_factors"]
+        embedding.item_factors = data["item_factors"]
+        embedding.user_counts = data["user_counts"]
+        embedding.item_counts = data["item_counts"]
+        embedding.user_checksums = data["user_checksums"] if "user_checksums" in data else None
+        embedding.item_checksums = data["item_checksums"] if "item_checksums" in data else None
+        return embedding
@@ -0,0 +1,74 @@
+import numpy as np
+import d3rlpy
+from d3rlpy.dataset import Transition, TransitionMiniBatch
+from d3rlpy.preprocessing import MinMaxActionScaler
+from recommender.mdp_storage import CompactMDPDataset, ShardedMDPDataset
+
+
+class D3RLPyAdapter:
+    """
+    Feeds minibatches sampled from a sharded or compact dataset to a d3rlpy (1.x) algorithm,
+    instead of fit() with an MDPDataset that must be fully in memory.
+    With discrete=True the actions are the game indices of a compact dataset (for DQN and DiscreteCQL),
+    and the action size is the number of games. With indices only those transitions are sampled (the training split).
+    """
+
+    def __init__(self, dataset: ShardedMDPDataset | CompactMDPDataset, gamma: float = 0.99, seed: int = None, discrete: bool = False, indices: np.ndarray = None):
+        if discrete and not isinstance(dataset, CompactMDPDataset):
+            raise ValueError("Discrete actions need the game indices of a CompactMDPDataset")
+        self.dataset = dataset
+        self.gamma = gamma
+        self.rng = np.random.default_rng(seed)
+        self.discrete = discrete
+        self.indices = indices
+        self.observation_shape = (dataset.observation_dim,)
+        self.action_size = len(dataset.game_ids) if discrete else dataset.action_dim
+
+    def action_scaler(self) -> MinMaxActionScaler:
+        """
+        The min_max action scaler from the action range saved in the manifest.
+        """
+        return MinMaxActionScaler(minimum=self.dataset.action_min, maximum=self.dataset.action_max)
+
+    def to_minibatch(self, batch: dict) -> TransitionMiniBatch:
+        actions = batch["action_indices"] if self.discrete else batch["actions"]
+        transitions = [
+            Transition(
+                observation_shape=self.observation_shape,
+                action_size=self.action_size,
+                observation=batch["observations"][i],
+                action=int(actions[i]) if self.discrete else actions[i],
+                reward=float(batch["rewards"][i, 0]),
+                next_observation=batch["next_observations"][i],
+                terminal=float(batch["terminals"][i, 0]),
+            )
+            for i in range(len(batch["actions"]))
+        ]
+        return TransitionMiniBatch(transitions, gamma=self.gamma)
+
+    def sample(self, batch_size: int, rng: np.random.Generator) -> dict:
+        if self.indices is None:
+            return self.dataset.sample(batch_size, rng)
+        return self.dataset.batch(np.sort(self.indices[rng.integers(0, len(self.indices), batch_size)]))
+
+    def minibatch(self, batch_size: int) -> TransitionMiniBatch:
+        return self.to_minibatch(self.sample(batch_size, self.rng))
+
+    def build(self, algo: d3rlpy.base.LearnableBase):
+        if algo.impl is None:
+            algo.create_impl(self.observation_shape, self.action_size)
+
+    def fit(self, algo: d3rlpy.base.LearnableBase, n_steps: int, batch_size: int = None, log_every: int = 1000) -> list[dict]:
+        """
+        Runs n_steps gradient steps of algo on minibatches of the shards.
+        Returns the losses logged every log_every steps.
+        """
+        batch_size = algo.batch_size if batch_size is None else batch_size
+        self.build(algo)
+        history = []
+        for step in range(1, n_steps + 1):
+            loss = algo.update(self.minibatch(batch_size))
+            if step % log_every == 0 or step == n_steps:
+                history.append({"step": step, **loss})
+                print(f"step {step}: " + ", ".join(f"{name}={value:.4f}" for name, value in loss.items()))
+        return history
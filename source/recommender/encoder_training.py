@@ -0,0 +1,171 @@
+import math
+from time import perf_counter
+import numpy as np
+import torch
+from recommender.mdp_storage import CompactMDPDataset
+from recommender.user_encoders import UserEncoder, ENCODERS
+
+
+class GRUModule(torch.nn.Module):
+    """
+    Training version of GRUEncoder, the state after each game of left padded sequences.
+    """
+
+    def __init__(self, dim: int, units: int):
+        super().__init__()
+        self.cell = torch.nn.GRUCell(dim + 1, units)
+        self.out = torch.nn.Linear(units, dim)
+
+    def forward(self, inputs: torch.Tensor, positions: torch.Tensor, valid: torch.Tensor) -> torch.Tensor:
+        h = inputs.new_zeros((inputs.shape[0], self.cell.hidden_size))
+        outputs = []
+        for t in range(inputs.shape[1]):
+            h = torch.where(valid[:, t, None], self.cell(inputs[:, t], h), h)
+            outputs.append(h)
+        return self.out(torch.stack(outputs, dim=1))
+
+
+class SASRecLayer(torch.nn.Module):
+    def __init__(self, model_dim: int, heads: int):
+        super().__init__()
+        self.heads = heads
+        self.norm1 = torch.nn.LayerNorm(model_dim)
+        self.query = torch.nn.Linear(model_dim, model_dim)
+        self.key = torch.nn.Linear(model_dim, model_dim)
+        self.value = torch.nn.Linear(model_dim, model_dim)
+        self.attention_out = torch.nn.Linear(model_dim, model_dim)
+        self.norm2 = torch.nn.LayerNorm(model_dim)
+        self.feed_forward1 = torch.nn.Linear(model_dim, 2 * model_dim)
+        self.feed_forward2 = torch.nn.Linear(2 * model_dim, model_dim)
+
+    def forward(self, h: torch.Tensor, allowed: torch.Tensor) -> torch.Tensor:
+        batch_size, length, model_dim = h.shape
+        head_dim = model_dim // self.heads
+        a = self.norm1(h)
+        query, key, value = [linear(a).view(batch_size, length, self.heads, head_dim).transpose(1, 2) for linear in (self.query, self.key, self.value)]
+        scores = (query @ key.transpose(-1, -2) / math.sqrt(head_dim)).masked_fill(~allowed[:, None], float("-inf"))
+        attention = (torch.softmax(scores, dim=-1) @ value).transpose(1, 2).reshape(batch_size, length, model_dim)
+        h = h + self.attention_out(attention)
+        return h + self.feed_forward2(torch.relu(self.feed_forward1(self.norm2(h))))
+
+
+class SASRecModule(torch.nn.Module):
+    """
+    Training version of SASRecEncoder: the same attention over the last window games, for whole sequences at once.
+    """
+
+    def __init__(self, dim: int, model_dim: int, heads: int, layers: int, window: int, max_position: int):
+        super().__init__()
+        self.window = window
+        self.max_position = max_position
+        self.input = torch.nn.Linear(dim + 1, model_dim)
+        self.positions = torch.nn.Embedding(max_position, model_dim)
+        self.layers = torch.nn.ModuleList([SASRecLayer(model_dim, heads) for _ in range(layers)])
+        self.norm = torch.nn.LayerNorm(model_dim)
+        self.out = torch.nn.Linear(model_dim, dim)
+
+    def forward(self, inputs: torch.Tensor, positions: torch.Tensor, valid: torch.Tensor) -> torch.Tensor:
+        length = inputs.shape[1]
+        h = self.input(inputs) + self.positions(positions.clamp(max=self.max_position - 1))
+        i = torch.arange(length)[:, None]
+        j = torch.arange(length)[None, :]
+        # Each game sees itself and the window - 1 games before it, the padding sees itself so no row is all -inf
+        allowed = ((j <= i) & (i - j < self.window))[None] & valid[:, None, :] | (i == j)[None]
+        for layer in self.layers:
+            h = layer(h, allowed)
+        return self.out(self.norm(h))
+
+
+def build_module(encoder: UserEncoder) -> torch.nn.Module:
+    if encoder.kind == "gru":
+        return GRUModule(encoder.dim, **encoder.config)
+    if encoder.kind == "sasrec":
+        return SASRecModule(encoder.dim, **encoder.config)
+    raise ValueError(f"The {encoder.kind} encoder has nothing to train")
+
+
+def sequence_batch(dataset: CompactMDPDataset, ends: np.ndarray, length: int, burn_in: int) -> dict:
+    """
+    Left padded windows of the histories ending at the steps in ends. The output after each game is trained to score the
+    next game of the last length steps above the sampled negatives. The burn_in games before them only build the state.
+    """
+    episodes = np.searchsorted(dataset.episode_starts, ends, side="right") - 1
+    episode_starts = dataset.episode_starts[episodes]
+    begins = np.maximum(episode_starts, ends - length - burn_in + 1)
+    size = length + burn_in
+    offsets = np.arange(size)[None, :] - size + 1
+    rows = ends[:, None] + offsets
+    valid = rows >= begins[:, None]
+    rows = np.where(valid, rows, ends[:, None])
+
+    actions = np.asarray(dataset.actions[rows.reshape(-1)], dtype=np.int64).reshape(rows.shape)
+    vectors = np.asarray(dataset.features[actions.reshape(-1)], dtype=np.float32).reshape(*rows.shape, -1)
+    rewards = np.asarray(dataset.rewards[rows.reshape(-1)], dtype=np.float32).reshape(rows.shape)
+    inputs = np.concatenate([vectors, rewards[..., None]], axis=2) * valid[..., None]
+
+    # The output at position t is the state before the game at t + 1
+    targets = np.zeros_like(actions)
+    targets[:, :-1] = actions[:, 1:]
+    trained = np.zeros_like(valid)
+    trained[:, :-1] = valid[:, :-1] & (offsets[:, 1:] > -length)
+    return {
+        "inputs": torch.from_numpy(inputs),
+        "positions": torch.from_numpy(rows - episode_starts[:, None]).clamp(min=0),
+        "valid": torch.from_numpy(valid),
+        "targets": torch.from_numpy(targets[trained]),
+        "trained": torch.from_numpy(trained),
+    }
+
+
+def sampled_softmax_loss(module: torch.nn.Module, batch: dict, features: torch.Tensor, negatives: torch.Tensor) -> torch.Tensor:
+    """
+    Cross entropy of the next game against the negatives, the logits are the dot products of the states and the game vectors.
+    """
+    states = module(batch["inputs"], batch["positions"], batch["valid"])[batch["trained"]]
+    positive = (states * features[batch["targets"]]).sum(dim=1, keepdim=True)
+    # The negatives that are the next game itself are masked out
+    collisions = torch.cat([torch.zeros((len(states), 1), dtype=torch.bool), negatives[None, :] == batch["targets"][:, None]], dim=1)
+    logits = torch.cat([positive, states @ features[negatives].T], dim=1).masked_fill(collisions, float("-inf"))
+    return torch.nn.functional.cross_entropy(logits, torch.zeros(len(states), dtype=torch.long))
+
+
+def train_encoder(encoder: UserEncoder, dataset: CompactMDPDataset, indices: np.ndarray = None, validation: np.ndarray = None, n_steps: int = 10_000, batch_size: int = 128, length: int = 50, burn_in: int = None, n_negatives: int = 512, learning_rate: float = 1e-3, log_every: int = 500, seed: int = 42) -> UserEncoder:
+    """
+    Trains a GRU or SASRec encoder to predict the next game of the histories ending at the steps in indices (all by default),
+    with a sampled softmax over the game vectors, and returns it with the trained weights.
+    The burn in of SASRec defaults to the games that reach the last one through the window of every layer,
+    so its windows see exactly the history the incremental encoder does. The GRU starts each window from zeros.
+    validation are the steps of the held out users, their loss is printed every log_every steps.
+    """
+    torch.manual_seed(seed)
+    rng = np.random.default_rng(seed)
+    if burn_in is None:
+        burn_in = encoder.config["layers"] * (encoder.config["window"] - 1) if encoder.kind == "sasrec" else 20
+    indices = np.arange(len(dataset)) if indices is None else np.asarray(indices)
+    module = build_module(encoder)
+    optimizer = torch.optim.Adam(module.parameters(), lr=learning_rate)
+    features = torch.from_numpy(np.asarray(dataset.features[np.arange(len(dataset.game_ids))], dtype=np.float32))
+    n_games = len(features)
+
+    start, losses = perf_counter(), []
+    for step in range(1, n_steps + 1):
+        module.train()
+        batch = sequence_batch(dataset, indices[rng.integers(0, len(indices), batch_size)], length, burn_in)
+        loss = sampled_softmax_loss(module, batch, features, torch.from_numpy(rng.integers(0, n_games, n_negatives)))
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+        losses.append(loss.item())
+
+        if step % log_every == 0 or step == n_steps:
+            message = f"step {step}: loss {np.mean(losses):.4f}, {len(losses) / (perf_counter() - start):.1f} steps/s"
+            if validation is not None and len(validation):
+                module.eval()
+                with torch.no_grad():
+                    batch = sequence_batch(dataset, validation[rng.integers(0, len(validation), 4 * batch_size)], length, burn_in)
+                    message += f", validation loss {sampled_softmax_loss(module, batch, features, torch.from_numpy(rng.integers(0, n_games, n_negatives))).item():.4f}"
+            print(message)
+            start, losses = perf_counter(), []
+
+    params = {name: value.detach().cpu().numpy() for name, value in module.state_dict().items()}
+    return ENCODERS[encoder.kind](encoder.dim, params, **encoder.config)
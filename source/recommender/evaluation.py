@@ -0,0 +1,164 @@
+from time import perf_counter
+import numpy as np
+from recommender.mdp_builder import Episodes, running_average_states
+from recommender.mdp_storage import CompactMDPDataset
+
+
+def split_episodes(episode_starts: np.ndarray, fraction: float = 0.1, seed: int = 42) -> np.ndarray:
+    """
+    Mask of the transitions of a random fraction of the episodes (users), held out of the training for evaluation.
+    The same seed always holds out the same episodes.
+    """
+    held_out = np.random.default_rng(seed).random(len(episode_starts) - 1) < fraction
+    return np.repeat(held_out, np.diff(episode_starts))
+
+
+def ranking_metrics(scores: np.ndarray, valid: np.ndarray, k_values: tuple) -> dict:
+    """
+    hit@K and NDCG@K of the first column (the game actually reviewed) against the other valid columns, summed over the rows.
+    With a single relevant game NDCG@K is 1 / log2(rank + 2) when it is in the top K.
+    """
+    rank = ((scores[:, 1:] > scores[:, :1]) & valid[:, 1:]).sum(axis=1)
+    metrics = {}
+    for k in k_values:
+        hit = rank < k
+        metrics[f"hit@{k}"] = float(hit.sum())
+        metrics[f"ndcg@{k}"] = float((hit / np.log2(rank + 2)).sum())
+    return metrics
+
+
+class OfflineEvaluator:
+    """
+    Scores a policy (any scorer of recommender.inference) on the transitions of a CompactMDPDataset, chunk by chunk:
+        - ranking: sampled hit@K and NDCG@K of the game the user reviewed next, ranked by Q among n_candidates games sampled
+          for each row. They are estimates of the full ranking against all the games, optimistic since most sampled games
+          are easy to beat, so they compare policies with each other, not with the top k served from the candidate index
+        - IPS and self normalized IPS of the rewards, with the softmax of Q / temperature over the same games as the
+          target policy and the popularity of the games in the training split as the behavior policy
+        - FQE: the linear Fitted Q Evaluation fixed point of the greedy policy, solved in closed form (LSTD-Q) over
+          phi(s, a) = [P s, P a, P s * P a, 1] with a fixed random projection P, so a single pass is needed
+    States are the running averages of the histories, computed with cumulative sums over contiguous chunks like the
+    dataset was built (or the user encoder states of the dataset), and every chunk is scored in one call of the scorer.
+    The greedy policy of each row picks among its candidates and the logged game.
+    """
+
+    def __init__(self, dataset: CompactMDPDataset, scorer, k_values: tuple = (5, 10, 20), n_candidates: int = 100, gamma: float = 0.3, temperature: float = 1.0, max_weight: float = 100.0, projection_dim: int = 32, ridge: float = 1e-3, chunk_size: int = 512, seed: int = 42):
+        self.dataset = dataset
+        self.scorer = scorer
+        self.k_values = k_values
+        self.n_candidates = n_candidates
+        self.gamma = gamma
+        self.temperature = temperature
+        self.max_weight = max_weight
+        self.ridge = ridge
+        self.chunk_size = chunk_size
+        self.seed = seed
+        self.n_games = len(dataset.game_ids)
+        self.episodes = Episodes(actions=dataset.actions, rewards=dataset.rewards, terminals=dataset.terminals, episode_starts=dataset.episode_starts, users=np.array([], dtype=object))
+        self.episode_ends = np.r_[dataset.episode_starts[1:], len(dataset)]
+
+        # Projected game vectors, computed once for every game
+        rng = np.random.default_rng(seed)
+        self.projection = (rng.standard_normal((dataset.observation_dim, projection_dim)) / np.sqrt(projection_dim)).astype(np.float32)
+        self.projected_games = np.concatenate([np.asarray(dataset.features[start : start + 65_536], dtype=np.float32) @ self.projection for start in range(0, self.n_games, 65_536)])
+
+    def phi(self, projected_states: np.ndarray, actions: np.ndarray) -> np.ndarray:
+        projected_actions = self.projected_games[actions]
+        return np.concatenate([projected_states, projected_actions, projected_states * projected_actions, np.ones((len(actions), 1), dtype=np.float32)], axis=1).astype(np.float64)
+
+    def _score(self, scorer, states: np.ndarray, candidates: np.ndarray) -> np.ndarray:
+        actions = np.asarray(self.dataset.features[candidates.reshape(-1)], dtype=np.float32).reshape(*candidates.shape, -1)
+        return np.asarray(scorer.score(states, actions, candidates), dtype=np.float64)
+
+    def evaluate(self, mask: np.ndarray = None, popularity_mask: np.ndarray = None, scorer=None) -> dict:
+        """
+        Metrics over the transitions in mask (all of them when None), the behavior popularity is counted over popularity_mask
+        (the complement of mask by default). scorer replaces the scorer of the evaluator, for example to evaluate checkpoints.
+        """
+        start_time = perf_counter()
+        scorer = self.scorer if scorer is None else scorer
+        n = len(self.dataset)
+        mask = np.ones(n, dtype=bool) if mask is None else mask
+        popularity_mask = ~mask if popularity_mask is None else popularity_mask
+        counted = popularity_mask if popularity_mask.any() else np.ones(n, dtype=bool)
+        popularity = np.bincount(np.asarray(self.dataset.actions)[counted], minlength=self.n_games).astype(np.float64) + 1.0
+        rng = np.random.default_rng(self.seed)
+
+        dim = 3 * self.projection.shape[1] + 1
+        a_matrix, b_vector = np.zeros((dim, dim)), np.zeros(dim)
+        phi_policy, phi_logged = np.zeros(dim), np.zeros(dim)
+        totals = {"transitions": 0, "reward": 0.0, "weighted_reward": 0.0, "weights": 0.0, "squared_weights": 0.0}
+        ranking = {}
+
+        for start in range(0, n, self.chunk_size):
+            end = min(start + self.chunk_size, n)
+            rows = start + np.flatnonzero(mask[start:end])
+            if len(rows) == 0:
+                continue
+            # States of [start, end] so the next state of the last row of the chunk is there too
+            if self.dataset.observations is None:
+                states = running_average_states(self.dataset.features, self.episodes, start, min(end + 1, n))
+            else:
+                states = np.asarray(self.dataset.observations[start : min(end + 1, n)], dtype=np.float32)
+            current = states[rows - start]
+            episode_end = self.episode_ends[np.searchsorted(self.dataset.episode_starts, rows, side="right") - 1]
+            continuing = (np.asarray(self.dataset.terminals[rows]) == 0) & (rows + 1 < episode_end)
+            following = np.minimum(rows + 1 - start, len(states) - 1)
+            next_states = np.where(continuing[:, None], states[following], 0.0).astype(np.float32)
+
+            actions = np.asarray(self.dataset.actions[rows], dtype=np.int64)
+            next_actions = np.asarray(self.dataset.actions[np.minimum(rows + 1, n - 1)], dtype=np.int64)
+            rewards = np.asarray(self.dataset.rewards[rows], dtype=np.float64)
+
+            # Column 0 is the logged game, the sampled games equal to it are not valid. Each row has its own sample,
+            # so the rows of a chunk are not ranked against the same games
+            negatives = rng.integers(0, self.n_games, (len(rows), self.n_candidates))
+            candidates = np.concatenate([actions[:, None], negatives], axis=1)
+            valid = np.ones(candidates.shape, dtype=bool)
+            valid[:, 1:] = candidates[:, 1:] != actions[:, None]
+            q = np.where(valid, self._score(scorer, current, candidates), -np.inf)
+            for name, value in ranking_metrics(q, valid, self.k_values).items():
+                ranking[f"sampled_{name}"] = ranking.get(f"sampled_{name}", 0.0) + value
+
+            # IPS: softmax of Q over the candidates against the popularity over the same candidates
+            logits = q / self.temperature
+            target = np.exp(logits - logits.max(axis=1, keepdims=True))
+            target = target[:, 0] / target.sum(axis=1)
+            behavior = np.where(valid, popularity[candidates], 0.0)
+            behavior = behavior[:, 0] / behavior.sum(axis=1)
+            weights = np.minimum(target / behavior, self.max_weight)
+            totals["transitions"] += len(rows)
+            totals["reward"] += rewards.sum()
+            totals["weighted_reward"] += (weights * rewards).sum()
+            totals["weights"] += weights.sum()
+            totals["squared_weights"] += (weights**2).sum()
+
+            # FQE: greedy actions of the current states (among the candidates) and of the next states (among the candidates and the next logged game)
+            greedy = candidates[np.arange(len(rows)), np.argmax(q, axis=1)]
+            next_candidates = candidates.copy()
+            next_candidates[:, 0] = next_actions
+            next_q = self._score(scorer, next_states, next_candidates)
+            next_greedy = next_candidates[np.arange(len(rows)), np.argmax(next_q, axis=1)]
+
+            projected, next_projected = current @ self.projection, next_states @ self.projection
+            phi = self.phi(projected, actions)
+            next_phi = self.phi(next_projected, next_greedy) * (self.gamma * continuing)[:, None]
+            a_matrix += phi.T @ (phi - next_phi)
+            b_vector += phi.T @ rewards
+            phi_logged += phi.sum(axis=0)
+            phi_policy += self.phi(projected, greedy).sum(axis=0)
+
+        count = max(totals["transitions"], 1)
+        weights = np.linalg.solve(a_matrix + self.ridge * count * np.eye(dim), b_vector)
+        results = {
+            "transitions": totals["transitions"],
+            "dataset_reward": float(totals["reward"] / count),
+            "ips": float(totals["weighted_reward"] / count),
+            "snips": float(totals["weighted_reward"] / max(totals["weights"], 1e-12)),
+            "ess": float(totals["weights"] ** 2 / max(totals["squared_weights"], 1e-12)),
+            "fqe_policy_value": float(phi_policy @ weights / count),
+            "fqe_logged_value": float(phi_logged @ weights / count),
+            **{name: value / count for name, value in ranking.items()},
+        }
+        results["seconds"] = perf_counter() - start_time
+        return results
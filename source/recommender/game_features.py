@@ -0,0 +1,443 @@
+import ast
+import hashlib
+import json
+import os
+import re
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from scipy.sparse import coo_matrix, csr_matrix, diags
+from dataset.storage import find_table, read_table
+from dataset.title_matcher import TitleMatcher, normalize_title, release_year
+from recommender.collaborative import randomized_svd
+from recommender.interactions import InteractionMatrix
+
+# Bumped when the encoders change, so the cached matrices of the old encoders are not reused
+FEATURES_VERSION = 1
+LATEST = "latest.json"
+
+# Column blocks of the feature matrix, in order
+TITLE = "title"
+DESCRIPTION = "description"
+GENRES = "genres"
+YEAR = "year"
+PLATFORMS = "platforms"
+TIME_TO_BEAT = "time_to_beat"
+CRITIC_RATING = "critic_rating"
+USER_RATING = "user_rating"
+COLLABORATIVE = "collaborative"
+
+TIME_TO_BEAT_COLUMNS = ["main_story", "main_extra", "completionist"]
+# Every user rating of the games table is already from 0 to 1
+USER_RATING_COLUMNS = ["user_rating", "rawg_rating", "igdb_rating", "hltb_rating"]
+STOPWORDS = {"the", "a", "an", "of", "and", "or", "in", "on", "to", "for", "with", "is", "it", "its", "as", "at", "by", "from", "this", "that", "be", "are", "your", "you"}
+
+
+@dataclass
+class FeatureConfig:
+    """
+    Sizes of the blocks and the settings of the encoders, part of the cache key.
+    """
+
+    title_dim: int = 128
+    description_dim: int = 128
+    genres: int = 20
+    platforms: int = 10
+    collaborative_dim: int = 32
+    time_to_beat_scale: float = 50.0
+    window: int = 5
+    min_count: int = 2
+    max_vocabulary: int = 50_000
+    seed: int = 42
+
+
+def as_list(value) -> list:
+    """
+    List cell of the games table: a native list from parquet, its string representation from csv, or missing.
+    """
+    if value is None:
+        return []
+    if isinstance(value, str):
+        if not value.startswith("["):
+            return [value] if value else []
+        try:
+            return list(ast.literal_eval(value))
+        except (ValueError, SyntaxError):
+            return []
+    if isinstance(value, float) and np.isnan(value):
+        return []
+    return list(value)
+
+
+def tokenize(text: str) -> list[str]:
+    return [token for token in re.findall(r"[a-z0-9]+", str(text).lower()) if token not in STOPWORDS and len(token) > 1]
+
+
+def input_digest(paths: list) -> str:
+    """
+    sha1 of the contents of the input tables, directories are hashed file by file in name order.
+    """
+    digest = hashlib.sha1()
+    for path in paths:
+        if path is None or not os.path.exists(path):
+            digest.update(b"missing")
+            continue
+        files = [path] if os.path.isfile(path) else sorted(os.path.join(path, name) for name in os.listdir(path) if not name.startswith((".", "_")))
+        for filename in files:
+            digest.update(os.path.basename(filename).encode())
+            with open(filename, "rb") as f:
+                digest.update(hashlib.file_digest(f, "sha1").digest())
+    return digest.hexdigest()
+
+
+class TitleLinker:
+    """
+    Links titles to positions in names: titles equal after normalize_title directly, the rest with the fuzzy TitleMatcher,
+    which is only built the first time it is needed and then reused.
+    """
+
+    def __init__(self, names):
+        self.names = list(names)
+        self.index = {}
+        for i, name in enumerate(self.names):
+            self.index.setdefault(normalize_title(name), i)
+        self._matcher = None
+
+    def link(self, titles) -> np.ndarray:
+        """
+        Position in names of each title, -1 when it has no match.
+        """
+        titles = [str(title) for title in titles]
+        positions = np.array([self.index.get(normalize_title(title), -1) for title in titles], dtype=np.int64)
+        missing = np.flatnonzero(positions < 0)
+        if len(missing) and len(self.names):
+            if self._matcher is None:
+                self._matcher = TitleMatcher(self.names)
+            matches, _ = self._matcher.match_many([titles[i] for i in missing])
+            positions[missing] = matches
+        return positions
+
+
+def link_titles(titles, names) -> np.ndarray:
+    return TitleLinker(names).link(titles)
+
+
+def to_rows(vectors: np.ndarray, positions: np.ndarray, n_rows: int) -> np.ndarray:
+    """
+    Average of the vectors linked to each row, zeros for the rows without any.
+    """
+    valid = positions >= 0
+    links = csr_matrix((np.ones(valid.sum(), dtype=np.float32), (positions[valid], np.flatnonzero(valid))), shape=(n_rows, len(vectors)))
+    counts = np.asarray(links.sum(axis=1)).ravel()
+    return np.asarray(diags(1.0 / np.maximum(counts, 1.0)) @ (links @ vectors), dtype=np.float32)
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return (vectors / np.where(norms > 0, norms, 1.0)).astype(np.float32)
+
+
+def ppmi(cooccurrence: csr_matrix, alpha: float = 0.75) -> csr_matrix:
+    """
+    Positive pointwise mutual information of a co-occurrence matrix, with the context counts smoothed by alpha.
+    Its factorization gives the same kind of vectors as skip-gram with negative sampling (Levy and Goldberg).
+    """
+    coo = cooccurrence.tocoo()
+    rows = np.asarray(cooccurrence.sum(axis=1)).ravel()
+    contexts = np.asarray(cooccurrence.sum(axis=0)).ravel() ** alpha
+    pmi = np.log(coo.data * contexts.sum() / (rows[coo.row] * contexts[coo.col]))
+    positive = pmi > 0
+    return csr_matrix((pmi[positive].astype(np.float32), (coo.row[positive], coo.col[positive])), shape=cooccurrence.shape)
+
+
+def svd_embedding(matrix: csr_matrix, dim: int, seed: int = 42) -> np.ndarray:
+    """
+    dim vectors u * sqrt(s) of the rows of matrix, unit length, zero padded when the matrix has a lower rank.
+    """
+    vectors = np.zeros((matrix.shape[0], dim), dtype=np.float32)
+    k = min(dim, *matrix.shape)
+    if matrix.nnz == 0 or k == 0:
+        return vectors
+    u, s, _ = randomized_svd(matrix, k, seed=seed)
+    vectors[:, : u.shape[1]] = u * np.sqrt(s[: u.shape[1]])
+    return normalize_rows(vectors)
+
+
+def window_cooccurrence(token_ids: np.ndarray, document_ids: np.ndarray, vocabulary_size: int, window: int) -> csr_matrix:
+    """
+    Symmetric counts of the words at most window tokens apart in the same document, weighted like the
+    dynamic window of word2vec: (window - distance + 1) / window.
+    """
+    rows, columns, weights = [], [], []
+    for distance in range(1, window + 1):
+        same = document_ids[distance:] == document_ids[:-distance]
+        rows.append(token_ids[:-distance][same])
+        columns.append(token_ids[distance:][same])
+        weights.append(np.full(same.sum(), (window - distance + 1) / window, dtype=np.float32))
+    counts = coo_matrix((np.concatenate(weights), (np.concatenate(rows), np.concatenate(columns))), shape=(vocabulary_size, vocabulary_size)).tocsr()
+    return (counts + counts.T).tocsr()
+
+
+def multi_hot(lists: list[list], size: int) -> tuple[np.ndarray, list[str]]:
+    """
+    Multi hot vectors over the size most frequent labels (ties in alphabetical order), labels are case folded.
+    """
+    lists = [sorted({str(label).strip().lower() for label in labels if str(label).strip()}) for labels in lists]
+    labels, counts = np.unique(np.array([label for labels in lists for label in labels] or [""], dtype=object), return_counts=True)
+    order = sorted(range(len(labels)), key=lambda i: (-counts[i], labels[i]))
+    vocabulary = [labels[i] for i in order if labels[i]][:size]
+    index = {label: i for i, label in enumerate(vocabulary)}
+    vectors = np.zeros((len(lists), size), dtype=np.float32)
+    for row, labels in enumerate(lists):
+        columns = [index[label] for label in labels if label in index]
+        vectors[row, columns] = 1.0
+    return vectors, vocabulary
+
+
+def min_max(values: np.ndarray, known: np.ndarray) -> tuple[np.ndarray, float, float]:
+    """
+    Scales the known values from 0 to 1, unknown values are 0.
+    """
+    if not known.any():
+        return np.zeros(len(values), dtype=np.float32), 0.0, 0.0
+    low, high = float(values[known].min()), float(values[known].max())
+    scaled = (values - low) / (high - low) if high > low else np.ones(len(values))
+    return np.where(known, scaled, 0.0).astype(np.float32), low, high
+
+
+class GameFeatureEncoder:
+    """
+    Fits every encoder of the game feature vector once over the games table and writes the
+    [n_games, M] float32 matrix with the column range of each block:
+        title (item2vec over the games reviewed by the same users), description (word2vec over the
+        description and keywords), multi hot genres, release year, multi hot platforms, tanh of the
+        time to beat, critic and user ratings, and the collaborative embedding.
+    Item2vec and word2vec are fit as the SVD of the PPMI co-occurrence matrix, the factorization
+    that skip-gram with negative sampling approximates, with the sparse routines already used by the
+    collaborative embedding.
+    """
+
+    def __init__(self, config: FeatureConfig = None):
+        self.config = FeatureConfig() if config is None else config
+        self.metadata = {}
+
+    @property
+    def blocks(self) -> list[tuple[str, int]]:
+        config = self.config
+        return [
+            (TITLE, config.title_dim),
+            (DESCRIPTION, config.description_dim),
+            (GENRES, config.genres),
+            (YEAR, 1),
+            (PLATFORMS, config.platforms),
+            (TIME_TO_BEAT, len(TIME_TO_BEAT_COLUMNS)),
+            (CRITIC_RATING, 1),
+            (USER_RATING, 1),
+            (COLLABORATIVE, config.collaborative_dim),
+        ]
+
+    def title_vectors(self, names: np.ndarray, reviews: InteractionMatrix) -> np.ndarray:
+        """
+        Item2vec: the games reviewed by the same user are the context of each other, each user weighted by
+        1 / (reviews - 1) so heavy reviewers do not dominate the co-occurrences.
+        """
+        dim = self.config.title_dim
+        if reviews is None or reviews.nnz == 0:
+            return np.zeros((len(names), dim), dtype=np.float32)
+        played = reviews.csr.copy()
+        played.data[:] = 1.0
+        counts = np.diff(played.indptr)
+        cooccurrence = (played.T @ diags(1.0 / np.maximum(counts - 1, 1)) @ played).tocsr()
+        cooccurrence.setdiag(0)
+        cooccurrence.eliminate_zeros()
+        item_vectors = svd_embedding(ppmi(cooccurrence) if cooccurrence.nnz else cooccurrence, dim, self.config.seed)
+        positions = link_titles(reviews.items, names)
+        self.metadata["title_linked"] = int((positions >= 0).sum())
+        return normalize_rows(to_rows(item_vectors, positions, len(names)))
+
+    def description_vectors(self, descriptions: list[str], keywords: list[list]) -> np.ndarray:
+        """
+        Word2vec: word vectors from the words around each word, each game is the average of its words.
+        """
+        config = self.config
+        documents = [tokenize(description) + [token for keyword in words for token in tokenize(keyword)] for description, words in zip(descriptions, keywords)]
+        tokens = np.array([token for document in documents for token in document] or [""], dtype=object)
+        words, counts = np.unique(tokens, return_counts=True)
+        order = [i for i in sorted(range(len(words)), key=lambda i: (-counts[i], words[i])) if counts[i] >= config.min_count and words[i]][: config.max_vocabulary]
+        vocabulary = {words[i]: n for n, i in enumerate(order)}
+        self.metadata["description_vocabulary"] = len(vocabulary)
+        if len(vocabulary) == 0:
+            return np.zeros((len(documents), config.description_dim), dtype=np.float32)
+
+        # Words out of the vocabulary are removed before the windows, like word2vec does
+        ids = [np.array([vocabulary[token] for token in document if token in vocabulary], dtype=np.int64) for document in documents]
+        lengths = np.array([len(document) for document in ids], dtype=np.int64)
+        token_ids = np.concatenate(ids)
+        document_ids = np.repeat(np.arange(len(ids)), lengths)
+        word_vectors = svd_embedding(ppmi(window_cooccurrence(token_ids, document_ids, len(vocabulary), config.window)), config.description_dim, config.seed)
+
+        # Bag of words @ word vectors, divided by the number of words
+        bag = csr_matrix((np.ones(len(token_ids), dtype=np.float32), (document_ids, token_ids)), shape=(len(ids), len(vocabulary)))
+        return normalize_rows(np.asarray(diags(1.0 / np.maximum(lengths, 1)) @ (bag @ word_vectors)))
+
+    def collaborative_vectors(self, names: np.ndarray, embeddings: pd.DataFrame) -> np.ndarray:
+        dim = self.config.collaborative_dim
+        if embeddings is None or len(embeddings) == 0:
+            return np.zeros((len(names), dim), dtype=np.float32)
+        vectors = np.zeros((len(embeddings), dim), dtype=np.float32)
+        stacked = np.stack([np.asarray(vector, dtype=np.float32) for vector in embeddings["svd_vector"]])
+        vectors[:, : min(dim, stacked.shape[1])] = stacked[:, :dim]
+        positions = link_titles(embeddings["game_name"], names)
+        self.metadata["collaborative_linked"] = int((positions >= 0).sum())
+        return to_rows(vectors, positions, len(names))
+
+    def fit_transform(self, games: pd.DataFrame, reviews: InteractionMatrix = None, embeddings: pd.DataFrame = None, out: np.ndarray = None) -> np.ndarray:
+        """
+        Encodes every game into out (a new array when it is None), block by block.
+        """
+        config = self.config
+        names = games["name"].astype(str).to_numpy()
+        n_games = len(games)
+        dim = sum(size for _, size in self.blocks)
+        out = np.zeros((n_games, dim), dtype=np.float32) if out is None else out
+        column = lambda name: games[name] if name in games.columns else pd.Series([None] * n_games)
+        number = lambda name: pd.to_numeric(column(name), errors="coerce").fillna(0.0).to_numpy(dtype=np.float64)
+
+        blocks = {}
+        blocks[TITLE] = self.title_vectors(names, reviews)
+        blocks[DESCRIPTION] = self.description_vectors(column("description").fillna("").astype(str).tolist(), [as_list(value) for value in column("keywords")])
+        blocks[GENRES], self.metadata["genres"] = multi_hot([as_list(value) for value in column("genres")], config.genres)
+
+        years = np.array([release_year(release) for release in column("release")], dtype=np.float64)
+        year, low, high = min_max(years, years > 0)
+        blocks[YEAR] = year[:, None]
+        self.metadata["year_range"] = [low, high]
+
+        blocks[PLATFORMS], self.metadata["platforms"] = multi_hot([as_list(value) for value in column("platforms")], config.platforms)
+        blocks[TIME_TO_BEAT] = np.tanh(np.stack([number(name) for name in TIME_TO_BEAT_COLUMNS], axis=1) / config.time_to_beat_scale).astype(np.float32)
+
+        critic = number("metacritic_rating")
+        critic, low, high = min_max(critic, critic > 0)
+        blocks[CRITIC_RATING] = critic[:, None]
+        self.metadata["critic_rating_range"] = [low, high]
+
+        # Average of the user ratings available for each game, then min max scaled
+        ratings = np.stack([number(name) for name in USER_RATING_COLUMNS], axis=1)
+        available = (ratings > 0).sum(axis=1)
+        user = ratings.sum(axis=1) / np.maximum(available, 1)
+        user, low, high = min_max(user, available > 0)
+        blocks[USER_RATING] = user[:, None]
+        self.metadata["user_rating_range"] = [low, high]
+
+        blocks[COLLABORATIVE] = self.collaborative_vectors(names, embeddings)
+
+        start = 0
+        for name, size in self.blocks:
+            out[:, start : start + size] = blocks[name]
+            start += size
+        return out
+
+
+class GameFeatures:
+    """
+    Cached feature matrix of the games, memory mapped, with the column range of each block and the game of each row.
+    Matrices are cached in cache_dir by the hash of the input tables and the encoder config, so a run
+    with the same inputs only maps the existing matrix, and latest.json points to the last one built.
+    """
+
+    def __init__(self, matrix: np.ndarray, metadata: dict):
+        self.matrix = matrix
+        self.metadata = metadata
+        self.names = np.asarray(metadata["names"], dtype=object)
+        self.blocks = {block["name"]: (block["start"], block["stop"]) for block in metadata["blocks"]}
+        self.key = metadata["key"]
+        self._linker = None
+
+    def __len__(self) -> int:
+        return len(self.matrix)
+
+    @property
+    def dim(self) -> int:
+        return self.matrix.shape[1]
+
+    def block(self, name: str) -> np.ndarray:
+        start, stop = self.blocks[name]
+        return self.matrix[:, start:stop]
+
+    def rows(self, titles) -> np.ndarray:
+        """
+        Row of each title (for example the game_name of the reviews), -1 when it is not in the table.
+        """
+        if self._linker is None:
+            self._linker = TitleLinker(self.names)
+        return self._linker.link(titles)
+
+    @classmethod
+    def load(cls, cache_dir: str = "./data/game_features", key: str = None, mmap: bool = True) -> "GameFeatures":
+        """
+        Loads the matrix of key, or the last one built when key is None.
+        """
+        if key is None:
+            with open(os.path.join(cache_dir, LATEST)) as f:
+                key = json.load(f)["key"]
+        with open(os.path.join(cache_dir, f"{key}.json")) as f:
+            metadata = json.load(f)
+        matrix = np.load(os.path.join(cache_dir, f"{key}.npy"), mmap_mode="r" if mmap else None)
+        return cls(matrix, metadata)
+
+    @classmethod
+    def build(cls, games_base: str = "./data/games", reviews_base: str = "./data/reviews", embeddings_path: str = "./data/game_embeddings.parquet", cache_dir: str = "./data/game_features", config: FeatureConfig = None, force: bool = False) -> "GameFeatures":
+        """
+        Returns the cached matrix of these inputs and config, encoding the games only when there is none.
+        """
+        config = FeatureConfig() if config is None else config
+        games_path = find_table(games_base)
+        reviews_path = find_table(reviews_base) if reviews_base is not None else None
+        embeddings_path = embeddings_path if embeddings_path is not None and os.path.exists(embeddings_path) else None
+        settings = json.dumps({"version": FEATURES_VERSION, "config": asdict(config)}, sort_keys=True)
+        key = hashlib.sha1((input_digest([games_path, reviews_path, embeddings_path]) + settings).encode()).hexdigest()[:16]
+        Path(cache_dir).mkdir(parents=True, exist_ok=True)
+
+        if force or not os.path.exists(os.path.join(cache_dir, f"{key}.json")):
+            games = read_table(games_path)
+            reviews = InteractionMatrix.load(reviews_base) if reviews_path is not None and os.path.exists(reviews_path) else None
+            embeddings = read_table(embeddings_path) if embeddings_path is not None else None
+            encoder = GameFeatureEncoder(config)
+            dim = sum(size for _, size in encoder.blocks)
+
+            # The matrix is written to a hidden file and renamed, then the metadata marks the cache entry as complete
+            tmp_filename = os.path.join(cache_dir, f".{key}.npy")
+            matrix = np.lib.format.open_memmap(tmp_filename, mode="w+", dtype=np.float32, shape=(len(games), dim))
+            encoder.fit_transform(games, reviews, embeddings, out=matrix)
+            matrix.flush()
+            del matrix
+            os.replace(tmp_filename, os.path.join(cache_dir, f"{key}.npy"))
+
+            blocks, start = [], 0
+            for name, size in encoder.blocks:
+                blocks.append({"name": name, "start": start, "stop": start + size})
+                start += size
+            metadata = {
+                "key": key,
+                "version": FEATURES_VERSION,
+                "config": asdict(config),
+                "created": datetime.now().isoformat(timespec="seconds"),
+                "inputs": {"games": games_path, "reviews": reviews_path, "embeddings": embeddings_path},
+                "shape": [len(games), dim],
+                "blocks": blocks,
+                "names": games["name"].astype(str).tolist(),
+                "encoders": encoder.metadata,
+            }
+            _write_json(os.path.join(cache_dir, f"{key}.json"), metadata)
+            print(f"Encoded {len(games)} games into {dim} features, cache {key}")
+        _write_json(os.path.join(cache_dir, LATEST), {"key": key})
+        return cls.load(cache_dir, key)
+
+
+def _write_json(filename: str, data: dict):
+    tmp_filename = os.path.join(os.path.dirname(filename), "." + os.path.basename(filename))
+    with open(tmp_filename, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp_filename, filename)
@@ -0,0 +1,489 @@
+import json
+import os
+import queue
+import threading
+import traceback
+from collections import deque
+from concurrent.futures import Future
+from dataclasses import asdict, dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import perf_counter
+from urllib.parse import unquote
+import numpy as np
+import pandas as pd
+from recommender.candidates import CandidateIndex, top_k
+from recommender.game_features import GameFeatures, as_list
+from recommender.user_encoders import AverageEncoder, UserEncoder
+from recommender.sessions import Session, SessionStore, narrower
+
+
+@dataclass
+class RecommendationRequest:
+    """
+    Cold start answers of a user: the games played (titles or rows of the feature matrix, in the order they were played),
+    their ratings from 0 to 10 (5, neutral, when not given) and the hard filters.
+    """
+
+    played: list = field(default_factory=list)
+    ratings: list = None
+    min_year: int = None
+    max_year: int = None
+    platforms: list = None
+    k: int = 5
+
+    def __post_init__(self):
+        # Requests come from JSON, a bad value would fail every request of its micro batch
+        self.played = [game if isinstance(game, (int, np.integer)) else str(game) for game in self.played]
+        self.ratings = None if self.ratings is None else [float(rating) for rating in self.ratings]
+        if self.ratings is not None and len(self.ratings) != len(self.played):
+            raise ValueError(f"{len(self.ratings)} ratings for {len(self.played)} games played")
+        self.min_year = None if self.min_year is None else int(self.min_year)
+        self.max_year = None if self.max_year is None else int(self.max_year)
+        self.platforms = None if self.platforms is None else [str(platform) for platform in self.platforms]
+        self.k = int(self.k)
+        if self.k < 1:
+            raise ValueError(f"k must be positive, got {self.k}")
+
+
+@dataclass
+class InteractionRequest(RecommendationRequest):
+    """
+    Follow up request of a user session (step 6 of ideia.txt): the games played since the last request with their ratings,
+    the games to leave out (not interested, or filtered out by the client: single player, developer...) and the filters.
+    The first request of a session (or after it expired) sends the whole history in played.
+    """
+
+    user: str = None
+    exclude: list = field(default_factory=list)
+
+    def __post_init__(self):
+        super().__post_init__()
+        if self.user is None or str(self.user) == "":
+            raise ValueError("user is required")
+        self.user = str(self.user)
+        self.exclude = [game if isinstance(game, (int, np.integer)) else str(game) for game in self.exclude]
+
+
+class SimilarityScorer:
+    """
+    Stub policy without a trained model: Q(s, a) is the inner product of the state and the game vector.
+    """
+
+    def score(self, states: np.ndarray, actions: np.ndarray, candidates: np.ndarray) -> np.ndarray:
+        return np.einsum("bd,bkd->bk", states, actions)
+
+
+class TorchScriptScorer:
+    """
+    Q function exported as TorchScript by the training, on CPU. It is forward(observations [N, dim], actions [N, dim]) -> q [N],
+    or forward(observations) -> q [N, n_games] for discrete algorithms (said by the q_function.json next to it).
+    """
+
+    def __init__(self, path: str, threads: int = None):
+        import torch
+
+        self.torch = torch
+        if threads:
+            torch.set_num_threads(threads)
+        self.model = torch.jit.load(path, map_location="cpu").eval()
+        info_filename = os.path.join(os.path.dirname(path), "q_function.json")
+        self.discrete = False
+        if os.path.exists(info_filename):
+            with open(info_filename) as f:
+                self.discrete = json.load(f).get("discrete", False)
+
+    def score(self, states: np.ndarray, actions: np.ndarray, candidates: np.ndarray) -> np.ndarray:
+        batch, k, dim = actions.shape
+        with self.torch.inference_mode():
+            if self.discrete:
+                q = self.model(self.torch.from_numpy(np.ascontiguousarray(states, dtype=np.float32))).numpy()
+                return np.take_along_axis(q, np.maximum(candidates, 0), axis=1)
+            observations = np.repeat(states, k, axis=0)
+            q = self.model(self.torch.from_numpy(observations), self.torch.from_numpy(np.ascontiguousarray(actions.reshape(batch * k, dim))))
+        return q.numpy().reshape(batch, k)
+
+
+class D3RLPyScorer:
+    """
+    Q function of a d3rlpy (1.x) algorithm saved with save_params (params.json) and save_model (model.pt), on CPU.
+    """
+
+    def __init__(self, algo):
+        self.algo = algo
+
+    @classmethod
+    def load(cls, params_path: str, model_path: str) -> "D3RLPyScorer":
+        import d3rlpy
+
+        with open(params_path) as f:
+            algorithm = json.load(f).get("algorithm", "CQL")
+        algo = getattr(d3rlpy.algos, algorithm).from_json(params_path, use_gpu=False)
+        algo.load_model(model_path)
+        return cls(algo)
+
+    def score(self, states: np.ndarray, actions: np.ndarray, candidates: np.ndarray) -> np.ndarray:
+        import d3rlpy
+
+        batch, k, dim = actions.shape
+        discrete = self.algo.get_action_type() == d3rlpy.constants.ActionSpace.DISCRETE
+        q = self.algo.predict_value(np.repeat(states, k, axis=0), np.maximum(candidates, 0).reshape(-1) if discrete else actions.reshape(batch * k, dim))
+        return np.asarray(q, dtype=np.float32).reshape(batch, k)
+
+
+class LocalHydrator:
+    """
+    Details of the recommended games from the local games table, a stub of the IGDB hydration.
+    """
+
+    COLUMNS = ["name", "release", "platforms", "genres", "description", "cover_url"]
+
+    def __init__(self, games: pd.DataFrame):
+        self.games = games
+
+    def hydrate(self, names: list[str], rows: list[int]) -> list[dict]:
+        details = []
+        for row in rows:
+            game = self.games.iloc[int(row)]
+            details.append({column: as_list(game[column]) if column in ["platforms", "genres", "cover_url"] else game[column] for column in self.COLUMNS if column in self.games.columns})
+        return details
+
+
+class IGDBHydrator:
+    """
+    Cover art, summary and release of the recommended games from IGDB, searched with a single multiquery.
+    Games not found keep only their name.
+    """
+
+    def __init__(self, igdb):
+        self.igdb = igdb
+
+    def hydrate(self, names: list[str], rows: list[int]) -> list[dict]:
+        results = self.igdb.search_many(names, max_n=1)
+        details = []
+        for name, games in zip(names, results):
+            if len(games) == 0:
+                details.append({"name": name})
+                continue
+            game = games[0]
+            details.append({"name": name, "igdb_name": game.name, "release": game.release, "platforms": game.platforms, "genres": game.genres, "description": game.description, "cover_url": game.cover_url})
+        return details
+
+
+class LatencyTracker:
+    """
+    Latencies of the last window requests, in milliseconds.
+    """
+
+    def __init__(self, window: int = 10_000):
+        self.latencies = deque(maxlen=window)
+        self.lock = threading.Lock()
+
+    def record(self, milliseconds: float):
+        with self.lock:
+            self.latencies.append(milliseconds)
+
+    def stats(self) -> dict:
+        with self.lock:
+            latencies = np.array(self.latencies, dtype=np.float64)
+        if len(latencies) == 0:
+            return {"count": 0}
+        p50, p99 = np.percentile(latencies, [50, 99])
+        return {"count": len(latencies), "p50_ms": round(float(p50), 3), "p99_ms": round(float(p99), 3), "max_ms": round(float(latencies.max()), 3)}
+
+
+class MicroBatcher:
+    """
+    Groups the items submitted by concurrent threads into batches for a single call of fn(items) -> results.
+    A batch is sent when it has max_batch_size items or max_wait_ms after its first item arrived.
+    """
+
+    def __init__(self, fn, max_batch_size: int = 32, max_wait_ms: float = 2.0):
+        self.fn = fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.queue = queue.Queue()
+        self.batch_sizes = deque(maxlen=10_000)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, item) -> Future:
+        future = Future()
+        self.queue.put((item, future))
+        return future
+
+    def _run(self):
+        while True:
+            first = self.queue.get()
+            if first is None:
+                return
+            batch = [first]
+            deadline = perf_counter() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                try:
+                    item = self.queue.get(timeout=max(0.0, deadline - perf_counter()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    self.queue.put(None)
+                    break
+                batch.append(item)
+            self.batch_sizes.append(len(batch))
+            try:
+                results = self.fn([item for item, _ in batch])
+                for (_, future), result in zip(batch, results):
+                    future.set_result(result)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+
+class RecommenderService:
+    """
+    In process recommendation pipeline of ideia.txt, everything loaded once:
+        1. the state s0 of the user is phi(H) of the user encoder the policy was trained with, by default the average
+           of the feature vectors of the games played (as in the MDP dataset)
+        2. the candidate index returns the n_candidates closest games that pass the year and platform filters
+        3. the policy scores the candidates of every request of a micro batch in one forward pass
+        4. the top k by Q value are hydrated (IGDB or the local stub)
+    Concurrent calls of recommend are grouped by a MicroBatcher, interact keeps the state of each user in the sessions.
+    """
+
+    def __init__(self, features: GameFeatures, index: CandidateIndex, scorer=None, hydrator=None, n_candidates: int = 100, max_batch_size: int = 32, max_wait_ms: float = 2.0, encoder: UserEncoder = None, sessions: SessionStore = None):
+        self.features = features
+        self.encoder = AverageEncoder(features.dim) if encoder is None else encoder
+        self.index = index
+        self.scorer = SimilarityScorer() if scorer is None else scorer
+        self.hydrator = hydrator
+        self.n_candidates = n_candidates
+        self.sessions = SessionStore() if sessions is None else sessions
+        self.latency = LatencyTracker()
+        self.session_latency = LatencyTracker()
+        self.batcher = MicroBatcher(self._recommend_batch, max_batch_size, max_wait_ms)
+        self.hydration_errors = 0
+        self.lock = threading.Lock()
+
+    def history(self, played: list, ratings: list = None) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Rows of the games played, given as rows or titles, and their rewards (rating - 5) / 5, the titles not found are dropped.
+        """
+        played = list(played)
+        titles = [i for i, game in enumerate(played) if not isinstance(game, (int, np.integer))]
+        rows = np.array([-1 if i in titles else int(game) for i, game in enumerate(played)], dtype=np.int64)
+        if titles:
+            rows[titles] = self.features.rows([played[i] for i in titles])
+        rewards = np.zeros(len(rows), dtype=np.float32) if ratings is None else (np.asarray(ratings, dtype=np.float32) - 5.0) / 5.0
+        found = (rows >= 0) & (rows < len(self.features))
+        return rows[found], rewards[found]
+
+    def rows(self, played: list) -> np.ndarray:
+        return self.history(played)[0]
+
+    def state(self, rows: np.ndarray, rewards: np.ndarray = None) -> np.ndarray:
+        """
+        State of the user encoder after the games played, in order.
+        """
+        vectors = np.asarray(self.features.matrix[rows], dtype=np.float32)
+        return self.encoder.output(self.encoder.fold(vectors, rewards))[0]
+
+    def _recommend_batch(self, requests: list[RecommendationRequest]) -> list[list[tuple[int, float]]]:
+        histories = [self.history(request.played, request.ratings) for request in requests]
+        played = [rows for rows, _ in histories]
+        states = np.stack([self.state(rows, rewards) for rows, rewards in histories])
+
+        # Candidates of each request, padded to n_candidates. The requests with the same filters are searched together
+        candidates = np.full((len(requests), self.n_candidates), -1, dtype=np.int64)
+        groups = {}
+        for i, request in enumerate(requests):
+            groups.setdefault((request.min_year, request.max_year, None if request.platforms is None else tuple(request.platforms)), []).append(i)
+        for (min_year, max_year, platforms), group in groups.items():
+            queries = np.stack([self.index.user_state(played[i]) for i in group])
+            candidates[group], _ = self.index.search(queries, k=self.n_candidates, min_year=min_year, max_year=max_year, platforms=platforms, exclude=[played[i] for i in group])
+
+        # One forward pass for all the candidates of all the requests
+        valid = candidates >= 0
+        actions = np.zeros((*candidates.shape, self.features.dim), dtype=np.float32)
+        actions[valid] = self.features.matrix[candidates[valid]]
+        q = self.scorer.score(states, actions, candidates)
+        q = np.where(valid, q, -np.inf)
+
+        results = []
+        for i, request in enumerate(requests):
+            best = top_k(q[i : i + 1], request.k)[0]
+            best = best[valid[i, best]]
+            results.append([(int(candidates[i, j]), float(q[i, j])) for j in best])
+        return results
+
+    def _games(self, ranked: list[tuple[int, float]], hydrate: bool) -> tuple[list[dict], bool]:
+        """
+        Names of the ranked games with their details, and if they were hydrated. When the hydrator fails (IGDB down or
+        throttled) the games are returned with their names only instead of failing the request.
+        """
+        games = [{"row": row, "name": str(self.features.names[row]), "q": q} for row, q in ranked]
+        if not hydrate or self.hydrator is None or not games:
+            return games, False
+        try:
+            hydrated = self.hydrator.hydrate([game["name"] for game in games], [game["row"] for game in games])
+        except Exception as e:
+            with self.lock:
+                self.hydration_errors += 1
+            print(f"Hydration failed, returning the games without details: {e!r}")
+            return games, False
+        for game, details in zip(games, hydrated):
+            game.update({key: value for key, value in details.items() if key != "name"})
+        return games, True
+
+    def recommend(self, request: RecommendationRequest, hydrate: bool = True) -> dict:
+        start = perf_counter()
+        ranked = self.batcher.submit(request).result()
+        games, hydrated = self._games(ranked, hydrate)
+        milliseconds = 1000 * (perf_counter() - start)
+        self.latency.record(milliseconds)
+        return {"games": games, "hydrated": hydrated, "latency_ms": round(milliseconds, 3)}
+
+    def _search(self, session: Session, filters: tuple):
+        """
+        New candidates of the session for the filters, ranked by the scorer.
+        """
+        min_year, max_year, platforms = filters
+        played = np.fromiter(session.played, dtype=np.int64, count=len(session.played))
+        candidates, _ = self.index.search(self.index.user_state(played), k=self.n_candidates, min_year=min_year, max_year=max_year, platforms=platforms, exclude=[session.removed()])
+        session.filters = filters
+        self._rank(session, candidates[0][candidates[0] >= 0])
+
+    def _rank(self, session: Session, candidates: np.ndarray):
+        actions = np.asarray(self.features.matrix[candidates], dtype=np.float32)
+        q = np.asarray(self.scorer.score(session.state[None], actions[None], candidates[None]), dtype=np.float32)[0]
+        order = np.argsort(-q, kind="stable")
+        session.candidates, session.scores = candidates[order], q[order]
+
+    def _pop(self, session: Session, filters: tuple, k: int) -> list[tuple[int, float]]:
+        """
+        Best k candidates left: the games played or excluded since are dropped from the session, the filters only masked.
+        """
+        kept = ~np.isin(session.candidates, session.removed())
+        if not kept.all():
+            session.candidates, session.scores = session.candidates[kept], session.scores[kept]
+        best = np.arange(len(session.candidates))
+        if filters != session.filters:
+            best = np.flatnonzero(self.index.allowed(*filters, rows=session.candidates))
+        return [(int(session.candidates[j]), float(session.scores[j])) for j in best[:k]]
+
+    def interact(self, request: InteractionRequest, hydrate: bool = True) -> dict:
+        """
+        Recommendations of a session, applying only the delta of the request to the session of the user:
+            - the new games played are folded into the hidden state of the encoder, one step each, and the candidates scored again
+            - the new exclusions and narrower filters only mask the ranked candidates
+            - the candidates are searched again for a new session, wider filters, or when fewer than k are left
+        The common case, games excluded or filters narrowed, pops the next best candidates without searching or scoring.
+        """
+        start = perf_counter()
+        session, created = self.sessions.get_or_create(request.user, lambda: Session(self.encoder.initial(1)))
+        update = "new" if created else "masked"
+        filters = (request.min_year, request.max_year, None if request.platforms is None else tuple(request.platforms))
+        with session.lock:
+            rows, rewards = self.history(request.played, request.ratings)
+            if len(rows):
+                session.hidden = self.encoder.fold(np.asarray(self.features.matrix[rows], dtype=np.float32), rewards, session.hidden)
+                session.played.update(rows.tolist())
+            if len(rows) or session.state is None:
+                session.state = self.encoder.output(session.hidden)[0]
+            session.excluded.update(self.rows(request.exclude).tolist())
+
+            if session.candidates is None or not narrower(session.filters, filters):
+                self._search(session, filters)
+                update = "new" if update == "new" else "searched"
+            elif len(rows):
+                self._rank(session, session.candidates)
+                update = "rescored"
+            ranked = self._pop(session, filters, request.k)
+            if len(ranked) < request.k and update not in ("new", "searched"):
+                self._search(session, filters)
+                ranked = self._pop(session, filters, request.k)
+                update = "searched"
+        self.sessions.put(request.user, session)
+
+        games, hydrated = self._games(ranked, hydrate)
+        milliseconds = 1000 * (perf_counter() - start)
+        self.session_latency.record(milliseconds)
+        return {"games": games, "hydrated": hydrated, "update": update, "latency_ms": round(milliseconds, 3)}
+
+    def stats(self) -> dict:
+        sizes = np.array(self.batcher.batch_sizes) if self.batcher.batch_sizes else np.zeros(1)
+        return {
+            **self.latency.stats(),
+            "mean_batch_size": round(float(sizes.mean()), 2),
+            "session_latency": self.session_latency.stats(),
+            "hydration_errors": self.hydration_errors,
+            **self.sessions.stats(),
+        }
+
+    def close(self):
+        self.batcher.close()
+
+
+class RecommendationHandler(BaseHTTPRequestHandler):
+    """
+    POST /recommend with the JSON of a RecommendationRequest, POST /session with the JSON of an InteractionRequest,
+    DELETE /session/<user> to end a session, GET /stats for the latency percentiles.
+    """
+
+    service: RecommenderService = None
+
+    def _send(self, status: int, data: dict):
+        body = json.dumps(data, default=str).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/stats":
+            self._send(200, self.service.stats())
+        elif self.path == "/health":
+            self._send(200, {"status": "ok"})
+        else:
+            self._send(404, {"error": f"Unknown path {self.path}"})
+
+    def do_POST(self):
+        requests = {"/recommend": (RecommendationRequest, self.service.recommend), "/session": (InteractionRequest, self.service.interact)}
+        if self.path not in requests:
+            self._send(404, {"error": f"Unknown path {self.path}"})
+            return
+        request_type, handle = requests[self.path]
+        try:
+            data = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            request = request_type(**{key: value for key, value in data.items() if key in request_type.__dataclass_fields__})
+        except (ValueError, TypeError) as e:
+            self._send(400, {"error": str(e)})
+            return
+        try:
+            response = handle(request)
+        except Exception as e:
+            # A scorer error, or one raised in the micro batch of the request, answers instead of dropping the connection
+            traceback.print_exc()
+            self._send(500, {"error": f"{type(e).__name__}: {e}"})
+            return
+        self._send(200, {"request": asdict(request), **response})
+
+    def do_DELETE(self):
+        if not self.path.startswith("/session/"):
+            self._send(404, {"error": f"Unknown path {self.path}"})
+            return
+        user = unquote(self.path[len("/session/") :])
+        self._send(200, {"user": user, "deleted": self.service.sessions.delete(user)})
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_server(service: RecommenderService, host: str = "127.0.0.1", port: int = 8000) -> ThreadingHTTPServer:
+    """
+    HTTP server of the service, one thread per connection so concurrent requests are micro batched together.
+    """
+    handler = type("Handler", (RecommendationHandler,), {"service": service})
+    return ThreadingHTTPServer((host, port), handler)
@@ -0,0 +1,107 @@
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+from dataset.storage import find_table, read_table
+
+
+def factorize(values) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Integer codes of values and the sorted unique values they index, missing values get -1.
+    """
+    values = pd.Series(values)
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        # Dictionary columns are already factorized, only the unused categories are dropped and the rest sorted
+        values = values.cat.remove_unused_categories()
+        categories = np.asarray(values.cat.categories, dtype=object)
+        order = np.argsort(categories)
+        remap = np.empty(len(order) + 1, dtype=np.int32)
+        remap[order] = np.arange(len(order), dtype=np.int32)
+        remap[-1] = -1
+        return remap[values.cat.codes.to_numpy()], categories[order]
+    codes, uniques = pd.factorize(values.astype(object), sort=True)
+    return codes.astype(np.int32), np.asarray(uniques, dtype=object)
+
+
+class InteractionMatrix:
+    """
+    Sparse users x items rating matrix built directly from (user, item, rating) triplets.
+    Users and items are factorized to integer indices, the maps in both directions are kept, and when a user
+    reviewed the same item more than once the maximum rating is used.
+    Memory is proportional to the number of ratings, there is never a dense users x items table.
+    """
+
+    def __init__(self, users, items, ratings):
+        user_codes, self.users = factorize(users)
+        item_codes, self.items = factorize(items)
+        self.user_index = {user: i for i, user in enumerate(self.users)}
+        self.item_index = {item: i for i, item in enumerate(self.items)}
+        self.matrix = self._build(user_codes, item_codes, np.asarray(ratings, dtype=np.float32))
+        self._csc = None
+
+    @classmethod
+    def from_reviews(cls, reviews: pd.DataFrame, user_column: str = "author", item_column: str = "game_name", rating_column: str = "score") -> "InteractionMatrix":
+        return cls(reviews[user_column], reviews[item_column], reviews[rating_column])
+
+    @classmethod
+    def load(cls, base: str = "./data/reviews", user_column: str = "author", item_column: str = "game_name", rating_column: str = "score") -> "InteractionMatrix":
+        """
+        Reads only the three needed columns of the reviews table.
+        """
+        reviews = read_table(find_table(base), columns=[user_column, item_column, rating_column])
+        return cls.from_reviews(reviews, user_column, item_column, rating_column)
+
+    def _build(self, rows: np.ndarray, cols: np.ndarray, values: np.ndarray) -> csr_matrix:
+        valid = (rows >= 0) & (cols >= 0) & ~np.isnan(values)
+        rows, cols, values = rows[valid], cols[valid], values[valid]
+
+        # Sort by cell and keep the maximum rating of each cell
+        cells = rows.astype(np.int64) * len(self.items) + cols
+        order = np.argsort(cells)
+        cells, values = cells[order], values[order]
+        starts = np.flatnonzero(np.r_[True, cells[1:] != cells[:-1]]) if len(cells) else np.array([], dtype=np.int64)
+        cells, values = cells[starts], np.maximum.reduceat(values, starts) if len(starts) else values
+
+        # Cells are sorted by row then column, so they are already in CSR order
+        rows = (cells // len(self.items)).astype(np.int32)
+        indptr = np.zeros(len(self.users) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=len(self.users)), out=indptr[1:])
+        indices = (cells % len(self.items)).astype(np.int32)
+        return csr_matrix((values, indices, indptr), shape=(len(self.users), len(self.items)))
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        return self.matrix.shape
+
+    @property
+    def nnz(self) -> int:
+        return self.matrix.nnz
+
+    @property
+    def csr(self) -> csr_matrix:
+        return self.matrix
+
+    @property
+    def csc(self):
+        if self._csc is None:
+            self._csc = self.matrix.tocsc()
+        return self._csc
+
+    def user_codes(self, users) -> np.ndarray:
+        """
+        Indices of users, -1 for the unknown ones.
+        """
+        return np.array([self.user_index.get(user, -1) for user in users], dtype=np.int32)
+
+    def item_codes(self, items) -> np.ndarray:
+        """
+        Indices of items, -1 for the unknown ones.
+        """
+        return np.array([self.item_index.get(item, -1) for item in items], dtype=np.int32)
+
+    def user_items(self, user) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Items rated by a user and their ratings.
+        """
+        row = self.user_index[user]
+        start, end = self.matrix.indptr[row], self.matrix.indptr[row + 1]
+        return self.items[self.matrix.indices[start:end]], self.matrix.data[start:end]
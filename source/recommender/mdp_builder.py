@@ -0,0 +1,87 @@
+from dataclasses import dataclass
+import numpy as np
+import pandas as pd
+from recommender.interactions import factorize
+
+
+@dataclass
+class Episodes:
+    """
+    Reviews of the games with a vector, sorted by user and time.
+    actions are rows of the game vectors matrix, episode_starts[i]:episode_starts[i + 1] are the steps of episode i
+    and terminals mark the last review of the user (it is 0 when that review was of a game without vector).
+    """
+
+    actions: np.ndarray
+    rewards: np.ndarray
+    terminals: np.ndarray
+    episode_starts: np.ndarray
+    users: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.actions)
+
+
+def build_episodes(reviews_df: pd.DataFrame, game_ids, user_column: str = "user_id", game_column: str = "game_id", rating_column: str = "rating", time_column: str = "timestamp") -> Episodes:
+    """
+    Sorts the reviews once by user and time (stable, ties keep their order) and keeps the games in game_ids,
+    the order of the rows of the game vectors matrix.
+    """
+    user_codes, users = factorize(reviews_df[user_column])
+    keys = [user_codes] if time_column not in reviews_df.columns else [reviews_df[time_column].to_numpy(), user_codes]
+    order = np.lexsort(keys) if len(keys) > 1 else np.argsort(user_codes, kind="stable")
+    user_codes = user_codes[order]
+
+    game_index = pd.Index(game_ids)
+    actions = game_index.get_indexer(reviews_df[game_column].to_numpy()[order]).astype(np.int32)
+    ratings = reviews_df[rating_column].to_numpy(dtype=np.float64)[order]
+
+    # The last review of each user, before dropping the games without vector
+    last = np.ones(len(user_codes), dtype=bool)
+    last[:-1] = user_codes[1:] != user_codes[:-1]
+
+    # Reviews without a user (code -1) are dropped like the NaN keys of a groupby
+    kept = (actions >= 0) & (user_codes >= 0)
+    user_codes = user_codes[kept]
+    episode_starts = np.flatnonzero(np.r_[True, user_codes[1:] != user_codes[:-1]]) if len(user_codes) else np.array([], dtype=np.int64)
+    return Episodes(
+        actions=actions[kept],
+        rewards=((ratings[kept] - 5.0) / 5.0).astype(np.float32),
+        terminals=last[kept].astype(np.float32),
+        episode_starts=np.r_[episode_starts, len(user_codes)].astype(np.int64),
+        users=users[user_codes[episode_starts]] if len(user_codes) else users[:0],
+    )
+
+
+def running_average_states(game_vectors: np.ndarray, episodes: Episodes, start: int = 0, end: int = None) -> np.ndarray:
+    """
+    State before each step in [start, end): the average of the vectors of the games played so far by the user,
+    zeros at the first step. Computed with cumulative sums restarted at the episode offsets.
+    """
+    end = len(episodes) if end is None else end
+    # Steps of each episode so far, from the episode offsets
+    episode = np.searchsorted(episodes.episode_starts, np.arange(start, end), side="right") - 1
+    played = np.arange(start, end) - episodes.episode_starts[episode]
+    first = int(episodes.episode_starts[episode[0]]) if end > start else start
+
+    # Cumulative sum from the start of the first episode in range, so the running sums are exact
+    vectors = game_vectors[episodes.actions[first:end]].astype(np.float64)
+    cumulative = np.zeros((end - first + 1, vectors.shape[1]), dtype=np.float64)
+    np.cumsum(vectors, axis=0, out=cumulative[1:])
+    steps = np.arange(start, end) - first
+    episode_offsets = episodes.episode_starts[episode] - first
+    sums = cumulative[steps] - cumulative[episode_offsets]
+    return (sums / np.maximum(played, 1)[:, None]).astype(np.float32)
+
+
+def build_transitions(reviews_df: pd.DataFrame, game_ids, game_vectors: np.ndarray, user_column: str = "user_id", game_column: str = "game_id", rating_column: str = "rating", time_column: str = "timestamp") -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Observations (average of the games played so far), actions (game vectors), rewards (rating - 5) / 5
+    and terminals of every review, as whole array operations.
+    Returns float32 arrays of shape (N, dim), (N, dim), (N, 1) and (N, 1).
+    """
+    game_vectors = np.asarray(game_vectors)
+    episodes = build_episodes(reviews_df, game_ids, user_column, game_column, rating_column, time_column)
+    observations = running_average_states(game_vectors, episodes)
+    actions = game_vectors[episodes.actions].astype(np.float32)
+    return observations, actions, episodes.rewards[:, None], episodes.terminals[:, None]
@@ -0,0 +1,374 @@
+import json
+import os
+from pathlib import Path
+import numpy as np
+from recommender.mdp_builder import Episodes, running_average_states
+
+MANIFEST = "manifest.json"
+# Arrays of each shard
+FIELDS = ["observations", "actions", "rewards", "terminals"]
+
+
+class ShardWriter:
+    """
+    Streams transitions to fixed width .npy shards of shard_size rows and a manifest.
+    Each shard is preallocated as a memmap, and the manifest is rewritten atomically when a shard is complete,
+    so a dataset being written is always readable up to its last complete shard.
+    Observations and actions are stored as dtype (float32 or float16), rewards and terminals as float32.
+    The episode_starts of the transitions (with the total as last offset), when given, are saved with the manifest.
+    """
+
+    def __init__(self, path: str, observation_dim: int, action_dim: int, dtype: str = "float32", shard_size: int = 1_000_000, episode_starts: np.ndarray = None):
+        self.path = path
+        self.dims = {"observations": observation_dim, "actions": action_dim, "rewards": 1, "terminals": 1}
+        self.dtypes = {"observations": dtype, "actions": dtype, "rewards": "float32", "terminals": "float32"}
+        self.shard_size = shard_size
+        self.shards = []
+        self.arrays = None
+        self.rows = 0
+        # Minimum and maximum of each action column, used by the action scalers
+        self.action_min = np.full(action_dim, np.inf, dtype=np.float64)
+        self.action_max = np.full(action_dim, -np.inf, dtype=np.float64)
+        Path(path).mkdir(parents=True, exist_ok=True)
+        self.episode_starts = None
+        if episode_starts is not None:
+            self.episode_starts = "episode_starts.npy"
+            tmp_filename = os.path.join(path, f".{self.episode_starts}")
+            np.save(tmp_filename, np.asarray(episode_starts, dtype=np.int64))
+            os.replace(tmp_filename, os.path.join(path, self.episode_starts))
+
+    def _filename(self, shard: int, field: str) -> str:
+        return f"shard-{shard:05d}-{field}.npy"
+
+    def _open_shard(self):
+        shard = len(self.shards)
+        self.arrays = {
+            field: np.lib.format.open_memmap(os.path.join(self.path, self._filename(shard, field)), mode="w+", dtype=self.dtypes[field], shape=(self.shard_size, self.dims[field]))
+            for field in FIELDS
+        }
+        self.rows = 0
+
+    def write(self, observations: np.ndarray, actions: np.ndarray, rewards: np.ndarray, terminals: np.ndarray):
+        data = {"observations": observations, "actions": actions, "rewards": np.reshape(rewards, (-1, 1)), "terminals": np.reshape(terminals, (-1, 1))}
+        if len(actions):
+            self.action_min = np.minimum(self.action_min, actions.min(axis=0))
+            self.action_max = np.maximum(self.action_max, actions.max(axis=0))
+        start = 0
+        while start < len(actions):
+            if self.arrays is None:
+                self._open_shard()
+            n = min(len(actions) - start, self.shard_size - self.rows)
+            for field in FIELDS:
+                self.arrays[field][self.rows : self.rows + n] = data[field][start : start + n]
+            self.rows += n
+            start += n
+            if self.rows == self.shard_size:
+                self._close_shard()
+
+    def _close_shard(self):
+        shard = len(self.shards)
+        for field in FIELDS:
+            self.arrays[field].flush()
+        if self.rows < self.shard_size:
+            # The last shard is rewritten with its exact size
+            for field in FIELDS:
+                filename = os.path.join(self.path, self._filename(shard, field))
+                tmp_filename = os.path.join(self.path, f".{self._filename(shard, field)}")
+                exact = np.lib.format.open_memmap(tmp_filename, mode="w+", dtype=self.dtypes[field], shape=(self.rows, self.dims[field]))
+                exact[:] = self.arrays[field][: self.rows]
+                exact.flush()
+                del exact
+                self.arrays[field] = None
+                os.replace(tmp_filename, filename)
+        self.arrays = None
+        self.shards.append({"rows": self.rows, "files": {field: self._filename(shard, field) for field in FIELDS}})
+        self._write_manifest()
+
+    def _write_manifest(self):
+        manifest = {
+            "rows": sum(shard["rows"] for shard in self.shards),
+            "dims": self.dims,
+            "dtypes": self.dtypes,
+            "shard_size": self.shard_size,
+            "shards": self.shards,
+            "action_min": self.action_min.tolist() if np.isfinite(self.action_min).all() else None,
+            "action_max": self.action_max.tolist() if np.isfinite(self.action_max).all() else None,
+            "episode_starts": self.episode_starts,
+        }
+        tmp_filename = os.path.join(self.path, f".{MANIFEST}")
+        with open(tmp_filename, "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_filename, os.path.join(self.path, MANIFEST))
+
+    def close(self):
+        if self.arrays is not None and self.rows > 0:
+            self._close_shard()
+        elif not self.shards:
+            self._write_manifest()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def write_episodes(path: str, game_vectors: np.ndarray, episodes: Episodes, dtype: str = "float32", shard_size: int = 1_000_000, chunk_size: int = 100_000) -> int:
+    """
+    Streams the transitions of episodes to a sharded dataset, building chunk_size observations at a time,
+    so the observations never need to fit in memory.
+    """
+    game_vectors = np.asarray(game_vectors)
+    with ShardWriter(path, game_vectors.shape[1], game_vectors.shape[1], dtype, shard_size, episodes.episode_starts) as writer:
+        for start in range(0, len(episodes), chunk_size):
+            end = min(start + chunk_size, len(episodes))
+            observations = running_average_states(game_vectors, episodes, start, end)
+            writer.write(observations, game_vectors[episodes.actions[start:end]], episodes.rewards[start:end], episodes.terminals[start:end])
+    return len(episodes)
+
+
+class ShardedMDPDataset:
+    """
+    Read only view of a sharded dataset: the shards are memory mapped and only the sampled rows are read.
+    The next observation of a step is the observation of the following row, or zeros when the step is terminal
+    or the last of its episode (datasets written without episode_starts only know the terminals).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, MANIFEST)) as f:
+            self.manifest = json.load(f)
+        self.shards = [{field: np.load(os.path.join(path, shard["files"][field]), mmap_mode="r")[: shard["rows"]] for field in FIELDS} for shard in self.manifest["shards"]]
+        self.offsets = np.r_[0, np.cumsum([shard["rows"] for shard in self.manifest["shards"]])].astype(np.int64)
+        self.observation_dim = self.manifest["dims"]["observations"]
+        self.action_dim = self.manifest["dims"]["actions"]
+        episode_starts = self.manifest.get("episode_starts")
+        self.episode_starts = None if episode_starts is None else np.load(os.path.join(path, episode_starts))
+
+    def __len__(self) -> int:
+        return int(self.offsets[-1])
+
+    @property
+    def action_min(self) -> np.ndarray:
+        return None if self.manifest["action_min"] is None else np.array(self.manifest["action_min"], dtype=np.float32)
+
+    @property
+    def action_max(self) -> np.ndarray:
+        return None if self.manifest["action_max"] is None else np.array(self.manifest["action_max"], dtype=np.float32)
+
+    def gather(self, field: str, indices: np.ndarray) -> np.ndarray:
+        """
+        Rows of field at the global indices, as float32.
+        """
+        out = np.empty((len(indices), self.manifest["dims"][field]), dtype=np.float32)
+        shard_ids = np.searchsorted(self.offsets, indices, side="right") - 1
+        for shard_id in np.unique(shard_ids):
+            positions = np.flatnonzero(shard_ids == shard_id)
+            # Sorted reads keep the page accesses sequential
+            local = indices[positions] - self.offsets[shard_id]
+            order = np.argsort(local)
+            out[positions[order]] = self.shards[shard_id][field][local[order]]
+        return out
+
+    def batch(self, indices: np.ndarray) -> dict:
+        indices = np.asarray(indices, dtype=np.int64)
+        terminals = self.gather("terminals", indices)
+        next_indices = np.minimum(indices + 1, len(self) - 1)
+        next_observations = self.gather("observations", next_indices)
+        ended = terminals[:, 0] > 0
+        if self.episode_starts is not None:
+            ended |= indices + 1 == self.episode_starts[np.searchsorted(self.episode_starts, indices, side="right")]
+        next_observations[ended] = 0.0
+        return {
+            "observations": self.gather("observations", indices),
+            "actions": self.gather("actions", indices),
+            "rewards": self.gather("rewards", indices),
+            "next_observations": next_observations,
+            "terminals": terminals,
+        }
+
+    def sample(self, batch_size: int, rng: np.random.Generator = None) -> dict:
+        """
+        Uniform minibatch of transitions.
+        """
+        rng = np.random.default_rng() if rng is None else rng
+        return self.batch(rng.integers(0, len(self), batch_size))
+
+    def iter_batches(self, batch_size: int):
+        """
+        All the transitions in order, batch_size at a time.
+        """
+        for start in range(0, len(self), batch_size):
+            yield self.batch(np.arange(start, min(start + batch_size, len(self))))
+
+
+def write_compact(path: str, episodes: Episodes, game_ids) -> int:
+    """
+    Saves the episodes as int32 game indices with the episode offsets, without any game vector.
+    The vectors come from a [n_games, dim] feature matrix given when the dataset is loaded.
+    """
+    Path(path).mkdir(parents=True, exist_ok=True)
+    arrays = {"actions": episodes.actions.astype(np.int32), "rewards": episodes.rewards, "terminals": episodes.terminals, "episode_starts": episodes.episode_starts}
+    for name, array in arrays.items():
+        tmp_filename = os.path.join(path, f".{name}.npy")
+        np.save(tmp_filename, array)
+        os.replace(tmp_filename, os.path.join(path, f"{name}.npy"))
+    manifest = {"format": "compact", "rows": len(episodes), "episodes": len(episodes.episode_starts) - 1, "game_ids": [str(game_id) for game_id in game_ids]}
+    tmp_filename = os.path.join(path, f".{MANIFEST}")
+    with open(tmp_filename, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_filename, os.path.join(path, MANIFEST))
+    return len(episodes)
+
+
+def write_states(path: str, name: str, encoder, game_vectors: np.ndarray, episodes: Episodes, chunk_size: int = 100_000) -> int:
+    """
+    Saves the state of a user encoder (recommender.user_encoders) before each step of a compact dataset as states-{name}.npy,
+    encoded chunk_size steps at a time. Loaded with CompactMDPDataset(..., states=name) instead of the averages.
+    """
+    n, dim = len(episodes.actions), encoder.dim
+    tmp_filename = os.path.join(path, f".states-{name}.npy")
+    states = np.lib.format.open_memmap(tmp_filename, mode="w+", dtype=np.float32, shape=(n, dim))
+    for start in range(0, n, chunk_size):
+        end = min(start + chunk_size, n)
+        states[start:end] = encoder.encode(game_vectors, episodes, start, end)
+    states.flush()
+    del states
+    os.replace(tmp_filename, os.path.join(path, f"states-{name}.npy"))
+    return n
+
+
+class BFloat16Matrix:
+    """
+    Matrix stored as bfloat16 (the upper 16 bits of each float32, as uint16), read back as float32.
+    Half the memory of float32 with its exponent range, NumPy has no bfloat16 type.
+    """
+
+    def __init__(self, matrix: np.ndarray):
+        matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+        # Round to nearest even before dropping the lower 16 bits
+        bits = matrix.view(np.uint32)
+        self.bits = ((bits + 0x7FFF + ((bits >> 16) & 1)) >> 16).astype(np.uint16)
+        self.shape = matrix.shape
+        self.dtype = np.dtype(np.float32)
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    def __getitem__(self, index) -> np.ndarray:
+        return (self.bits[index].astype(np.uint32) << 16).view(np.float32)
+
+
+def cast_features(features: np.ndarray, dtype: str = "float32"):
+    """
+    Feature matrix stored as float32, float16 or bfloat16, the rows gathered from it are always converted to float32 or wider.
+    """
+    if dtype == "bfloat16":
+        return BFloat16Matrix(features)
+    return np.asarray(features, dtype=dtype)
+
+
+class CompactMDPDataset:
+    """
+    Transitions stored as game indices: actions are rows of a shared [n_games, dim] feature matrix and the
+    history of a step is the slice of actions from the start of its episode, so the dataset has no vector at all.
+    Observations (average of the history) and action vectors are materialized only for the sampled minibatches,
+    and the feature matrix can be swapped without rebuilding the transitions.
+    Minibatches have the same fields as ShardedMDPDataset, plus the action_indices for discrete algorithms.
+    With states, the observations are the states of a user encoder saved by write_states instead of the averages.
+    """
+
+    def __init__(self, path: str, features: np.ndarray, mmap: bool = True, states: str = None):
+        self.path = path
+        with open(os.path.join(path, MANIFEST)) as f:
+            self.manifest = json.load(f)
+        mmap_mode = "r" if mmap else None
+        self.actions = np.load(os.path.join(path, "actions.npy"), mmap_mode=mmap_mode)
+        self.rewards = np.load(os.path.join(path, "rewards.npy"), mmap_mode=mmap_mode)
+        self.terminals = np.load(os.path.join(path, "terminals.npy"), mmap_mode=mmap_mode)
+        self.episode_starts = np.load(os.path.join(path, "episode_starts.npy"))
+        self.game_ids = self.manifest["game_ids"]
+        if len(features) != len(self.game_ids):
+            raise ValueError(f"The feature matrix has {len(features)} rows but the dataset has {len(self.game_ids)} games")
+        self.features = features
+        self.observation_dim = features.shape[1]
+        self.action_dim = features.shape[1]
+        self._action_range = None
+        self.observations = None
+        if states is not None:
+            self.observations = np.load(os.path.join(path, f"states-{states}.npy"), mmap_mode=mmap_mode)
+            if self.observations.shape != (len(self.actions), self.observation_dim):
+                raise ValueError(f"The {states} states have shape {self.observations.shape} but the dataset has {len(self.actions)} steps of {self.observation_dim} features")
+
+    def __len__(self) -> int:
+        return len(self.actions)
+
+    def _range(self) -> tuple[np.ndarray, np.ndarray]:
+        if self._action_range is None:
+            played = self.features[np.unique(self.actions)].astype(np.float32)
+            self._action_range = (played.min(axis=0), played.max(axis=0))
+        return self._action_range
+
+    @property
+    def action_min(self) -> np.ndarray:
+        return self._range()[0]
+
+    @property
+    def action_max(self) -> np.ndarray:
+        return self._range()[1]
+
+    def states(self, indices: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Average of the games played before each step and the number of those games.
+        """
+        episode = np.searchsorted(self.episode_starts, indices, side="right") - 1
+        starts = self.episode_starts[episode]
+        lengths = indices - starts
+        states = np.zeros((len(indices), self.observation_dim), dtype=np.float64)
+        played = np.flatnonzero(lengths > 0)
+        if len(played):
+            # Flat positions of all the histories, summed per step with reduceat
+            offsets = np.r_[0, np.cumsum(lengths[played])]
+            positions = np.repeat(starts[played] - offsets[:-1], lengths[played]) + np.arange(offsets[-1])
+            vectors = self.features[self.actions[positions]].astype(np.float64)
+            states[played] = np.add.reduceat(vectors, offsets[:-1], axis=0) / lengths[played, None]
+        return states, lengths
+
+    def batch(self, indices: np.ndarray) -> dict:
+        indices = np.asarray(indices, dtype=np.int64)
+        action_indices = self.actions[indices].astype(np.int64)
+        actions = self.features[action_indices].astype(np.float64)
+        terminals = self.terminals[indices].astype(np.float32)
+
+        if self.observations is None:
+            # The next state adds the action to the average
+            states, lengths = self.states(indices)
+            next_states = (states * lengths[:, None] + actions) / (lengths + 1)[:, None]
+        else:
+            states = self.observations[indices].astype(np.float64)
+            next_states = self.observations[np.minimum(indices + 1, len(self) - 1)].astype(np.float64)
+        # The next state is zeros after the last step of an episode
+        episode_ends = self.episode_starts[np.searchsorted(self.episode_starts, indices, side="right")]
+        next_states[(terminals > 0) | (indices + 1 == episode_ends)] = 0.0
+        return {
+            "observations": states.astype(np.float32),
+            "actions": actions.astype(np.float32),
+            "action_indices": action_indices,
+            "rewards": self.rewards[indices].astype(np.float32)[:, None],
+            "next_observations": next_states.astype(np.float32),
+            "terminals": terminals[:, None],
+        }
+
+    def sample(self, batch_size: int, rng: np.random.Generator = None) -> dict:
+        """
+        Uniform minibatch of transitions.
+        """
+        rng = np.random.default_rng() if rng is None else rng
+        return self.batch(rng.integers(0, len(self), batch_size))
+
+    def iter_batches(self, batch_size: int):
+        """
+        All the transitions in order, batch_size at a time.
+        """
+        for start in range(0, len(self), batch_size):
+            yield self.batch(np.arange(start, min(start + batch_size, len(self))))
@@ -0,0 +1,162 @@
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from time import monotonic
+import numpy as np
+
+# Approximate bytes of a session without its arrays, and of each game in its sets
+SESSION_BYTES = 1024
+SET_ENTRY_BYTES = 64
+
+
+def narrower(searched: tuple, filters: tuple) -> bool:
+    """
+    If every game passing filters (min_year, max_year, platforms) also passed the searched ones, so the searched
+    candidates only need to be masked.
+    """
+    min_year, max_year, platforms = searched
+    new_min_year, new_max_year, new_platforms = filters
+    return (
+        (min_year is None or (new_min_year is not None and new_min_year >= min_year))
+        and (max_year is None or (new_max_year is not None and new_max_year <= max_year))
+        and (platforms is None or (new_platforms is not None and set(new_platforms) <= set(platforms)))
+    )
+
+
+@dataclass
+class Session:
+    """
+    State of a user between the interactive requests: the hidden state of the user encoder and the state it maps to,
+    the games played and excluded, and the last candidates ranked by score (best first) with the filters of their search.
+    """
+
+    hidden: np.ndarray
+    state: np.ndarray = None
+    played: set = field(default_factory=set)
+    excluded: set = field(default_factory=set)
+    filters: tuple = None
+    candidates: np.ndarray = None
+    scores: np.ndarray = None
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+
+    def removed(self) -> np.ndarray:
+        """
+        Rows of the games played or excluded, never recommended again.
+        """
+        return np.fromiter(self.played | self.excluded, dtype=np.int64, count=len(self.played | self.excluded))
+
+    def nbytes(self) -> int:
+        arrays = [self.hidden, self.state, self.candidates, self.scores]
+        return SESSION_BYTES + sum(array.nbytes for array in arrays if array is not None) + SET_ENTRY_BYTES * (len(self.played) + len(self.excluded))
+
+
+class SessionStore:
+    """
+    Sessions by user, bounded to max_sessions and about max_bytes. A session not used for ttl seconds is dropped
+    when it is looked up or when another is stored, and the least recently used ones are evicted to stay in the bounds.
+    The sessions are kept in use order, so the expired ones are always the first ones.
+    """
+
+    def __init__(self, max_sessions: int = 100_000, max_bytes: int = 512 * 2**20, ttl: float = 1800.0, clock=monotonic):
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.clock = clock
+        # user -> (session, last use, bytes)
+        self.sessions = OrderedDict()
+        self.nbytes = 0
+        self.lock = threading.Lock()
+        self.counts = {"hits": 0, "misses": 0, "expired": 0, "evicted": 0}
+
+    def __len__(self) -> int:
+        return len(self.sessions)
+
+    def _remove(self, user: str):
+        _, _, nbytes = self.sessions.pop(user)
+        self.nbytes -= nbytes
+
+    def _evict(self, now: float):
+        while self.sessions:
+            user, (_, last_use, _) = next(iter(self.sessions.items()))
+            if now - last_use > self.ttl:
+                self.counts["expired"] += 1
+            elif len(self.sessions) > 1 and (len(self.sessions) > self.max_sessions or self.nbytes > self.max_bytes):
+                self.counts["evicted"] += 1
+            else:
+                break
+            self._remove(user)
+
+    def get(self, user: str) -> Session:
+        """
+        Session of the user, None when there is none or it expired.
+        """
+        with self.lock:
+            now = self.clock()
+            entry = self.sessions.get(user)
+            if entry is not None and now - entry[1] > self.ttl:
+                self._remove(user)
+                self.counts["expired"] += 1
+                entry = None
+            if entry is None:
+                self.counts["misses"] += 1
+                return None
+            self.counts["hits"] += 1
+            self.sessions[user] = (entry[0], now, entry[2])
+            self.sessions.move_to_end(user)
+            return entry[0]
+
+    def get_or_create(self, user: str, factory) -> tuple[Session, bool]:
+        """
+        Session of the user, or a new one from factory() stored under the lock, so concurrent first requests of a user
+        share the same session. Returns the session and if it was created.
+        """
+        session = self.get(user)
+        if session is not None:
+            return session, False
+        session = factory()
+        with self.lock:
+            now = self.clock()
+            entry = self.sessions.get(user)
+            if entry is not None and now - entry[1] <= self.ttl:
+                # Another request created it since
+                self.sessions[user] = (entry[0], now, entry[2])
+                self.sessions.move_to_end(user)
+                return entry[0], False
+            if entry is not None:
+                self._remove(user)
+                self.counts["expired"] += 1
+            nbytes = session.nbytes()
+            self.sessions[user] = (session, now, nbytes)
+            self.nbytes += nbytes
+            self._evict(now)
+            return session, True
+
+    def put(self, user: str, session: Session):
+        """
+        Stores the session (again, after it changed, so its size is counted again) as the most recently used.
+        """
+        nbytes = session.nbytes()
+        with self.lock:
+            if user in self.sessions:
+                self._remove(user)
+            self.sessions[user] = (session, self.clock(), nbytes)
+            self.nbytes += nbytes
+            self._evict(self.clock())
+
+    def delete(self, user: str) -> bool:
+        with self.lock:
+            if user not in self.sessions:
+                return False
+            self._remove(user)
+            return True
+
+    def purge(self):
+        """
+        Drops the expired sessions, for a periodic cleanup when few sessions are stored.
+        """
+        with self.lock:
+            self._evict(self.clock())
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"sessions": len(self.sessions), "session_bytes": self.nbytes, **self.counts}
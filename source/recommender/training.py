@@ -0,0 +1,205 @@
+import json
+import os
+import queue
+import shutil
+import tempfile
+import threading
+from pathlib import Path
+from time import perf_counter
+import numpy as np
+import torch
+import d3rlpy
+from d3rlpy.logger import D3RLPyLogger
+from recommender.d3rlpy_adapter import D3RLPyAdapter
+
+# Files of a saved policy
+PARAMS = "params.json"
+MODEL = "model.pt"
+Q_FUNCTION = "q_function.pt"
+Q_FUNCTION_INFO = "q_function.json"
+
+
+def set_torch_threads(intra_op: int = None, inter_op: int = None):
+    """
+    Threads of the CPU kernels (intra op) and of the independent ops (inter op).
+    The inter op threads can only be set before torch runs any parallel work.
+    """
+    if intra_op:
+        torch.set_num_threads(intra_op)
+    if inter_op:
+        try:
+            torch.set_num_interop_threads(inter_op)
+        except RuntimeError:
+            print(f"The inter op threads were already set to {torch.get_num_interop_threads()}")
+
+
+class PrefetchSampler:
+    """
+    Samples and converts the next minibatches in background threads while the algorithm updates on the current one.
+    Each worker has its own random generator, and sample_time is the time the workers spent building batches.
+    """
+
+    def __init__(self, adapter: D3RLPyAdapter, batch_size: int, prefetch: int = 4, workers: int = 1, seed: int = None):
+        self.adapter = adapter
+        self.batch_size = batch_size
+        self.queue = queue.Queue(maxsize=prefetch)
+        self.stop = threading.Event()
+        self.sample_time = 0.0
+        self.lock = threading.Lock()
+        seeds = np.random.SeedSequence(seed).spawn(workers)
+        self.threads = [threading.Thread(target=self._run, args=(np.random.default_rng(seeds[i]),), daemon=True) for i in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def _run(self, rng: np.random.Generator):
+        while not self.stop.is_set():
+            start = perf_counter()
+            minibatch = self.adapter.to_minibatch(self.adapter.sample(self.batch_size, rng))
+            with self.lock:
+                self.sample_time += perf_counter() - start
+            while not self.stop.is_set():
+                try:
+                    self.queue.put(minibatch, timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+
+    def next(self):
+        return self.queue.get()
+
+    def close(self):
+        self.stop.set()
+        for thread in self.threads:
+            thread.join()
+
+
+def save_params(algo: d3rlpy.base.LearnableBase, policy_dir: str):
+    """
+    params.json of the algorithm (with its action scaler), read back by from_json.
+    The d3rlpy logger only writes to a new directory, so it writes to a temporary one and the file is moved to policy_dir.
+    """
+    tmp_dir = tempfile.mkdtemp(dir=policy_dir, prefix=".params-")
+    try:
+        logger = D3RLPyLogger("params", root_dir=tmp_dir, verbose=False, with_timestamp=False)
+        algo.save_params(logger)
+        logger.close()
+        os.replace(os.path.join(tmp_dir, "params", PARAMS), os.path.join(policy_dir, PARAMS))
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+class QFunction(torch.nn.Module):
+    """
+    Q(observations, actions) of a continuous algorithm, the mean of the ensemble like predict_value, with its action scaler.
+    """
+
+    def __init__(self, q_function, action_scaler=None):
+        super().__init__()
+        self.q_function = q_function
+        self.action_scaler = action_scaler
+
+    def forward(self, observations: torch.Tensor, actions: torch.Tensor) -> torch.Tensor:
+        if self.action_scaler is not None:
+            actions = self.action_scaler.transform(actions)
+        return self.q_function(observations, actions, "mean").view(-1)
+
+
+class DiscreteQFunction(torch.nn.Module):
+    """
+    Q values of every game for the observations, [N, n_games], of a discrete algorithm, the mean of the ensemble.
+    """
+
+    def __init__(self, q_function):
+        super().__init__()
+        self.q_function = q_function
+
+    def forward(self, observations: torch.Tensor) -> torch.Tensor:
+        return self.q_function(observations, "mean")
+
+
+def export_q_function(algo: d3rlpy.base.LearnableBase, path: str, discrete: bool = False):
+    """
+    Traces the Q function of the algorithm to TorchScript on CPU, loaded by the inference TorchScriptScorer.
+    The side file q_function.json says if it takes (observations, actions) or only observations (discrete).
+    """
+    impl = algo.impl
+    observation_dim = impl.observation_shape[0]
+    module = DiscreteQFunction(impl.q_function) if discrete else QFunction(impl.q_function, impl.action_scaler)
+    module = module.to("cpu").eval()
+    observations = torch.zeros((2, observation_dim), dtype=torch.float32)
+    with torch.no_grad():
+        example = (observations,) if discrete else (observations, torch.zeros((2, impl.action_size), dtype=torch.float32))
+        traced = torch.jit.trace(module, example, check_trace=False)
+    tmp_filename = os.path.join(os.path.dirname(path), "." + os.path.basename(path))
+    traced.save(tmp_filename)
+    os.replace(tmp_filename, path)
+    with open(os.path.join(os.path.dirname(path), Q_FUNCTION_INFO), "w") as f:
+        json.dump({"discrete": discrete, "algorithm": algo.__class__.__name__, "observation_dim": observation_dim, "action_size": impl.action_size}, f)
+
+
+def train(algo: d3rlpy.base.LearnableBase, adapter: D3RLPyAdapter, n_steps: int, policy_dir: str, batch_size: int = None, prefetch: int = 4, workers: int = 1, checkpoint_every: int = 5000, log_every: int = 1000, seed: int = None, evaluate=None) -> list[dict]:
+    """
+    Runs n_steps updates on minibatches prefetched in background threads, on CPU.
+    Every checkpoint_every steps the model is saved to policy_dir/checkpoints and as policy_dir/model.pt, evaluate(algo)
+    (when given) returns the metrics of the checkpoint, appended to policy_dir/evaluation.jsonl,
+    and at the end the Q function is exported as TorchScript. Every log_every steps prints the steps per second and
+    how the time went: waiting for minibatches (data loading is the bottleneck) or updating (compute is).
+    """
+    batch_size = algo.batch_size if batch_size is None else batch_size
+    adapter.build(algo)
+    checkpoint_dir = os.path.join(policy_dir, "checkpoints")
+    Path(checkpoint_dir).mkdir(parents=True, exist_ok=True)
+    save_params(algo, policy_dir)
+
+    sampler = PrefetchSampler(adapter, batch_size, prefetch, workers, seed)
+    history = []
+    wait_time, update_time, last_sample_time = 0.0, 0.0, 0.0
+    window_start, window_steps = perf_counter(), 0
+    try:
+        for step in range(1, n_steps + 1):
+            start = perf_counter()
+            minibatch = sampler.next()
+            loaded = perf_counter()
+            loss = algo.update(minibatch)
+            wait_time += loaded - start
+            update_time += perf_counter() - loaded
+            window_steps += 1
+
+            if step % log_every == 0 or step == n_steps:
+                elapsed = perf_counter() - window_start
+                sample_time = sampler.sample_time - last_sample_time
+                stats = {
+                    "step": step,
+                    "steps_per_sec": window_steps / elapsed,
+                    "wait_fraction": wait_time / elapsed,
+                    "update_fraction": update_time / elapsed,
+                    "sample_ms_per_batch": 1000 * sample_time / window_steps,
+                    **loss,
+                }
+                history.append(stats)
+                print(
+                    f"step {step}: {stats['steps_per_sec']:.1f} steps/s, waiting for data {100 * stats['wait_fraction']:.0f}%, "
+                    f"updating {100 * stats['update_fraction']:.0f}%, sampling {stats['sample_ms_per_batch']:.2f} ms/batch, "
+                    + ", ".join(f"{name}={value:.4f}" for name, value in loss.items())
+                )
+                window_start, window_steps, wait_time, update_time, last_sample_time = perf_counter(), 0, 0.0, 0.0, sampler.sample_time
+
+            if step % checkpoint_every == 0 or step == n_steps:
+                checkpoint_start = perf_counter()
+                checkpoint = os.path.join(checkpoint_dir, f"model_{step}.pt")
+                algo.save_model(checkpoint)
+                shutil.copyfile(checkpoint, os.path.join(policy_dir, f".{MODEL}"))
+                os.replace(os.path.join(policy_dir, f".{MODEL}"), os.path.join(policy_dir, MODEL))
+                if evaluate is not None:
+                    metrics = {"step": step, **evaluate(algo)}
+                    print(f"step {step} evaluation: " + ", ".join(f"{name}={value:.4f}" for name, value in metrics.items() if name != "step"))
+                    with open(os.path.join(policy_dir, "evaluation.jsonl"), "a") as f:
+                        f.write(json.dumps(metrics) + "\n")
+                # Saving and evaluating are not part of the steps per second
+                window_start += perf_counter() - checkpoint_start
+    finally:
+        sampler.close()
+
+    export_q_function(algo, os.path.join(policy_dir, Q_FUNCTION), adapter.discrete)
+    print(f"Saved {os.path.join(policy_dir, MODEL)} and the TorchScript {os.path.join(policy_dir, Q_FUNCTION)}")
+    return history
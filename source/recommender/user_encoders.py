@@ -0,0 +1,255 @@
+import json
+import os
+from abc import ABC, abstractmethod
+from pathlib import Path
+import numpy as np
+from recommender.mdp_builder import Episodes, running_average_states
+
+# Files of a saved encoder
+CONFIG = "encoder.json"
+WEIGHTS = "encoder.npz"
+
+
+def sigmoid(x: np.ndarray) -> np.ndarray:
+    return 0.5 * (1.0 + np.tanh(0.5 * x))
+
+
+def layer_norm(x: np.ndarray, weight: np.ndarray, bias: np.ndarray, eps: float = 1e-5) -> np.ndarray:
+    mean = x.mean(axis=-1, keepdims=True)
+    variance = x.var(axis=-1, keepdims=True)
+    return (x - mean) / np.sqrt(variance + eps) * weight + bias
+
+
+def softmax(x: np.ndarray, axis: int = -1) -> np.ndarray:
+    x = np.exp(x - x.max(axis=axis, keepdims=True))
+    return x / x.sum(axis=axis, keepdims=True)
+
+
+class UserEncoder(ABC):
+    """
+    User state phi(H) of a history H of (game vector, reward), in the space of the game vectors.
+    The history is folded one game at a time into a fixed size hidden state (step), so adding a review costs the same
+    whatever the length of the history, and output maps the hidden states to the states of the MDP.
+    hidden[:, 0] is the number of games folded, the state of an empty history is zeros like in the datasets.
+    The weights are NumPy arrays (trained by recommender.encoder_training), the encoders run without torch.
+    """
+
+    kind = None
+
+    def __init__(self, dim: int, params: dict = None, **config):
+        self.dim = dim
+        self.params = {} if params is None else {name: np.asarray(value, dtype=np.float32) for name, value in params.items()}
+        self.config = config
+
+    @property
+    @abstractmethod
+    def hidden_size(self) -> int:
+        pass
+
+    def initial(self, n: int = 1) -> np.ndarray:
+        return np.zeros((n, self.hidden_size), dtype=np.float32)
+
+    @abstractmethod
+    def step(self, hidden: np.ndarray, vectors: np.ndarray, rewards: np.ndarray) -> np.ndarray:
+        """
+        New hidden states after one more game of each row, the hidden states given are not modified.
+        """
+
+    @abstractmethod
+    def _output(self, hidden: np.ndarray) -> np.ndarray:
+        pass
+
+    def output(self, hidden: np.ndarray) -> np.ndarray:
+        states = np.asarray(self._output(hidden), dtype=np.float32)
+        states[hidden[:, 0] == 0] = 0.0
+        return states
+
+    def fold(self, vectors: np.ndarray, rewards: np.ndarray = None, hidden: np.ndarray = None) -> np.ndarray:
+        """
+        Hidden state [1, hidden_size] of one user after the games of the history, in order, from hidden (empty by default).
+        """
+        hidden = self.initial(1) if hidden is None else hidden
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        rewards = np.zeros(len(vectors), dtype=np.float32) if rewards is None else np.asarray(rewards, dtype=np.float32)
+        for i in range(len(vectors)):
+            hidden = self.step(hidden, vectors[i : i + 1], rewards[i : i + 1])
+        return hidden
+
+    def encode(self, game_vectors: np.ndarray, episodes: Episodes, start: int = 0, end: int = None) -> np.ndarray:
+        """
+        State before each step in [start, end), like running_average_states. The episodes in range are folded together,
+        the longest first, so each time step is one call of step over the episodes still running.
+        """
+        end = len(episodes.actions) if end is None else end
+        if end <= start:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        first_episode = np.searchsorted(episodes.episode_starts, start, side="right") - 1
+        last_episode = np.searchsorted(episodes.episode_starts, end - 1, side="right") - 1
+        begins = np.asarray(episodes.episode_starts[first_episode : last_episode + 1], dtype=np.int64)
+        lengths = np.minimum(np.asarray(episodes.episode_starts[first_episode + 1 : last_episode + 2], dtype=np.int64), end) - begins
+        order = np.argsort(-lengths, kind="stable")
+        begins, lengths = begins[order], lengths[order]
+
+        first = int(begins.min())
+        states = np.zeros((end - first, self.dim), dtype=np.float32)
+        hidden = self.initial(len(begins))
+        for t in range(int(lengths[0])):
+            n = int(np.searchsorted(-lengths, -t, side="left"))
+            rows = begins[:n] + t
+            states[rows - first] = self.output(hidden[:n])
+            if t + 1 < lengths[0]:
+                actions = np.asarray(episodes.actions[rows], dtype=np.int64)
+                hidden[:n] = self.step(hidden[:n], np.asarray(game_vectors[actions], dtype=np.float32), np.asarray(episodes.rewards[rows], dtype=np.float32))
+        return states[start - first :]
+
+    def save(self, path: str):
+        Path(path).mkdir(parents=True, exist_ok=True)
+        tmp_filename = os.path.join(path, f".{WEIGHTS}")
+        with open(tmp_filename, "wb") as f:
+            np.savez(f, **self.params)
+        os.replace(tmp_filename, os.path.join(path, WEIGHTS))
+        with open(os.path.join(path, CONFIG), "w") as f:
+            json.dump({"kind": self.kind, "dim": self.dim, **self.config}, f)
+
+
+class AverageEncoder(UserEncoder):
+    """
+    Average of the vectors of the games played, the state of mdp_generation.py. The hidden state is the count and the sum.
+    """
+
+    kind = "average"
+
+    @property
+    def hidden_size(self) -> int:
+        return 1 + self.dim
+
+    def step(self, hidden: np.ndarray, vectors: np.ndarray, rewards: np.ndarray) -> np.ndarray:
+        hidden = hidden.copy()
+        hidden[:, 0] += 1
+        hidden[:, 1:] += vectors
+        return hidden
+
+    def _output(self, hidden: np.ndarray) -> np.ndarray:
+        return hidden[:, 1:] / np.maximum(hidden[:, :1], 1)
+
+    def fold(self, vectors: np.ndarray, rewards: np.ndarray = None, hidden: np.ndarray = None) -> np.ndarray:
+        hidden = self.initial(1) if hidden is None else hidden.copy()
+        vectors = np.asarray(vectors, dtype=np.float64).reshape(-1, self.dim)
+        hidden[:, 0] += len(vectors)
+        hidden[:, 1:] += vectors.sum(axis=0)
+        return hidden
+
+    def encode(self, game_vectors: np.ndarray, episodes: Episodes, start: int = 0, end: int = None) -> np.ndarray:
+        return running_average_states(game_vectors, episodes, start, end)
+
+
+class GRUEncoder(UserEncoder):
+    """
+    GRU over the games played, the input of each step is [game vector, reward] (same gates as torch.nn.GRUCell),
+    and the state is a linear map of the last hidden state.
+    """
+
+    kind = "gru"
+
+    def __init__(self, dim: int, params: dict = None, units: int = 128):
+        super().__init__(dim, params, units=units)
+        self.units = units
+
+    @property
+    def hidden_size(self) -> int:
+        return 1 + self.units
+
+    def step(self, hidden: np.ndarray, vectors: np.ndarray, rewards: np.ndarray) -> np.ndarray:
+        p, units = self.params, self.units
+        h = hidden[:, 1:]
+        x = np.concatenate([vectors, rewards[:, None]], axis=1)
+        gates_x = x @ p["cell.weight_ih"].T + p["cell.bias_ih"]
+        gates_h = h @ p["cell.weight_hh"].T + p["cell.bias_hh"]
+        reset = sigmoid(gates_x[:, :units] + gates_h[:, :units])
+        update = sigmoid(gates_x[:, units : 2 * units] + gates_h[:, units : 2 * units])
+        candidate = np.tanh(gates_x[:, 2 * units :] + reset * gates_h[:, 2 * units :])
+        new = np.empty_like(hidden)
+        new[:, 0] = hidden[:, 0] + 1
+        new[:, 1:] = (1.0 - update) * candidate + update * h
+        return new
+
+    def _output(self, hidden: np.ndarray) -> np.ndarray:
+        return hidden[:, 1:] @ self.params["out.weight"].T + self.params["out.bias"]
+
+
+class SASRecEncoder(UserEncoder):
+    """
+    SASRec style causal transformer (pre layer norm) where each game attends to the last window games, itself included,
+    with a learned embedding of its position in the history (capped at max_position).
+    The hidden state keeps the keys and values of the last window games of every layer in a ring buffer and the output of
+    the last game, so a new game is one attention over the window per layer, not a pass over the whole history.
+    """
+
+    kind = "sasrec"
+
+    def __init__(self, dim: int, params: dict = None, model_dim: int = 64, heads: int = 2, layers: int = 2, window: int = 50, max_position: int = 200):
+        super().__init__(dim, params, model_dim=model_dim, heads=heads, layers=layers, window=window, max_position=max_position)
+        self.model_dim = model_dim
+        self.heads = heads
+        self.layers = layers
+        self.window = window
+        self.max_position = max_position
+
+    @property
+    def hidden_size(self) -> int:
+        return 1 + self.model_dim + self.layers * self.window * 2 * self.model_dim
+
+    def step(self, hidden: np.ndarray, vectors: np.ndarray, rewards: np.ndarray) -> np.ndarray:
+        p, d, window = self.params, self.model_dim, self.window
+        n, head_dim = len(hidden), self.model_dim // self.heads
+        count = hidden[:, 0].astype(np.int64)
+        cache = hidden[:, 1 + d :].reshape(n, self.layers, window, 2, d).copy()
+        rows, slot = np.arange(n), count % window
+        valid = np.arange(window)[None, :] < np.minimum(count + 1, window)[:, None]
+
+        x = np.concatenate([vectors, rewards[:, None]], axis=1)
+        h = x @ p["input.weight"].T + p["input.bias"] + p["positions.weight"][np.minimum(count, self.max_position - 1)]
+        for layer in range(self.layers):
+            name = f"layers.{layer}."
+            a = layer_norm(h, p[name + "norm1.weight"], p[name + "norm1.bias"])
+            cache[rows, layer, slot, 0] = a @ p[name + "key.weight"].T + p[name + "key.bias"]
+            cache[rows, layer, slot, 1] = a @ p[name + "value.weight"].T + p[name + "value.bias"]
+            query = (a @ p[name + "query.weight"].T + p[name + "query.bias"]).reshape(n, self.heads, head_dim)
+            keys = cache[:, layer, :, 0].reshape(n, window, self.heads, head_dim)
+            values = cache[:, layer, :, 1].reshape(n, window, self.heads, head_dim)
+            scores = np.einsum("nhe,nwhe->nhw", query, keys) / np.sqrt(head_dim)
+            weights = softmax(np.where(valid[:, None, :], scores, -np.inf))
+            attention = np.einsum("nhw,nwhe->nhe", weights, values).reshape(n, d)
+            h = h + attention @ p[name + "attention_out.weight"].T + p[name + "attention_out.bias"]
+            f = layer_norm(h, p[name + "norm2.weight"], p[name + "norm2.bias"])
+            h = h + np.maximum(f @ p[name + "feed_forward1.weight"].T + p[name + "feed_forward1.bias"], 0.0) @ p[name + "feed_forward2.weight"].T + p[name + "feed_forward2.bias"]
+
+        new = np.empty_like(hidden)
+        new[:, 0] = count + 1
+        new[:, 1 : 1 + d] = h
+        new[:, 1 + d :] = cache.reshape(n, -1)
+        return new
+
+    def _output(self, hidden: np.ndarray) -> np.ndarray:
+        p = self.params
+        h = layer_norm(hidden[:, 1 : 1 + self.model_dim], p["norm.weight"], p["norm.bias"])
+        return h @ p["out.weight"].T + p["out.bias"]
+
+
+ENCODERS = {encoder.kind: encoder for encoder in [AverageEncoder, GRUEncoder, SASRecEncoder]}
+
+
+def load_encoder(path: str = None, dim: int = None) -> UserEncoder:
+    """
+    Encoder saved in path, or the AverageEncoder of dim when there is none.
+    """
+    if path is None or not os.path.exists(os.path.join(path, CONFIG)):
+        if dim is None:
+            raise FileNotFoundError(f"No user encoder in {path}")
+        return AverageEncoder(dim)
+    with open(os.path.join(path, CONFIG)) as f:
+        config = json.load(f)
+    weights_filename = os.path.join(path, WEIGHTS)
+    params = dict(np.load(weights_filename)) if os.path.exists(weights_filename) else {}
+    encoder = ENCODERS[config.pop("kind")]
+    return encoder(config.pop("dim"), params, **config)
@@ -0,0 +1,70 @@
+import sys
+import os
+import tempfile
+from pathlib import Path
+import numpy as np
+import d3rlpy
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from recommender.mdp_builder import Episodes
+from recommender.mdp_storage import CompactMDPDataset, write_compact
+from recommender.d3rlpy_adapter import D3RLPyAdapter
+from recommender.training import train
+from recommender.evaluation import OfflineEvaluator, split_episodes
+from recommender.inference import D3RLPyScorer, TorchScriptScorer
+from train_policy import createAlgorithm
+
+
+def toyDataset(path: str, nGames: int, nUsers: int, nReviews: int, dim: int, rng: np.random.Generator) -> CompactMDPDataset:
+    """
+    Random compact dataset with random game vectors, a few reviews per user.
+    """
+    features = rng.standard_normal((nGames, dim)).astype(np.float32)
+    starts = np.r_[0, np.sort(rng.choice(np.arange(1, nReviews), nUsers - 1, replace=False)), nReviews]
+    terminals = np.zeros(nReviews, dtype=np.float32)
+    terminals[starts[1:] - 1] = 1.0
+    episodes = Episodes(
+        actions=rng.integers(0, nGames, nReviews).astype(np.int32),
+        rewards=rng.uniform(-1, 1, nReviews).astype(np.float32),
+        terminals=terminals,
+        episode_starts=starts,
+        users=np.arange(nUsers),
+    )
+    write_compact(path, episodes, range(nGames))
+    return CompactMDPDataset(path, features)
+
+
+if __name__ == "__main__":
+    # Parameters
+    algorithms = ["CQL", "DiscreteCQL"]
+    nSteps = 20  # a few updates, only the training, checkpoint and export paths are checked
+    batchSize = 32
+    gamma = 0.3
+    seed = 42
+
+    # Short training of each algorithm on a toy dataset, then the exported TorchScript Q function must give the same
+    # values as the d3rlpy model it was exported from and as the saved params.json + model.pt loaded back
+    d3rlpy.seed(seed)
+    rng = np.random.default_rng(seed)
+    with tempfile.TemporaryDirectory() as root:
+        dataset = toyDataset(os.path.join(root, "mdp_dataset"), nGames=50, nUsers=100, nReviews=2000, dim=8, rng=rng)
+        heldOut = split_episodes(dataset.episode_starts, 0.2, seed)
+        evaluator = OfflineEvaluator(dataset, None, gamma=gamma, seed=seed)
+        for algorithm in algorithms:
+            policyDir = os.path.join(root, algorithm)
+            adapter = D3RLPyAdapter(dataset, gamma=gamma, seed=seed, discrete=algorithm != "CQL", indices=np.flatnonzero(~heldOut))
+            algo = createAlgorithm(algorithm, adapter, batchSize, gamma)
+            train(algo, adapter, nSteps, policyDir, prefetch=2, checkpoint_every=nSteps // 2, log_every=nSteps // 2, seed=seed, evaluate=lambda algo: evaluator.evaluate(heldOut, scorer=D3RLPyScorer(algo)))
+
+            states = rng.standard_normal((4, dataset.observation_dim)).astype(np.float32)
+            candidates = rng.integers(0, len(dataset.game_ids), (4, 10))
+            actions = np.asarray(dataset.features[candidates.reshape(-1)], dtype=np.float32).reshape(*candidates.shape, -1)
+            exported = TorchScriptScorer(os.path.join(policyDir, "q_function.pt")).score(states, actions, candidates)
+            trained = D3RLPyScorer(algo).score(states, actions, candidates)
+            loaded = D3RLPyScorer.load(os.path.join(policyDir, "params.json"), os.path.join(policyDir, "model.pt")).score(states, actions, candidates)
+            error = max(np.abs(exported - trained).max(), np.abs(exported - loaded).max())
+            print(f"{algorithm}: TorchScript vs d3rlpy max difference {error:.2e}")
+            if error > 1e-4:
+                raise SystemExit(f"The TorchScript Q function of {algorithm} does not match the d3rlpy model")
+    print("Training, checkpoints and TorchScript export OK")
@@ -2,6 +2,7 @@ import sys
 from pathlib import Path
 import traceback
 import os
+import ast
 
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
@@ -10,6 +11,10 @@ from APIs.igdb_api import IGDB
 from APIs.rawg_api import RAWG
 from APIs.gamespot_api import Gamespot
 from APIs.metacritic_api import Metacritic
+from APIs.rate_limiter import is_rate_limit_error, rate_limit_stats
+from dataset.title_matcher import TitleMatcher
+from dataset.checkpoint import Checkpoint, OK, FAILED, SKIPPED
+from dataset.storage import find_table, read_table
 from APIs.api_types import (
     RAWGType,
     IGDBType,
@@ -19,9 +24,11 @@ from APIs.api_types import (
     GameType,
 )
 import pandas as pd
+from dataclasses import asdict
 from thefuzz import fuzz
 from datetime import datetime
 from time import sleep
+from concurrent.futures import ThreadPoolExecutor
 
 
 def nameRatio(name1: str, name2: str) -> bool:
@@ -39,6 +46,31 @@ def compareRelease(date1_s: str, date2_s: str) -> bool:
     return abs(date1.year - date2.year) <= 1
 
 
+def matchResult(results: list, empty: GameType, game_name: str, game_release: str, goodRatio: float, minRatio: float) -> GameType:
+    game = results[0] if len(results) > 0 else empty
+    ratio = nameRatio(game.name, game_name)
+    if ratio > goodRatio or (ratio > minRatio and compareRelease(game.release, game_release)):
+        return game
+    return empty
+
+
+def searchProviders(providers: dict, game_name: str, executor: ThreadPoolExecutor = None, prefetched: dict = None) -> dict:
+    """
+    Searches game_name in every provider and returns the results by provider name.
+    With an executor the providers are queried concurrently, otherwise one after another.
+    Each client is throttled by the rate limiter of its provider.
+    Providers with prefetched results are not queried again.
+    """
+    prefetched = {} if prefetched is None else prefetched
+    pending = {api: client for api, client in providers.items() if api not in prefetched}
+    if executor is None:
+        results = {api: client.search(game_name, max_n=1) for api, client in pending.items()}
+    else:
+        futures = {api: executor.submit(client.search, game_name, max_n=1) for api, client in pending.items()}
+        results = {api: future.result() for api, future in futures.items()}
+    return {**prefetched, **results}
+
+
 def getFirstString(str_list: list) -> str:
     for s in str_list:
         if s is not None and len(s) > 0:
@@ -95,6 +127,48 @@ def showResults(api: str, results: GameType, game_name: str, game_release: str,
     print(f"\t\tdescription: {game.description[:10]}")
 
 
+def legacyRow(row: dict) -> dict:
+    """
+    Row of the legacy csv with the types of GameType, the csv has the lists as their string representation
+    and "" for the missing numbers, so its rows can be exported with the new ones.
+    """
+    game = asdict(GameType())
+    for name, default in game.items():
+        value = row.get(name, default)
+        if isinstance(default, list):
+            if isinstance(value, str):
+                try:
+                    value = ast.literal_eval(value) if value.startswith("[") else [value] if len(value) > 0 else []
+                except (ValueError, SyntaxError):
+                    value = []
+            game[name] = [str(item) for item in value]
+        elif isinstance(default, (int, float)):
+            try:
+                game[name] = type(default)(float(value))
+            except (TypeError, ValueError):
+                game[name] = default
+        else:
+            game[name] = str(value)
+    return game
+
+
+def importLegacyGames(checkpoint: Checkpoint, filename: str, unique_games: list):
+    """
+    Moves the games of a table created before the checkpoint into it.
+    The processed titles are guessed by the best match of the last saved name, like the old resume did.
+    """
+    df_games = pd.read_csv(filename, keep_default_na=False)
+    names = [name for name in df_games["name"] if len(name) > 0]
+    if len(names) == 0:
+        return
+    last_index, _ = TitleMatcher(unique_games).best_match(names[-1], min_score=0)
+    for i, row in enumerate(df_games.to_dict("records")):
+        checkpoint.record(f"legacy:{i}", OK, legacyRow(row))
+    for game_name in unique_games[: last_index + 1]:
+        checkpoint.record(game_name, SKIPPED)
+    print(f"Imported {len(df_games)} games from {filename}, {last_index + 1} titles marked as processed")
+
+
 if __name__ == "__main__":
     # APIs modules
     rawg = RAWG()
@@ -103,9 +177,6 @@ if __name__ == "__main__":
     gamespot = Gamespot()
     metacritic = Metacritic()
 
-    # Aggregation list
-    game_list = []
-
     # Parameters
     goodRatio = 0.9
     minRatio = 0.65
@@ -113,83 +184,84 @@ if __name__ == "__main__":
     retryN = 0
     savedGames = 0
     saveEveryNGames = 10
-    filename = "./data/games.csv"
-    # Rate limit handling
-    baseDelay = 1  # seconds between API calls
-    rateLimitBackoff = 60  # seconds to wait on rate limit
+    filename = "./data/games.parquet"
+    legacyFilename = "./data/games.csv"  # table created before the checkpoint
+    checkpointFilename = "./data/games_checkpoint.jsonl"
+    retryFailed = False  # process again the games that failed in previous runs
+    # Rate limit handling, the requests per second of each provider are set in APIs/rate_limiter.py
+    concurrentMode = True  # query the providers of a game at the same time
+    batchIGDB = True  # search IGDB for the next games with a single multiquery
+    igdbBatchSize = 10
     rateLimitRetries = 0
     maxRateLimitRetries = 3
     # Debug
     debug = False
     maxGames = 2
 
+    # Each provider is throttled on its own
+    providers = {
+        "Gamespot": gamespot,
+        "RAWG": rawg,
+        "IGDB": igdb,
+        "HLTB": hltb,
+        "Metacritic": metacritic,
+    }
+    executor = ThreadPoolExecutor(max_workers=len(providers)) if concurrentMode else None
+
     # Load gamespot reviews
-    df_reviews = pd.read_csv("./data/reviews.csv")
+    df_reviews = read_table(find_table("./data/reviews"), columns=["game_name"])
     unique_games = [f"{game_name}" for game_name in df_reviews["game_name"].unique()]
     unique_games.sort()
-    # Start from the start if the table is empty yet
-    gi = 0
 
-    # Check if file exists and read the get the last game saved
-    if os.path.exists(f"{filename}"):
-        # Read it
-        df_games = pd.read_csv(filename)
-        # Look for the last name that is not empty in the table already generated
-        i = -1
-        while True:
-            last_game = df_games["name"].iloc[i]
-            if len(last_game) > 0:
-                break
-            i -= 1
-        # Need to look for the best match of last_game in unique_games since it is not guaranteed that the name is on the list
-        # gi = unique_games.index(last_game) + 1
-        max_name_ratio = 0.0
-        max_index = 0
-        for index, game_name in enumerate(unique_games):
-            current_name_ratio = nameRatio(last_game, game_name)
-            if current_name_ratio > max_name_ratio:
-                max_name_ratio = current_name_ratio
-                max_index = index
-        gi = max_index + 1
-        print(f"Starting from {gi}, actually {100 * gi/len(unique_games):.2f}% of {len(unique_games)} games")
-        del df_games
+    # Every processed game is in the checkpoint, so resuming only skips its keys
+    legacyCheckpoint = not os.path.exists(checkpointFilename) and os.path.exists(legacyFilename)
+    checkpoint = Checkpoint(checkpointFilename)
+    if legacyCheckpoint:
+        importLegacyGames(checkpoint, legacyFilename, unique_games)
+    pending = [game_name for game_name in unique_games if game_name not in checkpoint or (retryFailed and checkpoint.status(game_name) == FAILED)]
+    print(f"{len(unique_games) - len(pending)} of {len(unique_games)} games already processed, {len(pending)} left")
+    pending = set(pending)
 
+    gi = 0
+    igdbBatch = {}
     while gi < len(unique_games):
         game_name = unique_games[gi]
+        if game_name not in pending:
+            gi += 1
+            continue
+        if len(game_name.strip()) == 0 or game_name == "nan":
+            checkpoint.record(game_name, SKIPPED)
+            gi += 1
+            continue
         try:
-            # Query and get the first result
-            # Gamespot
-            results_gamespot = gamespot.search(game_name, max_n=1)
-            sleep(baseDelay)
+            # IGDB is searched for the next games at once
+            prefetched = {}
+            if batchIGDB:
+                if game_name not in igdbBatch:
+                    batch_names = [name for name in unique_games[gi : gi + igdbBatchSize] if name in pending]
+                    igdbBatch = dict(zip(batch_names, igdb.search_many(batch_names, max_n=1)))
+                prefetched["IGDB"] = igdbBatch[game_name]
+            # Query all the providers, the first result of each one is used
+            results = searchProviders(providers, game_name, executor, prefetched)
+            # Gamespot release date gates the other providers
+            results_gamespot = results["Gamespot"]
             game_gamespot = results_gamespot[0] if len(results_gamespot) > 0 else GamespotType()
             game_gamespot = game_gamespot if nameRatio(game_gamespot.name, game_name) > minRatio else GamespotType()
             game_release = game_gamespot.release
             print(game_name, game_release)
             showResults("Gamespot", results_gamespot, game_name, game_release, debug)
             # RAWG
-            results_rawg = rawg.search(game_name, max_n=1)
-            sleep(baseDelay)
-            game_rawg = results_rawg[0] if len(results_rawg) > 0 else RAWGType()
-            game_rawg = game_rawg if nameRatio(game_rawg.name, game_name) > goodRatio or (nameRatio(game_rawg.name, game_name) > minRatio and compareRelease(game_rawg.release, game_release)) else RAWGType()
-            showResults("RAWG", results_rawg, game_name, game_release, debug)
+            game_rawg = matchResult(results["RAWG"], RAWGType(), game_name, game_release, goodRatio, minRatio)
+            showResults("RAWG", results["RAWG"], game_name, game_release, debug)
             # IGDB
-            results_igdb = igdb.search(game_name, max_n=1)
-            sleep(baseDelay)
-            game_igdb = results_igdb[0] if len(results_igdb) > 0 else IGDBType()
-            game_igdb = game_igdb if nameRatio(game_igdb.name, game_name) > goodRatio or (nameRatio(game_igdb.name, game_name) > minRatio and compareRelease(game_igdb.release, game_release)) else IGDBType()
-            showResults("IGDB", results_igdb, game_name, game_release, debug)
+            game_igdb = matchResult(results["IGDB"], IGDBType(), game_name, game_release, goodRatio, minRatio)
+            showResults("IGDB", results["IGDB"], game_name, game_release, debug)
             # HLTB
-            results_hltb = hltb.search(game_name, max_n=1)
-            sleep(baseDelay)
-            game_hltb = results_hltb[0] if len(results_hltb) > 0 else HLTBType()
-            game_hltb = game_hltb if nameRatio(game_hltb.name, game_name) > goodRatio or (nameRatio(game_hltb.name, game_name) > minRatio and compareRelease(game_hltb.release, game_release)) else HLTBType()
-            showResults("HLTB", results_hltb, game_name, game_release, debug)
+            game_hltb = matchResult(results["HLTB"], HLTBType(), game_name, game_release, goodRatio, minRatio)
+            showResults("HLTB", results["HLTB"], game_name, game_release, debug)
             # Metacritic
-            results_metacritic = metacritic.search(game_name, max_n=1)
-            sleep(baseDelay)
-            game_metacritic = results_metacritic[0] if len(results_metacritic) > 0 else MetacriticType()
-            game_metacritic = game_metacritic if nameRatio(game_metacritic.name, game_name) > goodRatio or (nameRatio(game_metacritic.name, game_name) > minRatio and compareRelease(game_metacritic.release, game_release)) else MetacriticType()
-            showResults("Metacritic", results_metacritic, game_name, game_release, debug)
+            game_metacritic = matchResult(results["Metacritic"], MetacriticType(), game_name, game_release, goodRatio, minRatio)
+            showResults("Metacritic", results["Metacritic"], game_name, game_release, debug)
 
             game_obj = GameType(
                 id=gi,
@@ -212,26 +284,18 @@ if __name__ == "__main__":
                 genres=getUnion([game.genres for game in [game_rawg, game_igdb, game_gamespot, game_metacritic]]),
                 keywords=getUnion([game.keywords for game in [game_rawg, game_igdb]] + [game_igdb.themes] + [game_igdb.game_modes] + [game_igdb.player_perspectives] + [[game_rawg.esrb_rating]] + [game_gamespot.themes]),
             )
-            game_list.append(game_obj)
+            checkpoint.record(game_name, OK, asdict(game_obj))
             savedGames += 1
             gi += 1
             retryN = 0
             rateLimitRetries = 0
 
-            # Save every N games to not lose
+            # Export the table every N games, the checkpoint already has every game
             if savedGames % saveEveryNGames == 0:
-                # Check if file exists and append
-                if os.path.exists(filename):
-                    # Append to existing file without loading all data into memory
-                    df_games = pd.DataFrame(game_list[-saveEveryNGames:])
-                    df_games.to_csv(filename, mode="a", header=False, index=False)
-                    print(f"Appended {len(df_games)} games to {filename}")
-                    del df_games
-                else:
-                    df_games = pd.DataFrame(game_list)
-                    df_games.to_csv(filename, index=False)
-                    print(f"Saved {len(df_games)} games to {filename}")
-                    del df_games
+                saved = checkpoint.export(filename)
+                print(f"Saved {saved} games to {filename}")
+                for api, stats in rate_limit_stats().items():
+                    print(f"\t{api}: {stats}")
 
             # Debug
             if debug:
@@ -259,16 +323,15 @@ if __name__ == "__main__":
                 if gi == maxGames:
                     break
         except Exception as e:
-            error_msg = str(e).lower()
-            is_rate_limit = any(keyword in error_msg for keyword in ["rate limit", "429", "420", "too many requests", "quota"])
+            is_rate_limit = is_rate_limit_error(e)
 
             print(50 * "*")
             print(50 * "-")
             traceback.print_exc()
             if is_rate_limit:
+                # The provider already backed off in its limiter, the others keep going
                 rateLimitRetries += 1
-                print(f"RATE LIMIT EXCEEDED {rateLimitRetries}x - Waiting {rateLimitBackoff} seconds...")
-                sleep(rateLimitBackoff)
+                print(f"RATE LIMIT EXCEEDED {rateLimitRetries}x")
 
                 # Stop the script if max rate limit retries exceeded
                 if rateLimitRetries >= maxRateLimitRetries:
@@ -282,10 +345,14 @@ if __name__ == "__main__":
             # Continue if maxRetries reached
             retryN += 1
             if retryN >= maxRetries:
+                checkpoint.record(game_name, FAILED)
                 gi += 1
                 retryN = 0
 
-    # Save results to CSV with append mode
-    df_games = pd.DataFrame(game_list)
-    df_games.to_csv("./data/games.csv", index=False)
-    print(f"Saved {len(df_games)} games to ./data/games.csv")
+    if executor is not None:
+        executor.shutdown()
+
+    # Save all the games, including the ones from previous runs
+    saved = checkpoint.export(filename)
+    checkpoint.close()
+    print(f"Saved {saved} games to {filename}")
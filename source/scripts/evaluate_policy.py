@@ -0,0 +1,57 @@
+import sys
+import os
+import re
+import json
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from recommender.game_features import GameFeatures
+from recommender.mdp_storage import CompactMDPDataset
+from recommender.evaluation import OfflineEvaluator, split_episodes
+from recommender.inference import SimilarityScorer, TorchScriptScorer, D3RLPyScorer
+from recommender.user_encoders import load_encoder
+
+
+def checkpointScorers(policyDir: str):
+    """
+    (name, scorer) of every checkpoint saved by the training, in step order, loaded one at a time.
+    """
+    checkpointDir = os.path.join(policyDir, "checkpoints")
+    checkpoints = [name for name in os.listdir(checkpointDir) if re.fullmatch(r"model_\d+\.pt", name)] if os.path.isdir(checkpointDir) else []
+    for name in sorted(checkpoints, key=lambda name: int(re.findall(r"\d+", name)[0])):
+        yield name, D3RLPyScorer.load(os.path.join(policyDir, "params.json"), os.path.join(checkpointDir, name))
+
+
+if __name__ == "__main__":
+    # Parameters
+    policyDir = "./data/policy"
+    evaluateCheckpoints = True  # every checkpoint of the training, else only the exported TorchScript Q function
+    holdoutFraction = 0.1  # same split and seed as train_policy.py
+    gamma = 0.3
+    seed = 42
+    nCandidates = 100  # games sampled for each transition to rank the game reviewed next against (sampled_hit@K, sampled_ndcg@K)
+    outputFilename = os.path.join(policyDir, "offline_evaluation.jsonl")
+
+    features = GameFeatures.load("./data/game_features")
+    # The states of the user encoder the policy was trained with, saved by train_policy.py
+    encoder = load_encoder(os.path.join(policyDir, "user_encoder"), features.dim)
+    dataset = CompactMDPDataset("./data/mdp_dataset", features.matrix, states=None if encoder.kind == "average" else encoder.kind)
+    heldOut = split_episodes(dataset.episode_starts, holdoutFraction, seed)
+    evaluator = OfflineEvaluator(dataset, SimilarityScorer(), n_candidates=nCandidates, gamma=gamma, seed=seed)
+    print(f"Evaluating on {heldOut.sum()} held out transitions")
+
+    # The similarity of the state and the game vectors is the baseline the policies should beat
+    scorers = [("similarity", None)]
+    qFunctionFilename = os.path.join(policyDir, "q_function.pt")
+    if evaluateCheckpoints:
+        scorers += list(checkpointScorers(policyDir))
+    elif os.path.exists(qFunctionFilename):
+        scorers.append(("q_function.pt", TorchScriptScorer(qFunctionFilename)))
+
+    Path(policyDir).mkdir(parents=True, exist_ok=True)
+    with open(outputFilename, "a") as f:
+        for name, scorer in scorers:
+            results = {"policy": name, **evaluator.evaluate(heldOut, scorer=scorer)}
+            print(", ".join(f"{key}={value:.4f}" if isinstance(value, float) else f"{key}={value}" for key, value in results.items()))
+            f.write(json.dumps(results) + "\n")
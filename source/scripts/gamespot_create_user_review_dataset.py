@@ -1,8 +1,17 @@
-import requests
-import pandas as pd
+import sys
+from pathlib import Path
 from dotenv import load_dotenv
 import os
 import xml.etree.ElementTree as ET
+import requests
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from APIs.http_client import HTTPClient
+from APIs.rate_limiter import RateLimitError
+from dataset.storage import GAMESPOT_REVIEW_SCHEMA, TableWriter, read_table
 
 
 def load_env():
@@ -12,54 +21,151 @@ def load_env():
 
 API_KEY = load_env()
 url = f"https://www.gamespot.com/api/reviews/"
-
-reviews_data = []
-offset = 0
-limit = 100
+# Rate limited keep-alive session, the pages are not cached since new reviews shift the offsets
+http = HTTPClient("gamespot")
 
 # Set headers for the request
 headers = {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"}
+# Format of publish_date 2025-04-24 12:00:00
+format_pattern = "%Y-%m-%d %H:%M:%S"
+
 
-# Fetch all reviews with pagination
-while True:
-    params = {"offset": offset, "limit": limit, "api_key": API_KEY}
-    response = requests.get(url, params=params, headers=headers)
-    print(f"Status Code: {response.status_code}")
+class PageError(Exception):
+    pass
 
-    if response.status_code != 200:
-        print(f"Error: {response.status_code}")
-        print(f"Response: {response.text}")
-        continue
 
-    # Parse XML response
+def parseScore(text: str) -> float:
+    # An empty <score/> is a missing score, not a 0
     try:
-        root = ET.fromstring(response.text)
-    except ET.ParseError as e:
-        print(f"XML Parse Error: {e}")
-        print(f"Response: {response.text[:500]}")
-        continue
-
-    # Extract number of results
-    number_of_total_results = int(root.findtext("number_of_total_results", 0))
-    number_of_page_results = int(root.findtext("number_of_page_results", 0))
-
-    # Extract reviews from this page
-    for review in root.findall(".//review"):
-        reviews_data.append(
+        return float(text)
+    except (TypeError, ValueError):
+        return None
+
+
+def fetchPage(offset: int, limit: int, since: str = None, maxRetries: int = 5) -> tuple[int, list[dict]]:
+    """
+    Fetches the page of reviews at offset, sorted by publish_date so new reviews do not shift the offsets.
+    Errors (status, network, rate limit or XML) back off the gamespot rate limiter and retry the page,
+    after maxRetries a PageError is raised.
+    Returns the number of total results and the reviews of the page.
+    """
+    params = {"offset": offset, "limit": limit, "sort": "publish_date:asc", "api_key": API_KEY}
+    if since is not None:
+        params["filter"] = f"publish_date:{since}|{datetime.now(timezone.utc).strftime(format_pattern)}"
+
+    for attempt in range(maxRetries):
+        try:
+            response = http.get(url, params=params, headers=headers, cache=False)
+        except (requests.RequestException, RateLimitError) as e:
+            print(f"Request Error: {e} at offset {offset}")
+            http.limiter.backoff()
+            continue
+        if response.status_code != 200:
+            print(f"Error: {response.status_code} at offset {offset}")
+            print(f"Response: {response.text[:500]}")
+            http.limiter.backoff()
+            continue
+
+        # Parse XML response
+        try:
+            root = ET.fromstring(response.text)
+        except ET.ParseError as e:
+            print(f"XML Parse Error: {e} at offset {offset}")
+            print(f"Response: {response.text[:500]}")
+            http.limiter.backoff()
+            continue
+
+        # Extract reviews from this page
+        reviews_data = [
             {
                 "authors": review.findtext("authors"),
-                "score": float(review.findtext("score", 0)),
+                "score": parseScore(review.findtext("score")),
                 "game_name": review.findtext("game/name"),
                 "publish_date": review.findtext("publish_date"),
             }
-        )
+            for review in root.findall(".//review")
+        ]
+        return int(root.findtext("number_of_total_results", 0)), reviews_data
+    raise PageError(f"Failed to fetch the reviews at offset {offset} after {maxRetries} attempts")
 
-    # Check if we've fetched all results
-    offset += number_of_page_results
-    if offset >= number_of_total_results:
-        break
 
-# Create DataFrame and save
-df = pd.DataFrame(reviews_data)
-df.to_csv("./data/gamespot_reviews.csv", index=False)
-print(f"Saved {len(df)} reviews to gamespot_reviews.csv")
+def storedReviews(path: str) -> tuple[str, set]:
+    """
+    Returns the newest publish_date stored and the keys of the reviews published at that date,
+    or (None, empty set) when there are no reviews yet.
+    """
+    if not os.path.exists(path):
+        return None, set()
+    df_reviews = read_table(path, columns=["authors", "game_name", "publish_date"])
+    if len(df_reviews) == 0:
+        return None, set()
+    newest = df_reviews["publish_date"].max()
+    last = df_reviews[df_reviews["publish_date"] == newest]
+    return newest, set(zip(last["authors"].astype(str), last["game_name"].astype(str)))
+
+
+def harvest(writer: TableWriter, since: str = None, known: set = None, limit: int = 100, workers: int = 4) -> int:
+    """
+    Fetches the pages after the first one concurrently and streams their reviews to writer.
+    Pages are written in offset order, so a failed page leaves a contiguous prefix of the reviews on disk
+    and the next incremental run restarts right after the newest review saved.
+    In incremental mode only the reviews published at or after since are requested.
+    """
+    known = set() if known is None else known
+    total, first_page = fetchPage(0, limit, since)
+    offsets = list(range(limit, total, limit))
+    print(f"{total} reviews to fetch in {len(offsets) + 1} pages")
+
+    def save(reviews_data: list[dict]) -> int:
+        # Reviews at the boundary date may already be stored
+        reviews_data = [review for review in reviews_data if (str(review["authors"]), str(review["game_name"])) not in known or review["publish_date"] != since]
+        writer.write(reviews_data)
+        return len(reviews_data)
+
+    saved = save(first_page)
+    done = {}
+    next_offset = limit
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(fetchPage, offset, limit, since): offset for offset in offsets}
+        try:
+            for future in as_completed(futures):
+                done[futures[future]] = future.result()[1]
+                while next_offset in done:
+                    saved += save(done.pop(next_offset))
+                    next_offset += limit
+                print(f"Saved the pages up to {min(next_offset, total)} of {total} reviews")
+        except PageError:
+            for future in futures:
+                future.cancel()
+            raise
+        finally:
+            writer.flush()
+    return saved
+
+
+if __name__ == "__main__":
+    # Parameters
+    path = "./data/gamespot_reviews"  # directory of parquet parts
+    incremental = True  # only fetch the reviews newer than the newest stored one
+    workers = 4  # concurrent page requests, all of them share the gamespot rate limit
+    limit = 100
+
+    writer = TableWriter(path, GAMESPOT_REVIEW_SCHEMA, rows_per_part=1000)
+    # Tables saved before the parts directory are moved into it
+    for legacy in [f"{path}.parquet", f"{path}.csv"]:
+        if os.path.exists(legacy) and len(os.listdir(path)) == 0:
+            writer.write(read_table(legacy).to_dict("records"))
+            writer.flush()
+            print(f"Moved {writer.rows_written} reviews from {legacy} to {path}")
+
+    since, known = storedReviews(path) if incremental else (None, set())
+    if since is not None:
+        print(f"Fetching the reviews published since {since}")
+    elif len(os.listdir(path)) > 0:
+        print(f"Full harvest, remove {path} to avoid duplicated reviews")
+
+    try:
+        saved = harvest(writer, since, known, limit, workers)
+        print(f"Saved {saved} new reviews to {path}")
+    except PageError as e:
+        print(f"{e}, {writer.rows_written} reviews saved, run again to continue")
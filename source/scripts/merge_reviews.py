@@ -1,27 +1,23 @@
-import pandas as pd
+import sys
+from pathlib import Path
 
-# Load data/gamespot_reviews.csv in a pandas dataframe
-gamespot_df = pd.read_csv("data/gamespot_reviews.csv")
+sys.path.insert(0, str(Path(__file__).parent.parent))
 
-# Load data/metacritic_reviews.csv in a pandas dataframe
-metacritic_df = pd.read_csv("data/metacritic_reviews.csv")
-
-# Show the duplicate lines head dataframe
-duplicates_df = metacritic_df[metacritic_df.duplicated()]
-print("Duplicate lines in metacritic_reviews:")
-print(len(duplicates_df))
-print(duplicates_df.head())
-
-# Remove duplicate lines in metacritic_reviews dataframe
-metacritic_df = metacritic_df.drop_duplicates()
+from dataset.merge import ReviewMerger
+from dataset.storage import find_table
 
 # Standardize column names to match
 # gamespot: authors,score,game_name,publish_date
 # metacritic: author,score,game_name,date,type,platform
-gamespot_df = gamespot_df.rename(columns={"authors": "author", "publish_date": "date"})
-
-# Create a new dataframe that merges metacritic and gamespot reviews dataframes
-reviews_df = pd.concat([gamespot_df, metacritic_df], ignore_index=True)
+# The scores of each source go from 0 to its scale and are converted to 0-10
+sources = {
+    "gamespot": ("data/gamespot_reviews", {"authors": "author", "publish_date": "date"}, 10),
+    "metacritic": ("data/metacritic_reviews", {}, 10),  # user reviews
+}
 
-# Save this new dataframe in a file called data/reviews.csv
-reviews_df.to_csv("data/reviews.csv", index=False)
+# Merged reviews in data/reviews, only the source files not merged yet are read
+merger = ReviewMerger("data/reviews")
+for name, (base, rename, scale) in sources.items():
+    read, appended = merger.merge(find_table(base), rename, scale)
+    print(f"{name}: read {read} reviews, appended {appended}, {read - appended} duplicates")
+print(f"{len(merger.keys)} reviews in data/reviews")
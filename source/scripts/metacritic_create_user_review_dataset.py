@@ -1,124 +1,175 @@
+import sys
+from pathlib import Path
 import os
-import pandas as pd
-import requests
 from dotenv import load_dotenv
 from difflib import SequenceMatcher
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from urllib.parse import quote
 import traceback
 
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from APIs.http_client import HTTPClient
+from dataset.frontier import CrawlFrontier, WorkItem
+from dataset.storage import METACRITIC_REVIEW_SCHEMA, find_table, read_table
+
 # Load API key
 load_dotenv()
 METACRITIC_API_KEY = os.getenv("METACRITIC_API_KEY")
-
-# Load gamespot reviews
-df_gamespot = pd.read_csv("./data/gamespot_reviews.csv")
-unique_games = df_gamespot["game_name"].unique()
-
-# Initialize results dataframe
-reviews_data = []
-fetched_users = set()
-
-# For each game, fetch Metacritic user reviews
-start_id = 0
-for gn, game_name in enumerate(unique_games[start_id:]):
-    try:
-        # Find name of the game in the Metacritic API
-        find_url = f"https://backend.metacritic.com/finder/metacritic/search/{game_name}/web?apiKey={METACRITIC_API_KEY}&limit=30&offset=0"
-        find_response = requests.get(find_url)
-        find_data = find_response.json()
-        if not "data" in find_data:
-            print(f"Error with {game_name}")
-            continue
-
-        game_slug = ""
-        best_ratio = 0.0
-        for item in find_data["data"]["items"]:
-            if item["type"] == "game-title":
-                current_ratio = SequenceMatcher(None, item["title"], game_name).ratio()
-                if current_ratio > best_ratio:
-                    best_ratio = current_ratio
-                    game_slug = item["slug"]
-
-        if len(game_slug) == 0:
-            continue
-        print(f"Game {gn + start_id}: {game_name} {game_slug}")
-        game_url = f"https://backend.metacritic.com/reviews/metacritic/user/games/{game_slug}/summary/web?apiKey={METACRITIC_API_KEY}"
-
-        response = requests.get(game_url)
-        game_data = response.json()
-        if not "data" in game_data:
-            print(f"Error with {game_slug}")
+# Rate limited and cached access to Metacritic
+http = HTTPClient("metacritic")
+
+# Kinds of work item: a gamespot title to find in Metacritic, a game slug to list its reviewers and a user profile
+TITLE = "title"
+GAME = "game"
+USER = "user"
+
+
+class CrawlError(Exception):
+    pass
+
+
+def getData(url: str) -> dict:
+    response = http.get(url)
+    data = response.json()
+    if not "data" in data:
+        raise CrawlError(f"Error with {url.split('?')[0]}")
+    return data["data"]
+
+
+def crawlTitle(item: WorkItem) -> tuple[list[dict], list[WorkItem]]:
+    """
+    Finds the slug of a gamespot title in the Metacritic API.
+    """
+    game_name = item.key
+    find_data = getData(f"https://backend.metacritic.com/finder/metacritic/search/{quote(game_name)}/web?apiKey={METACRITIC_API_KEY}&limit=30&offset=0")
+
+    game_slug = ""
+    best_ratio = 0.0
+    for find_item in find_data["items"]:
+        if find_item["type"] == "game-title":
+            current_ratio = SequenceMatcher(None, find_item["title"], game_name).ratio()
+            if current_ratio > best_ratio:
+                best_ratio = current_ratio
+                game_slug = find_item["slug"]
+
+    if len(game_slug) == 0:
+        return [], []
+    print(f"Game {game_name}: {game_slug}")
+    return [], [WorkItem(GAME, game_slug, game_slug=game_slug)]
+
+
+def crawlGame(item: WorkItem) -> tuple[list[dict], list[WorkItem]]:
+    """
+    Queues the authors of the user reviews of a game.
+    """
+    game_data = getData(f"https://backend.metacritic.com/reviews/metacritic/user/games/{item.game_slug}/summary/web?apiKey={METACRITIC_API_KEY}")
+
+    # Concatenate positive, negative, neutral reviews
+    reviews = game_data["item"].get("positive", []) + game_data["item"].get("negative", []) + game_data["item"].get("neutral", [])
+    users = {review.get("author") for review in reviews if review.get("author")}
+    return [], [WorkItem(USER, user_name, game_slug=item.game_slug, user=user_name) for user_name in sorted(users)]
+
+
+def crawlUser(item: WorkItem, minReviews: int = 3, limit: int = 100, expandGames: bool = False) -> tuple[list[dict], list[WorkItem]]:
+    """
+    Pages through the reviews of a user with at least minReviews reviews.
+    With expandGames the games reviewed by the user are queued too, so the crawl grows beyond the gamespot titles.
+    """
+    user_name = item.user
+    reviews_data = []
+    new_items = []
+    offset = 0
+    while True:
+        user_data = getData(
+            f"https://backend.metacritic.com/reviews/metacritic/user/users/{quote(user_name)}/web?apiKey={METACRITIC_API_KEY}&filterByType=games&offset={offset}&limit={limit}&componentName=reviews&componentDisplayName=Profile+Reviews&componentType=ReviewListComponent&sort=date"
+        )
+        total_results = user_data["totalResults"]
+        print(f"\t{user_name} has {total_results} reviews. currently in page {offset}")
+        if total_results < minReviews:
             break
 
-        # Concatenate positive, negative, neutral reviews
-        reviews = game_data["data"]["item"].get("positive", []) + game_data["data"]["item"].get("negative", []) + game_data["data"]["item"].get("neutral", [])
-
-        # For each review, get user_name and fetch their profile
-        for rn, review in enumerate(reviews):
-            user_name = review.get("author")
-
-            if not user_name or user_name in fetched_users:
-                continue
-
-            fetched_users.add(user_name)
-
-            # Check if user has 3+ reviews
-            total_results = 1  # 1 to pass the while statement
-            offset = 0
-            limit = 100
-            length_before = len(reviews_data)
-
-            while True:
-                user_url = f"https://backend.metacritic.com/reviews/metacritic/user/users/{user_name}/web?apiKey={METACRITIC_API_KEY}&filterByType=games&offset={offset}&limit={limit}&componentName=reviews&componentDisplayName=Profile+Reviews&componentType=ReviewListComponent&sort=date"
-                user_response = requests.get(user_url)
-                user_data = user_response.json()
-                if not "data" in user_data:
-                    print(f"Error with {user_name}")
-                    break
-                total_results = user_data["data"]["totalResults"]
-                print(f"\t{user_name} has {total_results} reviews. currently in page {offset}")
-
-                if total_results >= 3:
-                    # Loop through user's reviews
-                    for item in user_data["data"]["items"]:
-                        reviews_data.append(
-                            {
-                                "author": item.get("author"),
-                                "score": item.get("score"),
-                                "game_name": item.get("reviewedProduct", {}).get("title"),
-                                "date": item.get("date"),
-                                "type": item.get("reviewedProduct", {}).get("type"),
-                                "platform": item.get("platform"),
-                            }
-                        )
-                        print(f"\t\t{reviews_data[-1]['author']}, {reviews_data[-1]['score']}, {reviews_data[-1]['game_name']}, {reviews_data[-1]['date']}")
-
-                    offset += limit
-                    if offset >= total_results:
-                        break
-                else:
-                    break
-            # debug
-            # if rn > 5:
-            #     break
-        # debug
-        # if gn > 5:
-        #     break
-    except Exception as e:
-        print(50 * "*")
-        print(50 * "-")
-        traceback.print_exc()
-        print(50 * "-")
-        print(50 * "*")
-
-
-# Save results to CSV with append mode
-df_reviews = pd.DataFrame(reviews_data)
-
-# Check if file exists and append
-if os.path.exists("./data/metacritic_reviews.csv") and start_id > 0:
-    # Append to existing file without loading all data into memory
-    df_reviews.to_csv("./data/metacritic_reviews.csv", mode="a", header=False, index=False)
-    print(f"Appended {len(df_reviews)} reviews to ./data/metacritic_reviews.csv")
-else:
-    df_reviews.to_csv("./data/metacritic_reviews.csv", index=False)
-    print(f"Saved {len(df_reviews)} reviews to ./data/metacritic_reviews.csv")
+        # Loop through user's reviews
+        for review in user_data["items"]:
+            product = review.get("reviewedProduct", {})
+            reviews_data.append(
+                {
+                    "author": review.get("author"),
+                    "score": review.get("score"),
+                    "game_name": product.get("title"),
+                    "date": review.get("date"),
+                    "type": product.get("type"),
+                    "platform": review.get("platform"),
+                }
+            )
+            if expandGames and product.get("slug"):
+                new_items.append(WorkItem(GAME, product["slug"], game_slug=product["slug"]))
+
+        offset += limit
+        if offset >= total_results or len(user_data["items"]) == 0:
+            break
+    return reviews_data, new_items
+
+
+def crawl(frontier: CrawlFrontier, path: str, workers: int = 4, flushEveryNRows: int = 10_000, expandGames: bool = False):
+    """
+    Processes the work items of the frontier with a pool of workers until the queue is empty.
+    A failed item is queued again (up to the frontier max_attempts) without stopping the others.
+    """
+    handlers = {TITLE: crawlTitle, GAME: crawlGame, USER: lambda item: crawlUser(item, expandGames=expandGames)}
+    running = {}
+    processed = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while True:
+            # Keep every worker busy
+            for item in frontier.take(workers - len(running)):
+                running[executor.submit(handlers[item.kind], item)] = item
+            if len(running) == 0:
+                break
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                item = running.pop(future)
+                try:
+                    rows, new_items = future.result()
+                    frontier.complete(item, rows, new_items)
+                except Exception:
+                    print(50 * "*")
+                    print(f"{item.kind} {item.key} failed, attempt {item.attempts + 1}")
+                    traceback.print_exc()
+                    print(50 * "*")
+                    frontier.fail(item)
+                processed += 1
+
+            # Move the stored reviews to the parquet table
+            moved = frontier.flush(path, METACRITIC_REVIEW_SCHEMA, min_rows=flushEveryNRows)
+            if moved > 0:
+                print(f"Appended {moved} reviews to {path}, {processed} items processed: {frontier.counts()}")
+    return processed
+
+
+if __name__ == "__main__":
+    # Parameters
+    path = "./data/metacritic_reviews"  # directory of parquet parts
+    frontierFilename = "./data/metacritic_frontier.sqlite"  # queue, visited set and reviews not flushed yet
+    workers = 4  # concurrent requests, all of them share the metacritic rate limit
+    flushEveryNRows = 10_000
+    expandGames = False  # crawl the games reviewed by the users too
+    retryFailed = False  # process again the items that failed in previous runs
+
+    frontier = CrawlFrontier(frontierFilename)
+    if retryFailed:
+        print(f"{frontier.retry_failed()} failed items queued again")
+
+    # Load gamespot reviews, the titles already queued are ignored
+    df_gamespot = read_table(find_table("./data/gamespot_reviews"), columns=["game_name"])
+    unique_games = [f"{game_name}" for game_name in df_gamespot["game_name"].dropna().unique()]
+    added = frontier.add([WorkItem(TITLE, game_name) for game_name in unique_games])
+    print(f"{added} new titles queued: {frontier.counts()}")
+
+    processed = crawl(frontier, path, workers, flushEveryNRows, expandGames)
+
+    # Write the last stored reviews
+    moved = frontier.flush(path, METACRITIC_REVIEW_SCHEMA)
+    print(f"Appended {moved} reviews to {path}, {processed} items processed: {frontier.counts()}")
+    frontier.close()
@@ -0,0 +1,84 @@
+import sys
+import os
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from APIs.igdb_api import IGDB
+from recommender.game_features import GameFeatures
+from recommender.candidates import CandidateIndex
+from recommender.user_encoders import load_encoder
+from recommender.sessions import SessionStore
+from recommender.inference import RecommenderService, RecommendationRequest, TorchScriptScorer, D3RLPyScorer, LocalHydrator, IGDBHydrator, make_server
+from dataset.storage import find_table, read_table
+
+
+def loadScorer(policyDir: str, threads: int):
+    """
+    TorchScript Q function when it was exported, else the d3rlpy model, else the similarity stub (None).
+    """
+    torchscriptFilename = os.path.join(policyDir, "q_function.pt")
+    paramsFilename = os.path.join(policyDir, "params.json")
+    modelFilename = os.path.join(policyDir, "model.pt")
+    if os.path.exists(torchscriptFilename):
+        print(f"Policy: {torchscriptFilename}")
+        return TorchScriptScorer(torchscriptFilename, threads)
+    if os.path.exists(paramsFilename) and os.path.exists(modelFilename):
+        print(f"Policy: {modelFilename}")
+        return D3RLPyScorer.load(paramsFilename, modelFilename)
+    print("Policy: no trained model, scoring by similarity")
+    return None
+
+
+def benchmark(service: RecommenderService, nRequests: int, concurrency: int):
+    """
+    Sends nRequests cold start requests from concurrency threads and prints the latency percentiles.
+    """
+    names = service.features.names
+    requests = [RecommendationRequest(played=[int(i), int(i * 7 % len(names))], min_year=2010 if i % 2 else None) for i in range(nRequests)]
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(lambda request: service.recommend(request, hydrate=False), requests))
+    print(f"Benchmark {nRequests} requests, {concurrency} concurrent: {service.stats()}")
+
+
+if __name__ == "__main__":
+    # Parameters
+    host = "127.0.0.1"
+    port = 8000
+    policyDir = "./data/policy"  # written by the training, see train_step.py
+    featuresDir = "./data/game_features"
+    indexPath = "./data/candidate_index"  # built by snippets/candidate_generation.py
+    useIGDB = False  # hydrate the recommendations from IGDB, else from the local games table
+    nCandidates = 100
+    maxBatchSize = 32  # requests scored in the same forward pass
+    maxWaitMs = 2.0  # time a request waits for others to join its batch
+    torchThreads = 4
+    sessionTtl = 1800  # seconds a session of POST /session is kept without requests
+    maxSessions = 100_000  # least recently used sessions are evicted past this number or maxSessionBytes
+    maxSessionBytes = 512 * 2**20
+    benchmarkRequests = 1000  # 0 to skip the latency benchmark before serving
+    benchmarkConcurrency = 16
+
+    # Everything is loaded once, the matrices are memory mapped
+    features = GameFeatures.load(featuresDir)
+    index = CandidateIndex(indexPath)
+    if index.metadata.get("features") != features.key:
+        print(f"Warning: the candidate index was built for the features {index.metadata.get('features')}, not {features.key}")
+    hydrator = IGDBHydrator(IGDB()) if useIGDB else LocalHydrator(read_table(find_table("./data/games")))
+    # The user encoder the policy was trained with, the average of the games played when there is none
+    encoder = load_encoder(os.path.join(policyDir, "user_encoder"), features.dim)
+    print(f"User encoder: {encoder.kind}")
+    service = RecommenderService(features, index, loadScorer(policyDir, torchThreads), hydrator, nCandidates, maxBatchSize, maxWaitMs, encoder, SessionStore(maxSessions, maxSessionBytes, sessionTtl))
+
+    if benchmarkRequests > 0:
+        benchmark(service, benchmarkRequests, benchmarkConcurrency)
+
+    server = make_server(service, host, port)
+    print(f"Serving on http://{host}:{port} (POST /recommend, POST /session, DELETE /session/<user>, GET /stats)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+    service.close()
@@ -0,0 +1,69 @@
+import sys
+import os
+from pathlib import Path
+import numpy as np
+import d3rlpy
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from recommender.game_features import GameFeatures
+from recommender.mdp_storage import CompactMDPDataset, cast_features
+from recommender.d3rlpy_adapter import D3RLPyAdapter
+from recommender.training import set_torch_threads, train
+from recommender.evaluation import OfflineEvaluator, split_episodes
+from recommender.inference import D3RLPyScorer
+from recommender.user_encoders import load_encoder
+
+
+def createAlgorithm(algorithm: str, adapter: D3RLPyAdapter, batchSize: int, gamma: float):
+    """
+    CQL over the game vectors (continuous actions), or DiscreteCQL/DQN over the game indices.
+    """
+    if algorithm == "CQL":
+        return d3rlpy.algos.CQL(action_scaler=adapter.action_scaler(), batch_size=batchSize, gamma=gamma, actor_learning_rate=1e-4, critic_learning_rate=3e-4, use_gpu=False)
+    if algorithm == "DiscreteCQL":
+        return d3rlpy.algos.DiscreteCQL(batch_size=batchSize, gamma=gamma, learning_rate=6.25e-5, use_gpu=False)
+    if algorithm == "DQN":
+        return d3rlpy.algos.DQN(batch_size=batchSize, gamma=gamma, learning_rate=6.25e-5, use_gpu=False)
+    raise ValueError(f"Unknown algorithm {algorithm}")
+
+
+if __name__ == "__main__":
+    # Parameters
+    algorithm = "CQL"  # CQL, DiscreteCQL or DQN
+    nSteps = 100_000
+    batchSize = 256
+    gamma = 0.3  # short term decisions, see ideia.txt
+    intraOpThreads = 8  # threads of each torch kernel, about the number of physical cores
+    interOpThreads = 1
+    prefetch = 8  # minibatches sampled ahead
+    samplerWorkers = 2  # raise it when the log shows the updates waiting for data
+    featureDtype = "float32"  # float16 or bfloat16 halve the memory of the game vectors the observations are built from
+    checkpointEvery = 10_000
+    logEvery = 1_000
+    policyDir = "./data/policy"  # read by the recommendation server
+    holdoutFraction = 0.1  # users left out of the training and evaluated at every checkpoint, 0 to train on all
+    userEncoder = None  # None for the average of the games played, or gru/sasrec trained by train_user_encoder.py
+    seed = 42
+
+    # Torch threads are set before any work so the inter op pool can still be sized
+    set_torch_threads(intraOpThreads, interOpThreads)
+    d3rlpy.seed(seed)
+
+    # The transitions written by mdp_generation.py and the feature matrix they index, memory mapped
+    features = GameFeatures.load("./data/game_features")
+    dataset = CompactMDPDataset("./data/mdp_dataset", cast_features(features.matrix, featureDtype), states=userEncoder)
+    # The server encodes the users with the same encoder as the training states, the average one is saved too
+    # so the encoder of a previous policy is always replaced
+    encoder = load_encoder(None if userEncoder is None else f"./data/user_encoder/{userEncoder}", features.dim)
+    encoder.save(os.path.join(policyDir, "user_encoder"))
+    heldOut = split_episodes(dataset.episode_starts, holdoutFraction, seed)
+    adapter = D3RLPyAdapter(dataset, gamma=gamma, seed=seed, discrete=algorithm != "CQL", indices=np.flatnonzero(~heldOut))
+    print(f"{len(dataset)} transitions ({heldOut.sum()} held out), {features.dim} features, {adapter.action_size} {'games' if adapter.discrete else 'action dimensions'}")
+
+    # Each checkpoint is evaluated on the held out users (sampled hit@K and NDCG@K, IPS and FQE)
+    evaluator = OfflineEvaluator(dataset, None, gamma=gamma, seed=seed)
+    evaluateCheckpoint = (lambda algo: evaluator.evaluate(heldOut, scorer=D3RLPyScorer(algo))) if heldOut.any() else None
+
+    algo = createAlgorithm(algorithm, adapter, batchSize, gamma)
+    train(algo, adapter, nSteps, policyDir, prefetch=prefetch, workers=samplerWorkers, checkpoint_every=checkpointEvery, log_every=logEvery, seed=seed, evaluate=evaluateCheckpoint)
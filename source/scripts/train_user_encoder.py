@@ -0,0 +1,45 @@
+import sys
+from pathlib import Path
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from recommender.game_features import GameFeatures
+from recommender.mdp_storage import CompactMDPDataset, write_states
+from recommender.evaluation import split_episodes
+from recommender.user_encoders import GRUEncoder, SASRecEncoder
+from recommender.encoder_training import train_encoder
+from recommender.training import set_torch_threads
+
+if __name__ == "__main__":
+    # Parameters
+    encoderType = "gru"  # gru or sasrec
+    nSteps = 20_000
+    batchSize = 128
+    sequenceLength = 50  # steps of each history trained on, after the burn in
+    nNegatives = 512  # games sampled as negatives of the next game
+    learningRate = 1e-3
+    threads = 8
+    holdoutFraction = 0.1  # same split and seed as train_policy.py, the held out users are only used for the validation loss
+    seed = 42
+    encoderPath = f"./data/user_encoder/{encoderType}"  # train_policy.py with userEncoder = encoderType copies it to the policy
+
+    set_torch_threads(threads)
+    features = GameFeatures.load("./data/game_features")
+    dataset = CompactMDPDataset("./data/mdp_dataset", features.matrix)
+    heldOut = split_episodes(dataset.episode_starts, holdoutFraction, seed)
+
+    # The state before each step is phi(H) of the history, trained to score the next game above the sampled ones
+    if encoderType == "gru":
+        encoder = GRUEncoder(features.dim, units=128)
+    elif encoderType == "sasrec":
+        encoder = SASRecEncoder(features.dim, model_dim=64, heads=2, layers=2, window=50, max_position=200)
+    else:
+        raise ValueError(f"Unknown encoder {encoderType}")
+    encoder = train_encoder(encoder, dataset, np.flatnonzero(~heldOut), np.flatnonzero(heldOut), nSteps, batchSize, sequenceLength, n_negatives=nNegatives, learning_rate=learningRate, seed=seed)
+    encoder.save(encoderPath)
+    print(f"Saved the {encoderType} encoder to {encoderPath}, {encoder.hidden_size} floats of hidden state per user")
+
+    # The states of every step are written next to the transitions, the policies are trained on them with CompactMDPDataset(states=encoderType)
+    write_states("./data/mdp_dataset", encoderType, encoder, features.matrix, dataset)
+    print(f"Saved the {encoderType} states of {len(dataset)} transitions")
@@ -0,0 +1,40 @@
+import sys
+import os
+import json
+from pathlib import Path
+from time import perf_counter
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from recommender.game_features import GameFeatures
+from recommender.candidates import CandidateIndex
+from dataset.storage import find_table, read_table
+
+# Parameters
+indexPath = "./data/candidate_index"
+blocks = None  # blocks of the feature matrix to search, None for all of them (e.g. ["title", "collaborative"])
+nCandidates = 100  # actions scored by the policy instead of the ~20k games
+
+# 1. Load the last feature matrix built by mdp_generation.py and the games table it was encoded from
+features = GameFeatures.load("./data/game_features")
+games = read_table(find_table("./data/games"), columns=["name", "release", "platforms"])
+
+# 2. Build the IVF index only when the feature matrix changed
+indexFile = os.path.join(indexPath, "index.json")
+built = json.load(open(indexFile)) if os.path.exists(indexFile) else {}
+if built.get("features") != features.key or built.get("blocks") != (blocks or list(features.blocks)):
+    index = CandidateIndex.from_features(indexPath, features, games, blocks)
+    print(f"Indexed {len(index)} games in {index.metadata['lists']} lists")
+else:
+    index = CandidateIndex(indexPath)
+
+# 3. Candidates of a user: the games closest to the average of the games played, with the hard filters
+played = features.rows(["The Witcher 3: Wild Hunt", "Dark Souls"])
+played = played[played >= 0]
+state = index.user_state(played)
+start = perf_counter()
+rows, scores = index.search(state, k=nCandidates, min_year=2015, platforms=["PC"], exclude=played)
+print(f"{(rows >= 0).sum()} candidates in {1000 * (perf_counter() - start):.2f} ms")
+for row, score in zip(rows[0][:10], scores[0][:10]):
+    if row >= 0:
+        print(f"\t{score:.3f} {features.names[row]}")
@@ -1,46 +1,43 @@
+import sys
+import os
+from pathlib import Path
 import pandas as pd
-from sklearn.decomposition import TruncatedSVD
-from scipy.sparse import csr_matrix
 
-# 1. Load your Kaggle Interaction Data
-# Assume columns: 'user_id', 'game_id', 'rating'
-df = pd.read_csv("kaggle_video_game_reviews.csv")
-
-# 2. Create a Pivot Table (Sparse Matrix)
-# Rows = Users, Columns = Games, Values = Ratings
-# We use a sparse matrix because a dense pivot table would crash your RAM
-user_item_matrix = df.pivot_table(
-    index="user_id", columns="game_title", values="rating"
-).fillna(0)
-# Convert to sparse format for efficiency
-sparse_matrix = csr_matrix(user_item_matrix.values)
-
-# 3. Apply SVD (Matrix Factorization)
-# n_components=32 means we compress the game info into 32 numbers
-svd = TruncatedSVD(n_components=32, random_state=42)
-svd.fit(
-    sparse_matrix.T
-)  # Note: Transpose (.T) because we want Item vectors, not User vectors
-
-# 4. Extract the Latent Vectors
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from recommender.interactions import InteractionMatrix
+from recommender.collaborative import CollaborativeEmbedding, ALS
+from dataset.storage import write_table
+
+# Parameters
+embeddingFilename = "./data/collaborative_embedding.npz"
+fullRefit = False  # refit from scratch, run it periodically
+method = ALS  # or SVD for the randomized SVD
+dim = 32  # n_components=32 means we compress the game info into 32 numbers
+
+# 1. Load the merged reviews (only the author, game_name and score columns)
+# 2. Build the sparse interaction matrix directly from the ratings
+# Rows = Users, Columns = Games, Values = Ratings (max of duplicate reviews)
+# A dense pivot table would crash your RAM, this uses memory proportional to the ratings
+interactions = InteractionMatrix.load("./data/reviews")
+print(f"{interactions.shape[0]} users x {interactions.shape[1]} games, {interactions.nnz} ratings")
+
+# 3. Matrix Factorization
+# The new ratings since the last run are folded in, the full fit is only done when asked or the first time
+if fullRefit or not os.path.exists(embeddingFilename):
+    embedding = CollaborativeEmbedding(k=dim, method=method).fit(interactions)
+    print("Full refit done")
+else:
+    embedding = CollaborativeEmbedding.load(embeddingFilename)
+    users_updated, games_updated = embedding.update(interactions)
+    print(f"Folded in {users_updated} users and {games_updated} games")
+embedding.save(embeddingFilename)
+
+# 4. Extract the Latent Vectors of the games
 # This matrix has shape (Number_of_Games, 32)
-item_vectors = svd.components_.T
-
-# 5. Map back to Game Titles
-game_titles = user_item_matrix.columns
-game_embedding_dict = {
-    title: vector for title, vector in zip(game_titles, item_vectors)
-}
-
-# 6. Save to your Game Database
-# Load your master game list (metadata)
-games_metadata_df = pd.read_csv("master_game_list.csv")
-
-# Create a new column 'svd_vector' by mapping the title
-games_metadata_df["svd_vector"] = games_metadata_df["title"].map(game_embedding_dict)
-
-# Filter out games that didn't have enough history to get a vector
-games_metadata_df = games_metadata_df.dropna(subset=["svd_vector"])
+item_vectors = embedding.item_factors
 
-# Save this for your App
-games_metadata_df.to_pickle("games_db_with_embeddings.pkl")
+# 5. Map back to Game Titles and save them as a list column
+games_df = pd.DataFrame({"game_name": embedding.items, "svd_vector": list(item_vectors)})
+write_table(games_df, "./data/game_embeddings.parquet")
+print(f"Saved {len(games_df)} game vectors to ./data/game_embeddings.parquet")
@@ -1,145 +1,61 @@
+import sys
+from pathlib import Path
 import pandas as pd
 import numpy as np
-import d3rlpy
-from sklearn.preprocessing import MultiLabelBinarizer
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from recommender.mdp_builder import build_episodes
+from recommender.mdp_storage import write_compact
+from recommender.game_features import GameFeatures
+from dataset.storage import find_table, read_table
 
 # ==========================================
 # 1. CONFIGURATION
 # ==========================================
-# Assuming you have these two files:
-# reviews.csv -> Columns: 'user_id', 'game_id', 'rating', 'timestamp' (optional)
-# games.csv   -> Columns: 'game_id', 'genres' (e.g., "Action|RPG|Indie")
+# Inputs:
+# ./data/reviews -> merged reviews, columns 'author', 'game_name', 'score' (0-10), 'date'
+# ./data/games   -> games table (GameType columns), encoded once into the cached feature matrix
 
-GAME_VECTOR_DIM = 20  # How many dimensions for our Game Embeddings?
+MDP_DATASET_PATH = "./data/mdp_dataset"  # directory of the transitions and their manifest
+GAME_FEATURES_PATH = "./data/game_features"  # cache of the [n_games, dim] feature matrices, the rows are the games of the manifest
 
 
 def main():
-    print("--- 1. Loading Data ---")
-    # MOCK DATA GENERATION (Replace this with pd.read_csv('reviews.csv'))
-    # We simulate a "Reviews Line Dataset"
-    reviews_df = pd.DataFrame(
-        {
-            "user_id": [1, 1, 1, 2, 2],
-            "game_id": [101, 102, 103, 101, 104],
-            "rating": [8.0, 4.0, 9.0, 7.0, 10.0],  # Raw 0-10
-            "timestamp": [100, 101, 102, 200, 201],  # Optional
-        }
-    )
-
-    # MOCK GAME DATA (Replace with pd.read_csv('games.csv'))
-    games_df = pd.DataFrame(
-        {
-            "game_id": [101, 102, 103, 104],
-            "genres": [
-                ["Action", "RPG"],
-                ["Strategy"],
-                ["Action", "Souls-like"],
-                ["RPG", "Turn-Based"],
-            ],
-        }
-    )
-
-    print("--- 2. Vectorizing Games (The 'Action' Space) ---")
-    # We need to turn "Action|RPG" into a vector like [1, 0, 1, 0...]
-    mlb = MultiLabelBinarizer()
-    genre_vectors = mlb.fit_transform(games_df["genres"])
-
-    # Map GameID -> Vector
-    # Create a dictionary for fast lookup: {101: [1,0,1...], 102: [0,1,0...]}
-    game_vector_map = {gid: vec for gid, vec in zip(games_df["game_id"], genre_vectors)}
-
-    # Store dimensions for d3rlpy config later
-    action_size = len(genre_vectors[0])
-    print(f"Game Vector Size: {action_size} dimensions")
+    print("--- 1. Vectorizing Games (The 'Action' Space) ---")
+    # Every game becomes its feature vector (title, description, genres, year, platforms, time to beat, ratings
+    # and collaborative embedding). The matrix is only encoded again when the tables or the encoder config change
+    features = GameFeatures.build("./data/games", "./data/reviews", "./data/game_embeddings.parquet", GAME_FEATURES_PATH)
+    print(f"Game Vector Size: {features.dim} dimensions, blocks {features.blocks}")
+
+    print("--- 2. Loading Data ---")
+    reviews_df = read_table(find_table("./data/reviews"), columns=["author", "game_name", "score", "date"])
+    # Row of the feature matrix of each reviewed game, -1 for the games without metadata
+    titles = reviews_df["game_name"].astype(str)
+    unique_titles = titles.unique()
+    reviews_df["game_row"] = pd.Series(features.rows(unique_titles), index=unique_titles).loc[titles].to_numpy()
+    reviews_df["timestamp"] = pd.to_datetime(reviews_df["date"], errors="coerce").to_numpy()
 
     print("--- 3. processing User Sessions ---")
-    # Sort by User and Time (Critical for RL!)
-    # If you don't have time, use: reviews_df.sample(frac=1).sort_values('user_id')
-    if "timestamp" in reviews_df.columns:
-        reviews_df = reviews_df.sort_values(by=["user_id", "timestamp"])
-    else:
-        reviews_df = reviews_df.sort_values(by=["user_id"])  # Arbitrary order
-
-    # Initialize lists to hold the MDP data
-    observations = []  # State (User History)
-    actions = []  # Action (Game Vector)
-    rewards = []  # Reward (Normalized Rating)
-    terminals = []  # Done Flag
-
-    # Group by User to create "Episodes"
-    grouped = reviews_df.groupby("user_id")
-
-    for user_id, group in grouped:
-
-        # Initialize User State (e.g., Zero vector at start of session)
-        # "State" = Average of games played so far
-        current_user_state = np.zeros(action_size)
-
-        # Count for averaging
-        games_played_count = 0
-
-        # Loop through this user's timeline
-        for index, row in group.iterrows():
-            game_id = row["game_id"]
-            raw_rating = row["rating"]
-
-            # 1. GET ACTION (The Game Vector)
-            if game_id not in game_vector_map:
-                continue  # Skip games we don't have metadata for
-
-            game_vec = game_vector_map[game_id]
-
-            # 2. CALCULATE REWARD (Normalize 0-10 to -1 to 1)
-            # Using the logic we discussed earlier
-            norm_reward = (raw_rating - 5.0) / 5.0
-
-            # 3. APPEND TO BUFFERS
-            observations.append(
-                current_user_state.copy()
-            )  # Record state BEFORE this action
-            actions.append(game_vec)
-            rewards.append([norm_reward])  # d3rlpy expects shape (N, 1)
-
-            # 4. UPDATE STATE (Transition logic)
-            # New State = Old State + This Game (Running Average)
-            games_played_count += 1
-            # Simple average update formula
-            current_user_state = (
-                current_user_state * (games_played_count - 1) + game_vec
-            ) / games_played_count
-
-            # 5. HANDLE TERMINAL
-            # Is this the last review for this user?
-            is_last_step = index == group.index[-1]
-            terminals.append([1.0 if is_last_step else 0.0])
-
-    print("--- 4. Finalizing Arrays ---")
-    # Convert to Numpy
-    obs_arr = np.array(observations, dtype=np.float32)
-    act_arr = np.array(actions, dtype=np.float32)
-    rew_arr = np.array(rewards, dtype=np.float32)
-    term_arr = np.array(terminals, dtype=np.float32)
-
-    print(f"Dataset Shape: {obs_arr.shape[0]} transitions")
-    print(f"Observation Shape: {obs_arr.shape}")
-    print(f"Action Shape: {act_arr.shape}")
-
-    print("--- 5. Saving for d3rlpy ---")
-    # Save as an MDPDataset object or raw files
-    dataset = d3rlpy.dataset.MDPDataset(
-        observations=obs_arr,
-        actions=act_arr,
-        rewards=rew_arr,
-        terminals=term_arr,
-    )
-
-    # Dump to disk (optional)
-    dataset.dump("game_recommender_data.h5")
-    print("Success! 'game_recommender_data.h5' created.")
+    # Sort by User and Time (Critical for RL!) once, then build every transition with array operations:
+    # State = Average of games played so far (cumulative sums restarted at each user), Action = Game Vector,
+    # Reward = rating normalized from 0-10 to -1 to 1, Terminal = last review of the user
+    # Games we don't have metadata for are skipped
+    episodes = build_episodes(reviews_df, np.arange(len(features)), user_column="author", game_column="game_row", rating_column="score")
+    print(f"Dataset Shape: {len(episodes)} transitions")
+    print(f"Observation Shape: {(len(episodes), features.dim)}")
+    print(f"Action Shape: {(len(episodes), features.dim)}")
+
+    print("--- 4. Saving for d3rlpy ---")
+    # Transitions are saved as game indices, the game vectors are the rows of the feature matrix.
+    # Observations and action vectors are only built for the sampled minibatches,
+    # so another game encoder only needs a new feature matrix
+    # (write_episodes saves the full vectors as memory mapped shards instead)
+    write_compact(MDP_DATASET_PATH, episodes, features.names)
+    print(f"Success! '{MDP_DATASET_PATH}' created for the features '{features.key}'.")
 
     # --- EXAMPLE TRAINING ---
-    # cql = d3rlpy.algos.CQL(use_gpu=False)
-    # cql.fit(dataset, n_steps=1000)
+    # See train_step.py, the transitions are fed to d3rlpy with D3RLPyAdapter
 
 
 if __name__ == "__main__":
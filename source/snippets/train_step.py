@@ -1,28 +1,33 @@
+import sys
+from pathlib import Path
 import d3rlpy
-import numpy as np
 
-# 1. Load your Data
-# observations: Array of shape (N, vector_dim) -> The User States
-# actions: Array of shape (N, vector_dim) -> The Game Vectors played
-# rewards: Array of shape (N, 1) -> +1/-1 values
-# terminals: Array of shape (N, 1) -> 1 if session ended, else 0
+sys.path.insert(0, str(Path(__file__).parent.parent))
 
-dataset = d3rlpy.dataset.MDPDataset(
-    observations=user_state_vectors,
-    actions=game_vectors_played,
-    rewards=rewards,
-    terminals=terminals,
-)
+from recommender.mdp_storage import CompactMDPDataset
+from recommender.d3rlpy_adapter import D3RLPyAdapter
+from recommender.game_features import GameFeatures
+
+# 1. Load your Data
+# The transitions written by mdp_generation.py are game indices, the minibatches are built from the feature matrix:
+# observations: (N, vector_dim) -> The User States
+# actions: (N, vector_dim) -> The Game Vectors played
+# rewards: (N, 1) -> +1/-1 values
+# terminals: (N, 1) -> 1 if session ended, else 0
+game_features = GameFeatures.load("./data/game_features")  # the last feature matrix built, memory mapped
+dataset = CompactMDPDataset("./data/mdp_dataset", game_features.matrix)
+adapter = D3RLPyAdapter(dataset, gamma=0)
 
 # 2. Train the Offline RL Algorithm (e.g., CQL or IQL)
 # We use 'continuous' because we are recommending Vectors, not IDs
+# The min_max action scaler uses the action range saved in the manifest
 cql = d3rlpy.algos.CQL(
-    action_scaler="min_max",
+    action_scaler=adapter.action_scaler(),
     gamma=0,
     actor_learning_rate=1e-4,
     critic_learning_rate=3e-4,
-    use_gpu=True,
+    use_gpu=False,  # scripts/train_policy.py trains on CPU with prefetching, checkpoints and the TorchScript export
 )
-cql.fit(dataset, n_steps=10000)
+adapter.fit(cql, n_steps=10000)
 
 # 3. Save Model